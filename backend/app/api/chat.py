@@ -5,6 +5,7 @@
 from fastapi import APIRouter
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
+import logging
 import re
 import sys
 from pathlib import Path
@@ -18,7 +19,8 @@ from backend.app.services.llm_service import get_llm_service
 from backend.app.services.question_service import get_question_service
 from backend.app.models.conversation import (
     get_conversation_manager,
-    ConversationStateEnum
+    ConversationStateEnum,
+    ChatMessage,
 )
 from backend.app.utils.hierarchy_util import HierarchyUtil
 from backend.app.utils.variant_util import variant_key_for_query
@@ -26,6 +28,9 @@ from backend.app.utils.option_merge_util import merge_similar_options
 
 router = APIRouter()
 
+# 请求处理的调试跟踪日志（默认不输出；排查对话流程时把该 logger 调到 DEBUG 级别）
+logger = logging.getLogger(__name__)
+
 def _filter_conditions_text(filter_history: List[Dict[str, Any]]) -> str:
     """
     将 filter_history 归一成可读的“当前筛选条件”文本。
@@ -151,12 +156,6 @@ def _dedup_exact_filename_options(raw_options: List[Dict[str, Any]]) -> List[Dic
     return out
 
 
-class ChatMessage(BaseModel):
-    """聊天消息"""
-    role: str = Field(..., description="消息角色：user 或 assistant")
-    content: str = Field(..., description="消息内容")
-
-
 class ChatRequest(BaseModel):
     """聊天请求"""
     message: str
@@ -175,7 +174,9 @@ class ChatResponse(BaseModel):
     session_id: Optional[str] = "default"  # 会话ID
 
 
-@router.post("/chat", response_model=ChatResponse)
+# 各分支返回的都是已构造（已校验）的 ChatResponse，关闭路由层的 response_model 二次校验；
+# responses 仍声明 ChatResponse，保持 OpenAPI 文档不变
+@router.post("/chat", response_model=None, responses={200: {"model": ChatResponse}})
 async def chat(request: ChatRequest):
     """
     聊天接口
@@ -183,6 +184,19 @@ async def chat(request: ChatRequest):
     集成意图理解和对话管理
     支持多轮对话和选择题引导
     """
+    session_id = request.session_id or "default"
+    conversation_manager = get_conversation_manager()
+    # 同一会话的请求逐个处理：前一轮读改写完并写回后，下一轮才读取会话状态
+    async with conversation_manager.session_lock(session_id):
+        try:
+            return await _handle_chat(request)
+        finally:
+            # 无论从哪个分支返回，都把本轮的会话状态写回会话存储（内存存储下为空操作）
+            conversation_manager.save_state(session_id)
+
+
+async def _handle_chat(request: ChatRequest):
+    """处理一轮聊天请求（会话状态在 chat() 中统一写回）"""
     # 确保 re 模块可用（显式引用全局变量）
     _ = re
     
@@ -194,7 +208,7 @@ async def chat(request: ChatRequest):
     
     # 获取或创建对话状态
     session_id = request.session_id or "default"
-    conv_state = conversation_manager.get_or_create_state(session_id)
+    conv_state = await conversation_manager.get_or_create_state_async(session_id)
     
     # 获取用户查询
     query = request.message.strip()
@@ -331,7 +345,7 @@ async def chat(request: ChatRequest):
             meta = conv_state.relax_meta or {}
             used = meta.get("used_keywords") or []
             try:
-                print(f"[DEBUG] confirm=YES, relaxed used_keywords: {used}")
+                logger.debug("confirm=YES, relaxed used_keywords: %s", used)
             except Exception:
                 pass
 
@@ -358,24 +372,21 @@ async def chat(request: ChatRequest):
             return ChatResponse(message=msg, session_id=session_id)
     
     # 检测用户是否在回答“选项标签”（支持 A..Z, AA.. 等动态扩展标签）
+    # 按标签建一次索引，同时用于“是否在选标签”的判断和选项查找（同一标签出现多次时取第一个）
     user_input_upper = (query or "").upper().strip()
-    is_option_selection = False
+    selected_option = None
     if conv_state.state == ConversationStateEnum.NEEDS_CHOICE and conv_state.current_options:
-        labels = {str(o.get("label", "")).upper().strip() for o in conv_state.current_options if o.get("label")}
-        if user_input_upper in labels:
-            is_option_selection = True
+        options_by_label = {}
+        for o in conv_state.current_options:
+            if o.get("label"):
+                options_by_label.setdefault(str(o["label"]).upper().strip(), o)
+        selected_option = options_by_label.get(user_input_upper)
+    is_option_selection = selected_option is not None
     
     # 如果当前状态是等待选择，且用户输入是选项，处理选择
     if conv_state.state == ConversationStateEnum.NEEDS_CHOICE and is_option_selection:
         # 解析用户选择
         if conv_state.current_options:
-            # 找到对应的选项
-            selected_option = None
-            for option in conv_state.current_options:
-                if option.get('label') == user_input_upper:
-                    selected_option = option
-                    break
-            
             if selected_option:
                 # 基于选择筛选结果
                 option_type = selected_option.get('type')
@@ -525,7 +536,10 @@ async def chat(request: ChatRequest):
                 )
                 # 关键保护：筛选后结果不能比筛选前更多（否则说明选项count/ids或筛选逻辑不一致）
                 if len(filtered_results) > pre_filter_total:
-                    print(f"[WARN] selection increased results: {pre_filter_total} -> {len(filtered_results)}; option={option_type}:{option_value}")
+                    logger.warning(
+                        "selection increased results: %d -> %d; option=%s:%s",
+                        pre_filter_total, len(filtered_results), option_type, option_value,
+                    )
                 
                 # 如果筛选后结果≤5个，直接返回结果
                 max_results = request.max_results or 5
@@ -812,7 +826,10 @@ async def chat(request: ChatRequest):
             query = (conv_state.current_query or "").strip() or (option_value or "").strip() or query
 
             if len(filtered_results) > pre_filter_total:
-                print(f"[WARN] selection increased results(text-match): {pre_filter_total} -> {len(filtered_results)}; option={option_type}:{option_value}")
+                logger.warning(
+                    "selection increased results(text-match): %d -> %d; option=%s:%s",
+                    pre_filter_total, len(filtered_results), option_type, option_value,
+                )
     
     # 执行意图理解（确认态“需要”会跳过）
     if "skip_search" not in locals():
@@ -821,10 +838,15 @@ async def chat(request: ChatRequest):
         intent_result = None
     if not skip_search:
         try:
-            intent_result = llm_service.parse_intent(query)
+            # 优先使用异步接口（LLM 请求不阻塞事件循环）；没有异步接口的实现退回同步调用
+            parse_intent_async = getattr(llm_service, "parse_intent_async", None)
+            if parse_intent_async is not None:
+                intent_result = await parse_intent_async(query)
+            else:
+                intent_result = llm_service.parse_intent(query)
             conv_state.intent_result = intent_result
         except Exception as e:
-            print(f"⚠️ 意图理解失败: {str(e)}，使用关键词搜索")
+            logger.warning("⚠️ 意图理解失败: %s，使用关键词搜索", e)
             # 意图理解失败时，继续使用关键词搜索
 
     # 关键修复：
@@ -1065,7 +1087,7 @@ async def chat(request: ChatRequest):
             session_id=session_id,
         )
     
-    print(f"🔍 搜索结果: {total_found} 个，max_results: {max_results}")
+    logger.debug("🔍 搜索结果: %d 个，max_results: %d", total_found, max_results)
     
     # 对“针脚/针角”这类查询，即使结果较少，也强制走选择题（避免直接吐 5 条）
     if (not force_choose) and re.search(r"(针脚|针角)", conv_state.current_query or "") and total_found >= 2:
@@ -1074,7 +1096,7 @@ async def chat(request: ChatRequest):
     # 如果结果超过5个，或强制选择，尝试生成选择题引导用户缩小范围
     # 重要：当结果>5个时，必须生成选择题，不能直接返回结果
     if force_choose or total_found > max_results:
-        print(f"✅ 结果数({total_found}) > max_results({max_results})，进入选择题生成逻辑")
+        logger.debug("✅ 结果数(%d) > max_results(%d)，进入选择题生成逻辑", total_found, max_results)
         
         # 如果意图理解识别到了品牌和类型，将它们添加到筛选历史（用于指导选择题生成）
         # 注意：这里不实际筛选结果，只是记录用户意图，以便生成合适的选择题
@@ -1178,10 +1200,10 @@ async def chat(request: ChatRequest):
                 use_llm=True
             )
         
-        print(f"🔍 question_data: {question_data is not None}")
+        logger.debug("🔍 question_data: %s", question_data is not None)
         
         if question_data:
-            print(f"✅ 成功生成选择题，选项数: {len(question_data.get('options', []))}")
+            logger.debug("✅ 成功生成选择题，选项数: %d", len(question_data.get('options', [])))
             # 关键修复：若本轮只有 1 个选项（无信息增量），直接展开到文件级列表，
             # 避免出现“只有 A 还要再点一次”的体验。
             opts = question_data.get("options") or []
@@ -1242,7 +1264,7 @@ async def chat(request: ChatRequest):
         else:
             # 无法生成选择题，尝试从层级路径中提取更细粒度的选项
             # 尝试提取层级路径中的不同层级作为选项
-            print(f"⚠️ generate_question返回None，尝试fallback逻辑，结果数: {total_found}")
+            logger.debug("⚠️ generate_question返回None，尝试fallback逻辑，结果数: %d", total_found)
             
             # 尝试提取不同层级的选项
             all_levels = HierarchyUtil.get_all_levels([r.diagram for r in scored_results])
@@ -1257,22 +1279,22 @@ async def chat(request: ChatRequest):
                 brand_model_options = question_service._extract_options_from_hierarchy(
                     scored_results, max_options
                 )
-                print(f"⚠️ 从层级路径提取品牌+型号组合: {len(brand_model_options) if brand_model_options else 0} 个选项")
+                logger.debug("⚠️ 从层级路径提取品牌+型号组合: %d 个选项", len(brand_model_options) if brand_model_options else 0)
                 if brand_model_options and len(brand_model_options) >= 2:
                     best_option_type = "brand_model"
                     best_options = brand_model_options
             except Exception as e:
-                print(f"⚠️ 提取品牌+型号组合失败: {str(e)}")
+                logger.warning("⚠️ 提取品牌+型号组合失败: %s", e)
             
             # 如果品牌+型号组合失败，尝试其他类型
             if not best_options:
-                print(f"⚠️ 尝试其他类型选项，已排除类型: {excluded_types}")
+                logger.debug("⚠️ 尝试其他类型选项，已排除类型: %s", excluded_types)
                 for opt_type, level_set in [("brand", all_levels.get("brands", set())),
                                             ("model", all_levels.get("models", set())),
                                             ("type", all_levels.get("types", set())),
                                             ("category", all_levels.get("categories", set()))]:
                     if opt_type not in (excluded_types or []):
-                        print(f"⚠️ 检查类型 {opt_type}，选项数: {len(level_set)}")
+                        logger.debug("⚠️ 检查类型 %s，选项数: %d", opt_type, len(level_set))
                         if len(level_set) >= 2:
                             # 转换为选项格式（携带精确 ids，后续筛选才能严格收敛）
                             options = []
@@ -1291,7 +1313,7 @@ async def chat(request: ChatRequest):
                             # drop no-op buckets (ids == all_ids)
                             options = _filter_out_noop_options(options, {r.diagram.id for r in scored_results})
                             options.sort(key=lambda x: x["count"], reverse=True)
-                            print(f"⚠️ 类型 {opt_type} 生成选项数: {len(options)}")
+                            logger.debug("⚠️ 类型 %s 生成选项数: %d", opt_type, len(options))
                             if len(options) >= 2:
                                 best_option_type = opt_type
                                 best_options = options[:max_options]
@@ -1306,15 +1328,20 @@ async def chat(request: ChatRequest):
                 else:
                     # 生成问题（使用LLM或默认模板）
                     try:
-                        # 使用已经在文件顶部导入的 llm_service
-                        question_text = llm_service.generate_question_text(
+                        # 使用已经在文件顶部导入的 llm_service（优先异步接口，不阻塞事件循环）
+                        question_kwargs = dict(
                             option_type=best_option_type,
                             options=best_options,
                             total_count=total_found,
                             context=context
                         )
+                        generate_async = getattr(llm_service, "generate_question_text_async", None)
+                        if generate_async is not None:
+                            question_text = await generate_async(**question_kwargs)
+                        else:
+                            question_text = llm_service.generate_question_text(**question_kwargs)
                     except Exception as e:
-                        print(f"⚠️ LLM生成问题失败: {str(e)}，使用默认模板")
+                        logger.warning("⚠️ LLM生成问题失败: %s，使用默认模板", e)
                         question_text = question_service._generate_question_text(
                             best_option_type, total_found, context
                         )
@@ -1369,7 +1396,7 @@ async def chat(request: ChatRequest):
             # 如果仍然无法生成选择题，强制尝试从层级路径中提取选项
             # 这是最后的fallback，必须生成选择题
             if not best_options:
-                print(f"⚠️ 尝试最后的fallback：从层级路径中提取任意有区分度的选项")
+                logger.debug("⚠️ 尝试最后的fallback：从层级路径中提取任意有区分度的选项")
                 try:
                     # 尝试从层级路径中提取任意有区分度的选项
                     hierarchy_options: Dict[str, set] = {}
@@ -1385,8 +1412,7 @@ async def chat(request: ChatRequest):
                                         break
                             
                             if brand_pos != -1 and brand_pos + 1 < len(diagram.hierarchy_path):
-                                level_value = diagram.hierarchy_path[brand_pos + 1]
-                                level_value_clean = level_value.replace('*', '').strip()
+                                level_value_clean = diagram.clean_hierarchy[brand_pos + 1]
                                 if level_value_clean and level_value_clean != diagram.brand:
                                     option_name = f"{diagram.brand} {level_value_clean}"
                                     hierarchy_options.setdefault(option_name, set()).add(diagram.id)
@@ -1398,7 +1424,7 @@ async def chat(request: ChatRequest):
                                         hierarchy_options.setdefault(level, set()).add(diagram.id)
                                         break
                     
-                    print(f"⚠️ 从层级路径提取到 {len(hierarchy_options)} 个选项")
+                    logger.debug("⚠️ 从层级路径提取到 %d 个选项", len(hierarchy_options))
                     
                     if len(hierarchy_options) >= 2:
                         # 转换为选项格式
@@ -1451,11 +1477,11 @@ async def chat(request: ChatRequest):
                             session_id=session_id
                         )
                 except Exception as e:
-                    print(f"⚠️ Fallback选项生成失败: {str(e)}")
+                    logger.warning("⚠️ Fallback选项生成失败: %s", e)
             
             # 如果所有方法都失败，强制生成选择题（即使选项不够理想）
             if not best_options:
-                print(f"⚠️ 所有方法都失败，强制生成选择题")
+                logger.debug("⚠️ 所有方法都失败，强制生成选择题")
                 # 强制从层级路径中提取选项，即使只有部分区分度
                 try:
                     hierarchy_options: Dict[str, set] = {}
@@ -1579,7 +1605,7 @@ async def chat(request: ChatRequest):
                         )
                     else:
                         # 如果连层级路径都提取不到足够的选项，至少基于文件名生成选项
-                        print(f"⚠️ 层级路径提取失败，尝试基于文件名生成选项")
+                        logger.debug("⚠️ 层级路径提取失败，尝试基于文件名生成选项")
                         file_name_options: Dict[str, set] = {}
                         for result in scored_results[:max_results * 2]:  # 检查更多结果以找到区分度
                             diagram = result.diagram
@@ -1647,10 +1673,10 @@ async def chat(request: ChatRequest):
                                 session_id=session_id
                             )
                 except Exception as e:
-                    print(f"⚠️ 强制生成选择题失败: {str(e)}")
+                    logger.warning("⚠️ 强制生成选择题失败: %s", e)
                 
                 # 如果所有强制生成方法都失败，至少生成一个基于结果数量的选择题
-                print(f"⚠️ 所有强制生成方法都失败，生成基于结果的分组选择题")
+                logger.debug("⚠️ 所有强制生成方法都失败，生成基于结果的分组选择题")
                 # 将结果分成几组，让用户选择
                 group_size = max(2, total_found // max_results)
                 groups = []
@@ -1724,7 +1750,7 @@ async def chat(request: ChatRequest):
                 )
     else:
         # 结果≤5个，直接返回所有结果
-        print(f"✅ 结果数({total_found}) <= max_results({max_results})，直接返回结果")
+        logger.debug("✅ 结果数(%d) <= max_results(%d)，直接返回结果", total_found, max_results)
         formatted_results = []
         for result in scored_results[:max_results]:
             formatted_results.append({
@@ -52,6 +52,21 @@ app.include_router(health.router, prefix="/api", tags=["健康检查"])
 app.include_router(chat.router, prefix="/api", tags=["聊天"])
 
 
+@app.on_event("startup")
+def preload_jieba():
+    """预加载 jieba 词典（避免首个请求触发懒加载；放在启动阶段而非模块导入时，导入服务模块保持轻量）"""
+    import jieba
+    jieba.initialize()
+
+
+@app.on_event("shutdown")
+async def close_http_clients():
+    """关闭共享的 LLM HTTP 连接池"""
+    from backend.app.services.llm_service import close_async_client, close_sync_client
+    close_sync_client()
+    await close_async_client()
+
+
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
     """全局异常处理"""
@@ -10,10 +10,6 @@ from backend.app.models.conversation import (
 )
 from backend.app.models.types import ScoredResult
 
-# 重建模型以解决前向引用问题
-# 必须在 CircuitDiagram 导入后，ScoredResult 导入后执行
-ScoredResult.model_rebuild()
-
 __all__ = [
     'CircuitDiagram',
     'IntentResult',
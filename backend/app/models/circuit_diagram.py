@@ -1,8 +1,9 @@
 """
 电路图数据模型
 """
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 from dataclasses import dataclass
+from functools import cached_property
 
 
 @dataclass
@@ -81,6 +82,19 @@ class CircuitDiagram:
             if len(self.hierarchy_path) > 4:
                 self.model = self.hierarchy_path[4]
     
+    @cached_property
+    def clean_hierarchy(self) -> Tuple[str, ...]:
+        """
+        去掉 '*' 与首尾空白后的层级路径（如 "天龙*系列" -> "天龙系列"）
+        首次访问时计算并缓存在实例上（hierarchy_path 加载后不再修改），多轮问题生成共用。
+        """
+        return tuple(level.replace('*', '').strip() for level in self.hierarchy_path)
+
+    @cached_property
+    def path_text(self) -> str:
+        """文件名与层级路径以空格拼接的文本（与 clean_hierarchy 一样首次访问时缓存）"""
+        return " ".join([self.file_name or ""] + (self.hierarchy_path or []))
+
     def to_dict(self) -> Dict:
         """转换为字典"""
         return {
@@ -2,14 +2,32 @@
 对话状态和对话历史模型
 """
 from __future__ import annotations
-from typing import List, Optional, Dict, Any, TYPE_CHECKING
+import asyncio
+import threading
+import weakref
+from time import time as _now
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import List, Optional, Dict, Any, Callable, Deque, Iterable, TYPE_CHECKING
 from enum import Enum
-from pydantic import BaseModel, Field, ConfigDict
+from dataclasses import dataclass, field
+from backend.app.models.intent import IntentResult
+from backend.app.utils import json_util
+from backend.app.utils.json_util import drop_none
 
 if TYPE_CHECKING:
     from backend.app.models.types import ScoredResult
 
 
+# 每个会话保留的最大消息数（超出后自动丢弃最早的消息）
+MAX_MESSAGE_HISTORY = 200
+
+
+def _new_history(messages: Iterable[ChatMessage] = ()) -> Deque[ChatMessage]:
+    """创建有界的消息历史队列"""
+    return deque(messages, maxlen=MAX_MESSAGE_HISTORY)
+
+
 class ConversationStateEnum(str, Enum):
     """对话状态枚举"""
     INITIAL = "initial"           # 初始状态
@@ -20,82 +38,58 @@ class ConversationStateEnum(str, Enum):
     COMPLETED = "completed"       # 已完成
 
 
-class ChatMessage(BaseModel):
+@dataclass(slots=True)
+class ChatMessage:
     """聊天消息"""
-    role: str = Field(..., description="消息角色：user 或 assistant")
-    content: str = Field(..., description="消息内容")
-    timestamp: Optional[float] = Field(None, description="时间戳")
-
-
-class ConversationState(BaseModel):
-    """对话状态"""
-    model_config = ConfigDict(
-        arbitrary_types_allowed=True,
-        # 排除 search_results 和 intent_result 字段的序列化
-        # 这些字段包含复杂对象，不需要在 API 响应中序列化
-    )
-
-    state: ConversationStateEnum = Field(
-        ConversationStateEnum.INITIAL,
-        description="当前对话状态"
-    )
-    current_query: str = Field("", description="当前查询")
-    # 使用 Any 类型避免前向引用问题
-    # 这个字段不参与序列化，只在内部使用
-    search_results: List[Any] = Field(
-        default_factory=list,
-        description="当前搜索结果",
-        exclude=True  # 排除序列化
-    )
-    current_options: List[Dict[str, Any]] = Field(
-        default_factory=list,
-        description="当前选择题选项"
-    )
-    option_type: Optional[str] = Field(None, description="当前选项类型（brand/model/type）")
-    filter_history: List[Dict[str, Any]] = Field(
-        default_factory=list,
-        description="筛选历史记录"
-    )
-    message_history: List[ChatMessage] = Field(
-        default_factory=list,
-        description="消息历史记录"
-    )
-    intent_result: Optional[Any] = Field(
-        None,
-        description="意图理解结果",
-        exclude=True  # 排除序列化
-    )
-    relax_meta: Optional[Dict[str, Any]] = Field(
-        None,
-        description="放宽搜索元信息（用于确认/调试）",
-        exclude=True,
-    )
+    role: str  # 消息角色：user 或 assistant
+    content: str  # 消息内容
+    timestamp: Optional[float] = None  # 时间戳
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典"""
+        return {"role": self.role, "content": self.content, "timestamp": self.timestamp}
+
+
+@dataclass(slots=True)
+class ConversationState:
+    """
+    对话状态
+
+    纯内部容器（每轮请求读写，不直接作为 API 响应返回），无需 pydantic 校验。
+    search_results / intent_result 等字段包含复杂对象，持久化方式见 to_store_dict()。
+    """
+    state: ConversationStateEnum = ConversationStateEnum.INITIAL  # 当前对话状态
+    current_query: str = ""  # 当前查询
+    search_results: List[Any] = field(default_factory=list)  # 当前搜索结果（List[ScoredResult]）
+    current_options: List[Dict[str, Any]] = field(default_factory=list)  # 当前选择题选项
+    option_type: Optional[str] = None  # 当前选项类型（brand/model/type）
+    filter_history: List[Dict[str, Any]] = field(default_factory=list)  # 筛选历史记录
+    message_history: Deque[ChatMessage] = field(default_factory=_new_history)  # 消息历史记录（有界）
+    intent_result: Optional[Any] = None  # 意图理解结果
+    relax_meta: Optional[Dict[str, Any]] = None  # 放宽搜索元信息（用于确认/调试）
     # 内部标记：当用户选中了“合并后的资料分组”（result option with ids>1）后，
     # 下一轮应展开到组内“具体文件列表”，避免再次被相似合并压回单个选项导致不收敛循环。
-    expand_result_group_next: bool = Field(
-        False,
-        description="下一轮是否展开资料分组到具体文件列表",
-        exclude=True,
-    )
-    state_history: List[Dict[str, Any]] = Field(
-        default_factory=list,
-        description="状态历史记录，用于支持返回上一步功能",
-        exclude=True,  # 不序列化给前端
-    )
+    expand_result_group_next: bool = False
+    # 状态历史记录，用于支持返回上一步功能（快照不含消息历史，只记录当时的累计消息数）
+    state_history: List[Dict[str, Any]] = field(default_factory=list)
+    # 累计追加的消息数（message_history 有界，长度不能反映新增条数；供会话存储增量写入和回退截断使用）
+    _message_seq: int = field(default=0, repr=False, compare=False)
     
     def add_message(self, role: str, content: str):
         """添加消息到历史记录"""
-        import time
         message = ChatMessage(
             role=role,
             content=content,
-            timestamp=time.time()
+            timestamp=_now()
         )
         self.message_history.append(message)
+        self._message_seq += 1
     
     def get_recent_messages(self, n: int = 10) -> List[ChatMessage]:
         """获取最近N条消息"""
-        return self.message_history[-n:] if n > 0 else self.message_history
+        if n <= 0:
+            return list(self.message_history)
+        return list(islice(self.message_history, max(0, len(self.message_history) - n), None))
     
     def clear(self):
         """清空对话状态"""
@@ -105,10 +99,11 @@ class ConversationState(BaseModel):
         self.current_options = []
         self.option_type = None
         self.filter_history = []
-        self.message_history = []
+        self.message_history = _new_history()
         self.intent_result = None
         self.relax_meta = None
         self.state_history = []
+        self._message_seq = 0
 
     def save_state_snapshot(self):
         """保存当前状态的快照，用于返回上一步功能"""
@@ -121,10 +116,11 @@ class ConversationState(BaseModel):
                 "current_options": self.current_options.copy() if self.current_options else [],
                 "option_type": self.option_type,
                 "filter_history": self.filter_history.copy() if self.filter_history else [],
-                "message_history": self.message_history.copy() if self.message_history else [],
+                # 消息只会在末尾追加：记录累计条数即可在回退时截断，不必每个快照复制整份历史
+                "message_count": self._message_seq,
                 "intent_result": self.intent_result,
                 "relax_meta": self.relax_meta.copy() if self.relax_meta else None,
-                "timestamp": __import__("time").time()
+                "timestamp": _now()
             }
             # 限制历史记录数量，避免内存占用过多
             if len(self.state_history) >= 10:
@@ -148,11 +144,22 @@ class ConversationState(BaseModel):
         self.current_options = last_snapshot["current_options"]
         self.option_type = last_snapshot["option_type"]
         self.filter_history = last_snapshot["filter_history"]
-        self.message_history = last_snapshot["message_history"]
+        self._truncate_messages(last_snapshot.get("message_count"))
         self.intent_result = last_snapshot["intent_result"]
         self.relax_meta = last_snapshot["relax_meta"]
 
         return True
+
+    def _truncate_messages(self, message_count: Optional[int]):
+        """丢弃累计消息数超过 message_count 之后追加的消息（替换为新队列，会话存储据此整体重写）"""
+        if message_count is None:
+            return
+        drop = self._message_seq - message_count
+        if drop <= 0:
+            return
+        keep = max(0, len(self.message_history) - drop)
+        self.message_history = _new_history(islice(self.message_history, keep))
+        self._message_seq = message_count
     
     def update_state(self, new_state: ConversationStateEnum):
         """更新对话状态"""
@@ -163,9 +170,101 @@ class ConversationState(BaseModel):
         self.filter_history.append({
             "type": filter_type,
             "value": filter_value,
-            "timestamp": __import__("time").time()
+            "timestamp": _now()
         })
 
+    def to_store_dict(self) -> Dict[str, Any]:
+        """
+        序列化为可持久化的字典（供 Redis 等共享会话存储使用）
+
+        与 API 序列化不同，这里需要保留 search_results/intent_result 等内部字段，
+        否则多进程部署下一轮请求会丢失候选集。search_results 只保存 (id, score)，
+        读取时再从数据加载器还原电路图对象。值为 None 的字段不写入（读取时按缺省值还原）。
+        """
+        return drop_none({
+            "state": self.state.value,
+            "current_query": self.current_query,
+            "search_results": _dump_results(self.search_results),
+            "current_options": self.current_options,
+            "option_type": self.option_type,
+            "filter_history": self.filter_history,
+            "message_history": [drop_none(m.to_dict()) for m in self.message_history],
+            "message_seq": self._message_seq,
+            "intent_result": _dump_intent(self.intent_result),
+            "relax_meta": self.relax_meta,
+            "expand_result_group_next": self.expand_result_group_next,
+            "state_history": [_dump_snapshot(snap) for snap in self.state_history],
+        })
+
+    @classmethod
+    def from_store_dict(
+        cls,
+        data: Dict[str, Any],
+        resolve_results: Callable[[List[Any]], List[Any]],
+    ) -> "ConversationState":
+        """
+        从 to_store_dict() 的结果还原对话状态
+
+        Args:
+            data: 持久化的字典
+            resolve_results: 把 [(id, score), ...] 还原为 ScoredResult 列表的函数
+        """
+        message_history = _new_history(ChatMessage(**m) for m in (data.get("message_history") or []))
+        return cls(
+            state=ConversationStateEnum(data.get("state") or ConversationStateEnum.INITIAL.value),
+            current_query=data.get("current_query") or "",
+            search_results=resolve_results(data.get("search_results") or []),
+            current_options=data.get("current_options") or [],
+            option_type=data.get("option_type"),
+            filter_history=data.get("filter_history") or [],
+            message_history=message_history,
+            intent_result=_load_intent(data.get("intent_result")),
+            relax_meta=data.get("relax_meta"),
+            expand_result_group_next=bool(data.get("expand_result_group_next")),
+            state_history=[
+                _load_snapshot(snap, resolve_results) for snap in (data.get("state_history") or [])
+            ],
+            _message_seq=data.get("message_seq", len(message_history)),
+        )
+
+
+def _dump_results(results: List[Any]) -> List[List[Any]]:
+    """搜索结果只保存 [id, score]，避免把整份电路图数据写入会话存储"""
+    return [[r.diagram.id, r.score] for r in (results or [])]
+
+
+def _dump_intent(intent_result: Any) -> Optional[Dict[str, Any]]:
+    if intent_result is None or not hasattr(intent_result, "to_dict"):
+        return None
+    return drop_none(intent_result.to_dict())
+
+
+def _load_intent(data: Optional[Dict[str, Any]]) -> Optional[IntentResult]:
+    if not data:
+        return None
+    return IntentResult.from_dict(data)
+
+
+def _dump_snapshot(snapshot: Dict[str, Any]) -> Dict[str, Any]:
+    out = dict(snapshot)
+    out["state"] = snapshot["state"].value
+    out["search_results"] = _dump_results(snapshot.get("search_results"))
+    out["intent_result"] = _dump_intent(snapshot.get("intent_result"))
+    return out
+
+
+def _load_snapshot(
+    data: Dict[str, Any],
+    resolve_results: Callable[[List[Any]], List[Any]],
+) -> Dict[str, Any]:
+    out = dict(data)
+    out["state"] = ConversationStateEnum(data.get("state"))
+    out["search_results"] = resolve_results(data.get("search_results") or [])
+    # 旧格式快照带整份消息历史：回退时不再使用，丢弃
+    out.pop("message_history", None)
+    out["intent_result"] = _load_intent(data.get("intent_result"))
+    return out
+
 
 class ConversationManager:
     """对话管理器（单例模式）"""
@@ -174,6 +273,17 @@ class ConversationManager:
         """初始化对话管理器"""
         # 使用字典存储不同会话的状态（key: session_id）
         self.conversations: Dict[str, ConversationState] = {}
+        # 每个会话一把协程锁：/api/chat 的请求都在事件循环线程上执行，线程锁挡不住同一会话的
+        # 两个请求在 await 处交错；按会话持有 asyncio.Lock，让同一会话的请求逐个处理，不同会话互不阻塞。
+        # 弱引用字典：没有请求持有或等待时锁自动回收，不随会话数增长
+        self._session_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    def session_lock(self, session_id: str = "default") -> asyncio.Lock:
+        """获取指定会话的请求处理锁（仅在事件循环线程中调用）"""
+        lock = self._session_locks.get(session_id)
+        if lock is None:
+            lock = self._session_locks[session_id] = asyncio.Lock()
+        return lock
     
     def get_or_create_state(self, session_id: str = "default") -> ConversationState:
         """
@@ -189,6 +299,10 @@ class ConversationManager:
             self.conversations[session_id] = ConversationState()
         return self.conversations[session_id]
     
+    async def get_or_create_state_async(self, session_id: str = "default") -> ConversationState:
+        """异步获取或创建对话状态（内存存储下直接返回，供异步路由统一调用）"""
+        return self.get_or_create_state(session_id)
+    
     def clear_conversation(self, session_id: str = "default"):
         """清空指定会话的对话状态"""
         if session_id in self.conversations:
@@ -199,15 +313,219 @@ class ConversationManager:
         if session_id in self.conversations:
             del self.conversations[session_id]
 
+    def save_state(self, session_id: str = "default"):
+        """
+        持久化指定会话的状态
+
+        内存存储下状态对象本身就是共享的，无需写回（空操作）；
+        共享存储（Redis）实现会在请求结束时把状态写回。
+        """
+        return None
+
+
+class RedisConversationManager(ConversationManager):
+    """
+    基于 Redis 的对话管理器
+
+    - 每个会话一个 hash（key: conv:{session_id}），字段 state 保存 JSON 序列化的状态
+    - 消息历史单独存为 Redis list（key: conv:{session_id}:msgs），新消息用 RPUSH 追加，
+      服务端原子执行，多个 worker 同时写同一会话时不会互相覆盖
+    - 每次写回都会刷新 TTL（滑动过期），孤儿会话由 Redis 自动淘汰
+    - 进程内缓存只覆盖单个请求：读取后放入缓存，save_state 写回后即移除，
+      下一个请求（可能落在其他 worker 上）总是从 Redis 读最新状态，不会拿旧状态覆盖新状态
+    """
+
+    KEY_PREFIX = "conv:"
+
+    def __init__(
+        self,
+        redis_url: str,
+        ttl_seconds: int = 3600,
+        local_cache_size: int = 1024,
+    ):
+        """
+        初始化 Redis 对话管理器
+
+        Args:
+            redis_url: Redis 连接地址（如 redis://localhost:6379/0）
+            ttl_seconds: 会话过期时间（秒）
+            local_cache_size: 进程内缓存的最大会话数（正常情况下请求结束即移除，这里只是兜底上限）
+        """
+        super().__init__()
+        import redis
+
+        self._pool = redis.ConnectionPool.from_url(redis_url)
+        self._redis = redis.Redis(connection_pool=self._pool)
+        # 启动时探测一次连接，失败则由调用方降级到进程内存储
+        self._redis.ping()
+        self._redis_url = redis_url
+        # 异步客户端（首次在异步路由中读取会话时创建）
+        self._aredis = None
+        self.ttl_seconds = ttl_seconds
+        self.local_cache_size = local_cache_size
+        # 进程内 LRU：session_id -> 处理中请求的 ConversationState（顺序即最近使用顺序）
+        self.conversations: "OrderedDict[str, ConversationState]" = OrderedDict()
+        self._diagram_index: Optional[Dict[int, Any]] = None
+        # session_id -> (已写入 Redis 的消息队列对象, 写入时的 _message_seq)
+        # clear()/undo 会替换 message_history 对象，此时需要整体重写消息 list
+        self._persisted_msgs: Dict[str, Any] = {}
+
+    def _key(self, session_id: str) -> str:
+        return f"{self.KEY_PREFIX}{session_id}"
+
+    def _msgs_key(self, session_id: str) -> str:
+        return f"{self.KEY_PREFIX}{session_id}:msgs"
+
+    def _resolve_results(self, pairs: List[Any]) -> List[Any]:
+        """把 [(id, score), ...] 还原为 ScoredResult 列表（找不到的 id 直接跳过）"""
+        if not pairs:
+            return []
+        from backend.app.models.types import ScoredResult
+        from backend.app.utils.data_loader import get_data_loader
+
+        if self._diagram_index is None:
+            self._diagram_index = {d.id: d for d in get_data_loader().get_all()}
+        results = []
+        for diagram_id, score in pairs:
+            diagram = self._diagram_index.get(diagram_id)
+            if diagram is not None:
+                results.append(ScoredResult(diagram=diagram, score=score))
+        return results
+
+    def _cache_put(self, session_id: str, state: ConversationState):
+        self.conversations[session_id] = state
+        self.conversations.move_to_end(session_id)
+        while len(self.conversations) > self.local_cache_size:
+            old_id, _ = self.conversations.popitem(last=False)
+            self._persisted_msgs.pop(old_id, None)
+
+    def _cache_drop(self, session_id: str):
+        self.conversations.pop(session_id, None)
+        self._persisted_msgs.pop(session_id, None)
+
+    def get_or_create_state(self, session_id: str = "default") -> ConversationState:
+        """获取或创建对话状态（同一请求内优先命中进程内缓存，其次读取 Redis）"""
+        return self._load_state(session_id)
+
+    async def get_or_create_state_async(self, session_id: str = "default") -> ConversationState:
+        """
+        异步获取或创建对话状态
+
+        会话状态（hash）与消息历史（list）两个读取并发发出，长历史会话不再串行等待两次往返。
+        """
+        state = self._cached_state(session_id)
+        if state is not None:
+            return state
+        if self._aredis is None:
+            import redis.asyncio as aioredis
+
+            self._aredis = aioredis.Redis.from_url(self._redis_url)
+        raw, raw_msgs = await asyncio.gather(
+            self._aredis.hget(self._key(session_id), "state"),
+            self._aredis.lrange(self._msgs_key(session_id), 0, -1),
+        )
+        return self._state_from_raw(session_id, raw, raw_msgs)
+
+    def _cached_state(self, session_id: str) -> Optional[ConversationState]:
+        """当前请求已读取过该会话时返回进程内的状态对象，否则返回 None"""
+        state = self.conversations.get(session_id)
+        if state is not None:
+            self.conversations.move_to_end(session_id)
+        return state
+
+    def _load_state(self, session_id: str) -> ConversationState:
+        state = self._cached_state(session_id)
+        if state is not None:
+            return state
+
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.hget(self._key(session_id), "state")
+        pipe.lrange(self._msgs_key(session_id), 0, -1)
+        raw, raw_msgs = pipe.execute()
+        return self._state_from_raw(session_id, raw, raw_msgs)
+
+    def _state_from_raw(self, session_id: str, raw: Any, raw_msgs: Any) -> ConversationState:
+        """由 Redis 读出的原始数据还原状态，并放入进程内缓存"""
+        if raw:
+            data = json_util.loads(raw)
+            data["message_history"] = [json_util.loads(m) for m in (raw_msgs or [])]
+            state = ConversationState.from_store_dict(data, self._resolve_results)
+        else:
+            state = ConversationState()
+        self._persisted_msgs[session_id] = (state.message_history, state._message_seq)
+        self._cache_put(session_id, state)
+        return state
+
+    def save_state(self, session_id: str = "default"):
+        """把会话状态写回 Redis 并刷新过期时间（请求结束时调用，写回后移除进程内缓存）"""
+        state = self.conversations.get(session_id)
+        if state is None:
+            return
+        key = self._key(session_id)
+        msgs_key = self._msgs_key(session_id)
+        data = state.to_store_dict()
+        messages = data.pop("message_history")
+        history = state.message_history
+        persisted_history, persisted_seq = self._persisted_msgs.get(session_id, (None, 0))
+        new_count = state._message_seq - persisted_seq
+
+        pipe = self._redis.pipeline()
+        pipe.hset(key, "state", json_util.dumps(data))
+        pipe.expire(key, self.ttl_seconds)
+        if persisted_history is history and 0 <= new_count <= len(messages):
+            # 只追加本轮新增的消息
+            pending = messages[len(messages) - new_count:]
+        else:
+            # 消息历史被清空/回退：整体重写
+            pipe.delete(msgs_key)
+            pending = messages
+        if pending:
+            pipe.rpush(msgs_key, *[json_util.dumps(m) for m in pending])
+            pipe.ltrim(msgs_key, -MAX_MESSAGE_HISTORY, -1)
+        pipe.expire(msgs_key, self.ttl_seconds)
+        pipe.execute()
+        self._cache_drop(session_id)
+
+    def clear_conversation(self, session_id: str = "default"):
+        """清空指定会话的对话状态"""
+        self.get_or_create_state(session_id).clear()
+        self.save_state(session_id)
+
+    def remove_conversation(self, session_id: str):
+        """删除指定会话"""
+        self._cache_drop(session_id)
+        self._redis.delete(self._key(session_id), self._msgs_key(session_id))
+
 
 # 全局对话管理器实例（单例）
 _conversation_manager_instance = None
+_conversation_manager_lock = threading.Lock()
+
+
+def _create_conversation_manager() -> ConversationManager:
+    """根据配置创建对话管理器：配置了 REDIS_URL 时使用 Redis，否则使用进程内字典"""
+    from config import Config
+
+    redis_url = getattr(Config, "REDIS_URL", "")
+    if redis_url:
+        try:
+            return RedisConversationManager(
+                redis_url,
+                ttl_seconds=getattr(Config, "SESSION_TTL_SECONDS", 3600),
+            )
+        except ImportError:
+            print("⚠️  已配置 REDIS_URL 但未安装 redis 包：会话将保存在进程内存中")
+        except Exception as e:
+            print(f"⚠️  Redis 连接失败（{e}）：会话将保存在进程内存中")
+    return ConversationManager()
 
 
 def get_conversation_manager() -> ConversationManager:
-    """获取对话管理器实例（单例）"""
+    """获取对话管理器实例（单例，多线程并发首次调用时只创建一个）"""
     global _conversation_manager_instance
     if _conversation_manager_instance is None:
-        _conversation_manager_instance = ConversationManager()
+        with _conversation_manager_lock:
+            if _conversation_manager_instance is None:
+                _conversation_manager_instance = _create_conversation_manager()
     return _conversation_manager_instance
 
@@ -1,38 +1,23 @@
 """
 对话状态管理模块
 """
-from enum import Enum
+from time import time as _now
 from typing import List, Dict, Optional, Any, TYPE_CHECKING
 from dataclasses import dataclass, field
 from datetime import datetime
 from backend.app.models.intent_result import IntentResult
+from backend.app.models.conversation import ChatMessage, ConversationStateEnum
 
 # 避免循环导入
 if TYPE_CHECKING:
-    from backend.app.services.search_service import ScoredResult
-
-
-class ConversationState(Enum):
-    """对话状态枚举"""
-    INITIAL_SEARCH = "initial_search"  # 初始搜索
-    WAITING_CHOICE = "waiting_choice"  # 等待用户选择
-    FILTERING = "filtering"  # 正在筛选
-    COMPLETED = "completed"  # 已完成
-
-
-@dataclass
-class ChatMessage:
-    """聊天消息"""
-    role: str  # "user" or "assistant"
-    content: str
-    timestamp: datetime = field(default_factory=datetime.now)
+    from backend.app.models.types import ScoredResult
 
 
 @dataclass
 class ConversationSession:
     """对话会话"""
     session_id: str
-    state: ConversationState = ConversationState.INITIAL_SEARCH
+    state: ConversationStateEnum = ConversationStateEnum.INITIAL
     history: List[ChatMessage] = field(default_factory=list)
     
     # 当前搜索条件
@@ -48,43 +33,55 @@ class ConversationSession:
     # 意图理解结果
     intent_result: Optional[IntentResult] = None
     
-    # 元数据
-    created_at: datetime = field(default_factory=datetime.now)
-    updated_at: datetime = field(default_factory=datetime.now)
+    # 元数据（Unix 时间戳，序列化时再转为 ISO 格式）
+    created_at: float = field(default_factory=_now)
+    updated_at: float = field(default_factory=_now)
+
+    # 最后一条 用户/助手 消息在 history 中的下标（-1 表示没有），避免每次倒序扫描
+    _last_user_idx: int = field(default=-1, init=False, repr=False)
+    _last_assistant_idx: int = field(default=-1, init=False, repr=False)
     
     def add_message(self, role: str, content: str):
         """添加消息到历史记录"""
-        self.history.append(ChatMessage(role=role, content=content))
-        self.updated_at = datetime.now()
+        message = ChatMessage(role=role, content=content, timestamp=_now())
+        self.history.append(message)
+        if role == "user":
+            self._last_user_idx = len(self.history) - 1
+        elif role == "assistant":
+            self._last_assistant_idx = len(self.history) - 1
+        self.updated_at = _now()
     
     def get_last_user_message(self) -> Optional[ChatMessage]:
         """获取最后一条用户消息"""
-        for msg in reversed(self.history):
-            if msg.role == "user":
-                return msg
-        return None
+        return self._last_message("user", self._last_user_idx)
     
     def get_last_assistant_message(self) -> Optional[ChatMessage]:
         """获取最后一条助手消息"""
+        return self._last_message("assistant", self._last_assistant_idx)
+
+    def _last_message(self, role: str, idx: int) -> Optional[ChatMessage]:
+        # 下标由 add_message 维护；history 被外部替换导致下标失效时退回倒序扫描
+        if 0 <= idx < len(self.history) and self.history[idx].role == role:
+            return self.history[idx]
         for msg in reversed(self.history):
-            if msg.role == "assistant":
+            if msg.role == role:
                 return msg
         return None
     
-    def update_state(self, new_state: ConversationState):
+    def update_state(self, new_state: ConversationStateEnum):
         """更新对话状态"""
         self.state = new_state
-        self.updated_at = datetime.now()
+        self.updated_at = _now()
     
     def update_search_conditions(self, **kwargs):
         """更新搜索条件"""
         self.search_conditions.update(kwargs)
-        self.updated_at = datetime.now()
+        self.updated_at = _now()
     
     def clear_search_conditions(self):
         """清空搜索条件"""
         self.search_conditions.clear()
-        self.updated_at = datetime.now()
+        self.updated_at = _now()
     
     def to_dict(self) -> Dict[str, Any]:
         """转换为字典"""
@@ -95,7 +92,7 @@ class ConversationSession:
                 {
                     "role": msg.role,
                     "content": msg.content,
-                    "timestamp": msg.timestamp.isoformat()
+                    "timestamp": datetime.fromtimestamp(msg.timestamp).isoformat() if msg.timestamp else None
                 }
                 for msg in self.history
             ],
@@ -104,8 +101,8 @@ class ConversationSession:
             "current_options": self.current_options,
             "current_option_type": self.current_option_type,
             "intent_result": self.intent_result.to_dict() if self.intent_result else None,
-            "created_at": self.created_at.isoformat(),
-            "updated_at": self.updated_at.isoformat()
+            "created_at": datetime.fromtimestamp(self.created_at).isoformat(),
+            "updated_at": datetime.fromtimestamp(self.updated_at).isoformat()
         }
 
 
@@ -155,10 +152,7 @@ def delete_session(session_id: str) -> bool:
     Returns:
         是否删除成功
     """
-    if session_id in _sessions:
-        del _sessions[session_id]
-        return True
-    return False
+    return _sessions.pop(session_id, None) is not None
 
 
 def list_sessions() -> List[str]:
@@ -1,11 +1,14 @@
 """
 意图结果数据模型
 """
-from typing import List, Optional, Dict, Any
-from dataclasses import dataclass
+from typing import List, Optional, Dict, Any, Tuple
+from dataclasses import dataclass, field
 
+# 参与 get_search_query() 拼接的字段（重新赋值时需清空缓存）
+_SEARCH_QUERY_FIELDS = frozenset({"brand", "model", "diagram_type", "keywords", "original_query"})
 
-@dataclass
+
+@dataclass(slots=True)
 class IntentResult:
     """用户意图解析结果"""
     # 提取的信息
@@ -13,17 +16,34 @@ class IntentResult:
     model: Optional[str] = None  # 型号（如：天龙KL、JH6）
     diagram_type: Optional[str] = None  # 电路图类型（如：仪表图、ECU电路图）
     vehicle_category: Optional[str] = None  # 车辆类别（如：工程机械、商用车）
-    keywords: List[str] = None  # 其他关键词列表
+    keywords: List[str] = field(default_factory=list)  # 其他关键词列表
     
     # 元数据
+    original_query: str = ""  # 原始查询
     confidence: float = 0.0  # 置信度（0-1）
-    raw_query: str = ""  # 原始查询
     normalized_query: str = ""  # 标准化后的查询
+
+    # get_search_query() 的缓存：(生成时的关键词数, 查询字符串)；相关字段被重新赋值时清空
+    _search_query_cache: Optional[Tuple[int, str]] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+
+    def __setattr__(self, name: str, value: Any):
+        if name in _SEARCH_QUERY_FIELDS:
+            object.__setattr__(self, "_search_query_cache", None)
+        object.__setattr__(self, name, value)
     
     def __post_init__(self):
         """初始化后处理"""
         if self.keywords is None:
             self.keywords = []
+        # 置信度限制在 0-1 之间
+        self.confidence = min(max(float(self.confidence or 0.0), 0.0), 1.0)
+
+    @property
+    def raw_query(self) -> str:
+        """原始查询（original_query 的别名）"""
+        return self.original_query
     
     def to_dict(self) -> Dict[str, Any]:
         """转换为字典"""
@@ -32,12 +52,26 @@ class IntentResult:
             "model": self.model,
             "diagram_type": self.diagram_type,
             "vehicle_category": self.vehicle_category,
-            "keywords": self.keywords,
+            "keywords": list(self.keywords),
+            "original_query": self.original_query,
             "confidence": self.confidence,
-            "raw_query": self.raw_query,
             "normalized_query": self.normalized_query
         }
     
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "IntentResult":
+        """从 to_dict() 的结果还原（缺省字段取默认值）"""
+        return cls(
+            brand=data.get("brand"),
+            model=data.get("model"),
+            diagram_type=data.get("diagram_type"),
+            vehicle_category=data.get("vehicle_category"),
+            keywords=list(data.get("keywords") or []),
+            original_query=data.get("original_query") or "",
+            confidence=data.get("confidence") or 0.0,
+            normalized_query=data.get("normalized_query") or "",
+        )
+    
     def has_brand(self) -> bool:
         """是否有品牌信息"""
         return self.brand is not None and self.brand.strip() != ""
@@ -49,10 +83,18 @@ class IntentResult:
     def has_type(self) -> bool:
         """是否有类型信息"""
         return self.diagram_type is not None and self.diagram_type.strip() != ""
+
+    def has_diagram_type(self) -> bool:
+        """是否包含电路图类型信息"""
+        return self.has_type()
     
     def has_category(self) -> bool:
         """是否有类别信息"""
         return self.vehicle_category is not None and self.vehicle_category.strip() != ""
+
+    def has_keywords(self) -> bool:
+        """是否有关键词"""
+        return len(self.keywords) > 0
     
     def is_empty(self) -> bool:
         """是否为空（没有任何提取的信息）"""
@@ -60,8 +102,28 @@ class IntentResult:
                    self.has_type() or self.has_category() or 
                    (self.keywords and len(self.keywords) > 0))
 
+    def get_search_query(self) -> str:
+        """获取用于搜索的查询字符串（结果缓存在实例上，同一轮对话内多次调用不重复拼接）"""
+        cached = self._search_query_cache
+        if cached is not None and cached[0] == len(self.keywords):
+            return cached[1]
+        query = self._build_search_query()
+        object.__setattr__(self, "_search_query_cache", (len(self.keywords), query))
+        return query
 
-
-
-
-
+    def _build_search_query(self) -> str:
+        parts = []
+        if self.brand:
+            parts.append(self.brand)
+        if self.model:
+            parts.append(self.model)
+        if self.diagram_type:
+            parts.append(self.diagram_type)
+        if self.keywords:
+            parts.extend(self.keywords)
+        
+        # 如果没有提取到任何信息，返回原始查询
+        if not parts:
+            return self.original_query
+        
+        return " ".join(parts)
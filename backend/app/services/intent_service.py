@@ -3,10 +3,18 @@
 使用LLM解析用户自然语言查询，提取品牌、型号、类型等信息
 """
 import json
+import threading
 from typing import Optional, List, Dict, Any
+import jieba
+from config import Config
 from backend.app.services.llm_service import get_llm_service
 from backend.app.models.intent_result import IntentResult
 from backend.app.utils.hierarchy_util import HierarchyUtil
+from backend.app.utils.keyword_matcher import KeywordMatcher
+from backend.app.utils.ttl_cache import TTLCache, make_cache_key, normalize_query_key
+
+# 关键词提取时过滤的停用词
+_STOPWORDS = frozenset({'的', '了', '是', '在', '和', '与', '或'})
 
 
 class IntentService:
@@ -49,6 +57,15 @@ class IntentService:
     def __init__(self):
         """初始化意图理解服务"""
         self.llm_service = get_llm_service()
+        # 意图结果缓存：相同查询（含重复提交/刷新）直接复用解析结果，不再重复调用 LLM
+        # 注意：线上 /api/chat 走 LLMService.parse_intent（自带 llm_intent 缓存），本服务只被
+        # backend/test_*.py 等排查脚本使用；两者的 Prompt 与 IntentResult 模型不同，缓存不能共用
+        self._intent_cache = TTLCache(
+            maxsize=Config.INTENT_CACHE_SIZE,
+            ttl=Config.INTENT_CACHE_TTL_SECONDS,
+            redis_url=Config.REDIS_URL,
+            namespace="intent",
+        )
     
     def parse_intent(self, user_query: str, use_llm: bool = True) -> IntentResult:
         """
@@ -62,21 +79,32 @@ class IntentService:
             意图结果对象
         """
         if not user_query or not user_query.strip():
-            return IntentResult(raw_query="", normalized_query="")
+            return IntentResult(original_query="", normalized_query="")
         
         user_query = user_query.strip()
         
+        cache_key = make_cache_key("llm" if use_llm else "rules", normalize_query_key(user_query))
+        cached = self._intent_cache.get(cache_key)
+        if cached is not None:
+            # 每次命中都还原出新对象，调用方修改结果不会影响缓存
+            intent_result = IntentResult.from_dict(cached)
+            intent_result.original_query = user_query
+            return intent_result
+        
         # 如果启用LLM，使用LLM解析
         if use_llm:
             try:
-                return self._parse_with_llm(user_query)
+                intent_result = self._parse_with_llm(user_query)
             except Exception as e:
                 print(f"LLM解析失败，降级为规则匹配：{e}")
-                # 降级为规则匹配
+                # 降级为规则匹配（降级结果不缓存，LLM 恢复后应重新解析）
                 return self._parse_with_rules(user_query)
         else:
             # 直接使用规则匹配
-            return self._parse_with_rules(user_query)
+            intent_result = self._parse_with_rules(user_query)
+        
+        self._intent_cache.set(cache_key, intent_result.to_dict())
+        return intent_result
     
     def _parse_with_llm(self, user_query: str) -> IntentResult:
         """
@@ -136,7 +164,7 @@ class IntentService:
                 vehicle_category=result_dict.get("vehicle_category"),
                 keywords=result_dict.get("keywords", []),
                 confidence=result_dict.get("confidence", 0.5),
-                raw_query=user_query,
+                original_query=user_query,
                 normalized_query=user_query
             )
             
@@ -159,43 +187,27 @@ class IntentService:
             意图结果对象
         """
         intent_result = IntentResult(
-            raw_query=user_query,
+            original_query=user_query,
             normalized_query=user_query,
             keywords=[],
             confidence=0.3  # 规则匹配的置信度较低
         )
         
-        query_lower = user_query.lower()
-        
-        # 提取品牌
-        for brand in self.VALID_BRANDS:
-            if brand in user_query:
-                intent_result.brand = brand
-                break
-        
-        # 提取类型
-        for diagram_type in self.VALID_DIAGRAM_TYPES:
-            if diagram_type in user_query:
-                intent_result.diagram_type = diagram_type
-                break
-        
-        # 提取车辆类别
-        for category in HierarchyUtil.COMMON_VEHICLE_CATEGORIES:
-            if category in user_query:
-                intent_result.vehicle_category = category
-                break
+        # 一次扫描同时提取品牌、类型、车辆类别（各类别按列表顺序取第一个命中）
+        hits = _get_rule_matcher().first_by_kind(user_query)
+        intent_result.brand = hits.get("brand")
+        intent_result.diagram_type = hits.get("diagram_type")
+        intent_result.vehicle_category = hits.get("vehicle_category")
         
         # 应用近义词映射
-        self._normalize_intent(intent_result)
+        self._normalize_intent(intent_result, hits=hits)
         
         # 提取其他关键词（使用jieba分词）
-        import jieba
-        words = jieba.cut(user_query)
-        keywords = [
-            word.strip() 
-            for word in words 
-            if len(word.strip()) > 1 and word.strip() not in ['的', '了', '是', '在', '和', '与', '或']
-        ]
+        keywords = []
+        for word in jieba.lcut(user_query):
+            word = word.strip()
+            if len(word) > 1 and word not in _STOPWORDS:
+                keywords.append(word)
         intent_result.keywords = keywords
         
         return intent_result
@@ -216,20 +228,22 @@ class IntentService:
 
 请以JSON格式返回解析结果。"""
     
-    def _normalize_intent(self, intent_result: IntentResult):
+    def _normalize_intent(self, intent_result: IntentResult, hits: Optional[Dict[str, str]] = None):
         """
         标准化意图结果（应用近义词映射、处理模糊表达）
         
         Args:
             intent_result: 意图结果对象（会被修改）
+            hits: 原始查询的关键词命中结果（已扫描过时传入，避免重复扫描）
         """
         # 首先检查原始查询中是否包含复合品牌（优先匹配）
-        raw_query = intent_result.raw_query
+        raw_query = intent_result.original_query
         if raw_query:
-            for compound_brand in self.COMPOUND_BRANDS:
-                if compound_brand in raw_query:
-                    intent_result.brand = compound_brand
-                    break
+            if hits is None:
+                hits = _get_rule_matcher().first_by_kind(raw_query)
+            compound_brand = hits.get("compound_brand")
+            if compound_brand:
+                intent_result.brand = compound_brand
         
         # 应用近义词映射
         if intent_result.brand:
@@ -252,36 +266,55 @@ class IntentService:
         # 处理模糊表达：如果只有型号没有品牌，尝试推断品牌
         if intent_result.model and not intent_result.brand:
             # 检查型号中是否包含品牌信息
-            for brand in self.VALID_BRANDS:
-                if brand in intent_result.model:
-                    intent_result.brand = brand
-                    break
+            brand = _get_rule_matcher().first_by_kind(intent_result.model).get("brand")
+            if brand:
+                intent_result.brand = brand
         
         # 构建标准化查询
-        normalized_parts = []
-        if intent_result.brand:
-            normalized_parts.append(intent_result.brand)
-        if intent_result.model:
-            normalized_parts.append(intent_result.model)
-        if intent_result.diagram_type:
-            normalized_parts.append(intent_result.diagram_type)
-        if intent_result.vehicle_category:
-            normalized_parts.append(intent_result.vehicle_category)
+        normalized_parts = [
+            part for part in (
+                intent_result.brand,
+                intent_result.model,
+                intent_result.diagram_type,
+                intent_result.vehicle_category,
+            )
+            if part
+        ]
         if intent_result.keywords:
             normalized_parts.extend(intent_result.keywords)
         
-        intent_result.normalized_query = " ".join(normalized_parts) if normalized_parts else intent_result.raw_query
+        intent_result.normalized_query = " ".join(normalized_parts) if normalized_parts else intent_result.original_query
+
+
+# 规则匹配用的关键词自动机（品牌/复合品牌/类型/车辆类别，首次使用时构建）
+_rule_matcher_instance = None
+
+
+def _get_rule_matcher() -> KeywordMatcher:
+    """获取规则匹配用的关键词自动机（单例）"""
+    global _rule_matcher_instance
+    if _rule_matcher_instance is None:
+        matcher = KeywordMatcher()
+        matcher.add_many(IntentService.VALID_BRANDS, "brand")
+        matcher.add_many(IntentService.COMPOUND_BRANDS, "compound_brand")
+        matcher.add_many(IntentService.VALID_DIAGRAM_TYPES, "diagram_type")
+        matcher.add_many(HierarchyUtil.COMMON_VEHICLE_CATEGORIES, "vehicle_category")
+        _rule_matcher_instance = matcher.build()
+    return _rule_matcher_instance
 
 
 # 全局意图理解服务实例（单例模式）
 _intent_service_instance = None
+_intent_service_lock = threading.Lock()
 
 
 def get_intent_service() -> IntentService:
-    """获取意图理解服务实例（单例）"""
+    """获取意图理解服务实例（单例，多线程并发首次调用时只创建一个）"""
     global _intent_service_instance
     if _intent_service_instance is None:
-        _intent_service_instance = IntentService()
+        with _intent_service_lock:
+            if _intent_service_instance is None:
+                _intent_service_instance = IntentService()
     return _intent_service_instance
 
 
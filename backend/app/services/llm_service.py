@@ -2,14 +2,240 @@
 LLM服务模块
 提供通义千问API调用和意图理解功能
 """
-import json
+import asyncio
+import importlib.util
+import logging
 import re
-from typing import Optional, Dict, Any, List
+import threading
+from contextlib import aclosing
+from itertools import chain
+from typing import Optional, Dict, Any, List, Tuple, AsyncIterator
 import dashscope
-from dashscope import Generation
+import httpx
 from config import Config
 from backend.app.models.intent import IntentResult
+from backend.app.utils import json_util
 from backend.app.utils.hierarchy_util import HierarchyUtil
+from backend.app.utils.keyword_matcher import KeywordMatcher
+from backend.app.utils.semantic_cache import SemanticCache
+from backend.app.utils.ttl_cache import TTLCache, make_cache_key, normalize_query_key
+
+logger = logging.getLogger(__name__)
+
+
+# 意图理解 Prompt 版本：修改下方 Prompt 文本后递增，使 Redis/磁盘中按旧 Prompt 缓存的结果自动失效
+INTENT_PROMPT_VERSION = 1
+
+# 意图理解 Prompt 的固定部分（只有用户查询是可变的，导入时构建一次）
+_INTENT_PROMPT_RULES = """你是一个智能车辆电路图资料导航助手。请分析用户的查询，提取以下信息：
+
+1. **品牌**：如三一、徐工、东风、解放、重汽、福田、红岩等
+   **重要**：如果用户说"东风天龙"、"东风天龙XXX"，brand字段应该设置为"东风天龙"（完整品牌），而不是"东风"
+   **重要**：如果用户说"天龙"，应该理解为"东风天龙"品牌
+   **重要**：复合品牌（如"东风天龙"、"一汽解放"）应该作为完整的brand返回，不要拆分
+
+2. **型号**：如天龙KL、JH6、杰狮、豪瀚、欧曼ETX、乘龙H7等
+   **注意**：如果用户说"东风天龙"，这是品牌，不是型号
+
+3. **电路图类型**：如仪表图、ECU电路图、整车电路图、保险丝图等
+
+4. **车辆类别**：如工程机械、商用车等
+
+5. **其他关键词**：查询中的其他重要信息
+
+"""
+_INTENT_PROMPT_FORMAT = """{
+    "brand": "品牌名称或null",
+    "model": "型号名称或null",
+    "diagram_type": "电路图类型或null",
+    "vehicle_category": "车辆类别或null",
+    "keywords": ["关键词1", "关键词2"],
+    "confidence": 0.0-1.0之间的数字
+}"""
+_INTENT_PROMPT_NOTES = """
+
+注意：
+- 如果信息不明确，返回null
+- 处理近义词（如"仪表图" = "仪表电路图"）
+- 处理模糊表达（如"天龙" = "东风天龙"）
+- keywords包含除品牌、型号、类型外的其他重要信息
+- 只返回JSON，不要有其他文字说明
+- **关键规则**：如果用户查询包含"东风天龙"，brand必须设置为"东风天龙"，不能只设置为"东风"
+"""
+_INTENT_PROMPT_HEAD = _INTENT_PROMPT_RULES + "用户查询："
+_INTENT_BATCH_PROMPT_TAIL = (
+    "\n\n请以JSON数组返回结果，数组长度与查询条数相同，第 i 个元素对应第 i 条查询，每个元素格式如下：\n"
+    + _INTENT_PROMPT_FORMAT
+    + _INTENT_PROMPT_NOTES
+)
+_INTENT_PROMPT_TAIL = "\n\n请以JSON格式返回结果，格式如下：\n" + _INTENT_PROMPT_FORMAT + _INTENT_PROMPT_NOTES
+
+# 输出 token 上限：生成时间/计费随上限增长，按实际输出长度收紧
+# - 意图 JSON 通常不超过 150 token
+# - 追问只有一句话
+_INTENT_MAX_TOKENS = 200
+_QUESTION_MAX_TOKENS = 80
+
+# 从 diagram_type 剩余部分提取的型号/代号（如 VGT/KL/C81）
+_CODE_TOKEN_RE = re.compile(r"[A-Z]{2,5}\d{0,4}")
+
+# 已知图类型（含近义词族根词）：COMMON_DIAGRAM_TYPES 为静态表，导入时去重并按长度降序一次性建好自动机，
+# priority 即排序后的下标，first_by_kind 返回的就是“最长优先”的命中（与逐个 in 判断的结果一致）
+_DIAGRAM_TYPE_MATCHER = KeywordMatcher()
+_DIAGRAM_TYPE_MATCHER.add_many(
+    sorted(dict.fromkeys(HierarchyUtil.COMMON_DIAGRAM_TYPES), key=len, reverse=True),
+    "diagram_type",
+)
+_DIAGRAM_TYPE_MATCHER.build()
+
+# 规则快速路径：查询只由“品牌 [+ 图类型]”组成时（如“东风天龙仪表图”），无需调用 LLM
+_FAST_PATH_MATCHER = KeywordMatcher()
+for _brand in dict.fromkeys(HierarchyUtil.COMPOUND_BRANDS + HierarchyUtil.COMMON_BRANDS):
+    _FAST_PATH_MATCHER.add(_brand, "brand")
+for _diagram_type in dict.fromkeys(HierarchyUtil.COMMON_DIAGRAM_TYPES):
+    _FAST_PATH_MATCHER.add(_diagram_type, "diagram_type")
+_FAST_PATH_MATCHER.build()
+# 去掉品牌/类型后允许剩下的字符（空白、“的”、标点）
+_FAST_PATH_FILLER_RE = re.compile(r"[\s的,，、。.!！?？]*")
+
+# 安装了 h2 时启用 HTTP/2（多路复用）；否则使用 HTTP/1.1 keep-alive 连接池
+_HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# 同步 HTTP 客户端（进程内共享连接池，首次同步调用时创建；同步调用可能来自多个线程）
+_sync_client: Optional[httpx.Client] = None
+_sync_client_lock = threading.Lock()
+
+# 异步 HTTP 客户端（进程内共享连接池，首次异步调用时创建）
+_async_client: Optional[httpx.AsyncClient] = None
+
+
+def _get_sync_client() -> httpx.Client:
+    """获取共享的同步 HTTP 客户端（保持长连接，避免每次请求重新建连/TLS 握手）"""
+    global _sync_client
+    if _sync_client is None:
+        with _sync_client_lock:
+            if _sync_client is None:
+                _sync_client = httpx.Client(
+                    timeout=httpx.Timeout(Config.LLM_TIMEOUT_SECONDS, connect=5.0),
+                    # 建连失败时重试（已发出的请求不重试，避免重复计费）
+                    transport=httpx.HTTPTransport(
+                        http2=_HTTP2_AVAILABLE,
+                        limits=httpx.Limits(max_keepalive_connections=16, max_connections=64),
+                        retries=2,
+                    ),
+                )
+    return _sync_client
+
+
+def close_sync_client():
+    """关闭共享的同步 HTTP 客户端（应用关闭时调用）"""
+    global _sync_client
+    with _sync_client_lock:
+        if _sync_client is not None:
+            _sync_client.close()
+            _sync_client = None
+
+
+def _get_async_client() -> httpx.AsyncClient:
+    """获取共享的异步 HTTP 客户端（保持长连接，避免每次请求重新建连/握手）"""
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(
+            http2=_HTTP2_AVAILABLE,
+            timeout=httpx.Timeout(Config.LLM_TIMEOUT_SECONDS, connect=5.0),
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+        )
+    return _async_client
+
+
+async def close_async_client():
+    """关闭共享的异步 HTTP 客户端（应用关闭时调用）"""
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+def _find_json_spans(text: str) -> List[Tuple[int, int]]:
+    """
+    找出文本中所有顶层的 {...} 片段（返回 [start, end) 下标）
+
+    单次线性扫描，用栈记录尚未闭合的 "{"；JSON 字符串内的括号和转义引号不计入深度。
+    未闭合的 "{"（如说明文字里的括号、被截断的流式输出）视为不存在：
+    直接包含在它里面的已闭合片段按顶层片段返回，不回头重扫。
+    """
+    spans: List[Tuple[int, int]] = []
+    # 栈元素：(左括号下标, 直接包含在其中、已闭合的片段)；左括号闭合时这些片段随之丢弃
+    stack: List[Tuple[int, List[Tuple[int, int]]]] = []
+    in_string = False
+    escaped = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == "{":
+            stack.append((i, []))
+        elif not stack:
+            continue
+        elif ch == "}":
+            start, _ = stack.pop()
+            (stack[-1][1] if stack else spans).append((start, i + 1))
+        elif ch == '"':
+            in_string = True
+    # 剩下的都是未闭合的左括号：其中直接包含的片段按位置先后补为顶层片段
+    for _, children in stack:
+        spans.extend(children)
+    return spans
+
+
+class _JsonObjectWatcher:
+    """
+    增量跟踪流式文本的括号深度，判断第一个顶层 {...} 是否已经闭合
+
+    与 _find_json_spans 规则一致：JSON 字符串内的括号和转义引号不计入深度。
+    """
+
+    __slots__ = ("depth", "in_string", "escaped")
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, chunk: str) -> bool:
+        """送入一段文本，有顶层对象在其中闭合时返回 True"""
+        closed = False
+        for ch in chunk:
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == "{":
+                self.depth += 1
+            elif self.depth == 0:
+                continue
+            elif ch == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    closed = True
+            elif ch == '"':
+                self.in_string = True
+        return closed
+
+
+def _null_to_none(value: Any) -> Optional[str]:
+    """LLM 返回的空值/"null" 字符串统一转为 None"""
+    if not value or value.lower() == "null":
+        return None
+    return value
 
 
 class LLMService:
@@ -27,7 +253,7 @@ class LLMService:
         if self.enabled:
             dashscope.api_key = self.api_key
         else:
-            print("⚠️  未配置 ALI_QWEN_API_KEY：将以无 LLM 模式运行（意图理解/问题生成会降级）")
+            logger.warning("⚠️  未配置 ALI_QWEN_API_KEY：将以无 LLM 模式运行（意图理解/问题生成会降级）")
         
         # 近义词映射表
         self.synonyms = {
@@ -48,6 +274,29 @@ class LLMService:
             "欧曼": "福田欧曼",
             "乘龙": "东风乘龙",
         }
+        # 品牌简称自动机：简称 -> 完整品牌名（多个命中时按上表顺序取第一个）
+        self._brand_matcher = KeywordMatcher()
+        for i, (short_name, full_name) in enumerate(self.brand_completion.items()):
+            self._brand_matcher.add(short_name, "brand", priority=i, payload=full_name)
+        self._brand_matcher.build()
+
+        # 意图理解结果缓存：相同查询直接复用上次的 LLM 解析结果（失败/降级结果不缓存）
+        self._intent_cache = TTLCache(
+            maxsize=Config.INTENT_CACHE_SIZE,
+            ttl=Config.INTENT_CACHE_TTL_SECONDS,
+            redis_url=Config.REDIS_URL,
+            namespace="llm_intent",
+            disk_path=Config.INTENT_CACHE_DIR,
+            disk_size_limit=Config.INTENT_CACHE_DISK_SIZE_MB << 20,
+        )
+        # 语义缓存（可选）：精确缓存未命中时，按句向量相似度复用相近问法的结果
+        self._semantic_cache: Optional[SemanticCache] = None
+        if Config.SEMANTIC_CACHE_ENABLED:
+            self._semantic_cache = SemanticCache(
+                Config.SEMANTIC_CACHE_MODEL,
+                threshold=Config.SEMANTIC_CACHE_THRESHOLD,
+                maxsize=Config.SEMANTIC_CACHE_SIZE,
+            )
     
     def call_llm(
         self,
@@ -74,21 +323,151 @@ class LLMService:
         if not self.enabled:
             raise Exception("ALI_QWEN_API_KEY 未设置，LLM 功能不可用")
         try:
-            response = Generation.call(
-                model=model or self.model,
-                prompt=prompt,
-                max_tokens=max_tokens or self.max_tokens,
-                temperature=temperature or self.temperature
+            # 直接请求 DashScope REST 接口，复用共享连接池（不再每次调用重新建连/握手）
+            response = _get_sync_client().post(
+                Config.DASHSCOPE_API_URL,
+                json=self._build_payload(prompt, model, max_tokens, temperature),
+                headers={"Authorization": f"Bearer {self.api_key}"},
             )
-            
-            if response.status_code == 200:
-                return response.output.text
+            data = json_util.loads(response.content)
+            if response.status_code == 200 and not data.get("code"):
+                return data["output"]["text"]
             else:
-                raise Exception(f"LLM API调用失败: {response.message}")
+                raise Exception(f"LLM API调用失败: {data.get('message') or response.status_code}")
         
         except Exception as e:
             raise Exception(f"LLM调用异常: {str(e)}")
+
+    def _build_payload(
+        self,
+        prompt: str,
+        model: Optional[str],
+        max_tokens: Optional[int],
+        temperature: Optional[float],
+        stream: bool = False
+    ) -> Dict[str, Any]:
+        """构建 DashScope 文本生成接口的请求体"""
+        parameters = {
+            "max_tokens": max_tokens or self.max_tokens,
+            "temperature": temperature or self.temperature,
+        }
+        if stream:
+            parameters["incremental_output"] = True
+        return {
+            "model": model or self.model,
+            "input": {"prompt": prompt},
+            "parameters": parameters,
+        }
+
+    async def stream_llm(
+        self,
+        prompt: str,
+        model: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None
+    ) -> AsyncIterator[str]:
+        """
+        异步流式调用LLM（直接请求 DashScope REST 接口，SSE 增量输出）
+        
+        Args:
+            prompt: 提示词
+            model: 模型名称（默认使用配置的模型）
+            max_tokens: 最大输出token数（默认使用配置值）
+            temperature: 温度参数（默认使用配置值）
+            
+        Yields:
+            LLM 返回的文本片段
+            
+        Raises:
+            Exception: API调用失败时抛出异常
+        """
+        if not self.enabled:
+            raise Exception("ALI_QWEN_API_KEY 未设置，LLM 功能不可用")
+        payload = self._build_payload(prompt, model, max_tokens, temperature, stream=True)
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Accept": "text/event-stream",
+            "X-DashScope-SSE": "enable",
+        }
+        async with _get_async_client().stream(
+            "POST", Config.DASHSCOPE_API_URL, json=payload, headers=headers
+        ) as response:
+            if response.status_code != 200:
+                body = (await response.aread()).decode("utf-8", errors="replace")
+                raise Exception(f"LLM API调用失败: HTTP {response.status_code} {body[:200]}")
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = json_util.loads(line[5:])
+                if data.get("code"):
+                    raise Exception(f"LLM API调用失败: {data.get('message')}")
+                chunk = (data.get("output") or {}).get("text") or ""
+                if chunk:
+                    yield chunk
+
+    async def call_llm_async(
+        self,
+        prompt: str,
+        model: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None
+    ) -> str:
+        """
+        异步调用LLM API（不阻塞事件循环，参数同 call_llm）
+        
+        Returns:
+            LLM返回的文本
+            
+        Raises:
+            Exception: API调用失败时抛出异常
+        """
+        try:
+            chunks = []
+            async for chunk in self.stream_llm(prompt, model, max_tokens, temperature):
+                chunks.append(chunk)
+            return "".join(chunks)
+        except Exception as e:
+            raise Exception(f"LLM调用异常: {str(e)}")
     
+    async def call_llm_json_async(
+        self,
+        prompt: str,
+        model: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None
+    ) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """
+        异步调用LLM，只需要返回中的 JSON 对象时使用（参数同 call_llm）
+
+        流式接收输出，第一个能解析的顶层 JSON 对象一闭合就关闭连接返回，
+        不再等待模型生成 JSON 之后的多余说明文字。
+
+        Returns:
+            (截至 JSON 对象闭合的文本, 解析出的 JSON 对象)；未找到 JSON 时为 (完整输出, None)。
+            判断闭合时已经解析过，调用方直接使用该对象，不必再解析一遍
+
+        Raises:
+            Exception: API调用失败时抛出异常
+        """
+        try:
+            chunks = []
+            watcher = _JsonObjectWatcher()
+            async with aclosing(self.stream_llm(prompt, model, max_tokens, temperature)) as stream:
+                async for chunk in stream:
+                    chunks.append(chunk)
+                    if not watcher.feed(chunk):
+                        continue
+                    text = "".join(chunks)
+                    try:
+                        data = self.parse_json_from_text(text)
+                    except ValueError:
+                        # 闭合的是说明文字里的括号，继续接收
+                        continue
+                    return text, data
+            return "".join(chunks), None
+        except Exception as e:
+            raise Exception(f"LLM调用异常: {str(e)}")
+
     def build_intent_prompt(self, user_query: str) -> str:
         """
         构建意图理解的Prompt
@@ -99,43 +478,7 @@ class LLMService:
         Returns:
             完整的Prompt文本
         """
-        prompt = f"""你是一个智能车辆电路图资料导航助手。请分析用户的查询，提取以下信息：
-
-1. **品牌**：如三一、徐工、东风、解放、重汽、福田、红岩等
-   **重要**：如果用户说"东风天龙"、"东风天龙XXX"，brand字段应该设置为"东风天龙"（完整品牌），而不是"东风"
-   **重要**：如果用户说"天龙"，应该理解为"东风天龙"品牌
-   **重要**：复合品牌（如"东风天龙"、"一汽解放"）应该作为完整的brand返回，不要拆分
-
-2. **型号**：如天龙KL、JH6、杰狮、豪瀚、欧曼ETX、乘龙H7等
-   **注意**：如果用户说"东风天龙"，这是品牌，不是型号
-
-3. **电路图类型**：如仪表图、ECU电路图、整车电路图、保险丝图等
-
-4. **车辆类别**：如工程机械、商用车等
-
-5. **其他关键词**：查询中的其他重要信息
-
-用户查询：{user_query}
-
-请以JSON格式返回结果，格式如下：
-{{
-    "brand": "品牌名称或null",
-    "model": "型号名称或null",
-    "diagram_type": "电路图类型或null",
-    "vehicle_category": "车辆类别或null",
-    "keywords": ["关键词1", "关键词2"],
-    "confidence": 0.0-1.0之间的数字
-}}
-
-注意：
-- 如果信息不明确，返回null
-- 处理近义词（如"仪表图" = "仪表电路图"）
-- 处理模糊表达（如"天龙" = "东风天龙"）
-- keywords包含除品牌、型号、类型外的其他重要信息
-- 只返回JSON，不要有其他文字说明
-- **关键规则**：如果用户查询包含"东风天龙"，brand必须设置为"东风天龙"，不能只设置为"东风"
-"""
-        return prompt
+        return f"{_INTENT_PROMPT_HEAD}{user_query}{_INTENT_PROMPT_TAIL}"
     
     def parse_json_from_text(self, text: str) -> Dict[str, Any]:
         """
@@ -150,23 +493,22 @@ class LLMService:
         Raises:
             ValueError: JSON解析失败
         """
-        # 尝试直接解析
-        try:
-            return json.loads(text)
-        except json.JSONDecodeError:
-            pass
-        
-        # 尝试提取JSON部分（使用正则表达式）
-        json_pattern = r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}'
-        matches = re.findall(json_pattern, text, re.DOTALL)
-        
-        if matches:
-            # 尝试解析最长的匹配
-            for match in sorted(matches, key=len, reverse=True):
-                try:
-                    return json.loads(match)
-                except json.JSONDecodeError:
-                    continue
+        # 尝试直接解析（LLM 通常直接返回干净的 JSON）；
+        # 开头不是 "{" 时（带前缀说明文字）必然失败，跳过这次注定抛异常的解析。
+        # orjson.JSONDecodeError 与 json.JSONDecodeError 都是 ValueError 的子类
+        if text.lstrip()[:1] == "{":
+            try:
+                return json_util.loads(text)
+            except ValueError:
+                pass
+        
+        # 提取文本中的 JSON 对象（单次扫描，按括号深度配对），优先尝试最长的
+        spans = sorted(_find_json_spans(text), key=lambda span: span[1] - span[0], reverse=True)
+        for start, end in spans:
+            try:
+                return json_util.loads(text[start:end])
+            except ValueError:
+                continue
         
         raise ValueError(f"无法从文本中提取有效的JSON: {text[:200]}")
     
@@ -180,13 +522,8 @@ class LLMService:
         Returns:
             应用近义词后的文本
         """
-        result = text
-        for key, synonyms in self.synonyms.items():
-            if key in result:
-                # 如果找到关键词，可以替换为第一个同义词，或者保持原样
-                # 这里保持原样，因为搜索时会处理同义词
-                pass
-        return result
+        # 命中近义词时保持原样（搜索时会处理同义词），因此无需逐个扫描近义词表
+        return text
     
     def complete_brand(self, brand: Optional[str]) -> Optional[str]:
         """
@@ -201,12 +538,9 @@ class LLMService:
         if not brand:
             return None
         
-        # 检查是否需要补全
-        for short_name, full_name in self.brand_completion.items():
-            if short_name in brand:
-                return full_name
-        
-        return brand
+        # 检查是否需要补全（包含简称时返回对应的完整品牌名）
+        full_name = self._brand_matcher.first_by_kind(brand).get("brand")
+        return full_name or brand
     
     def parse_intent(self, user_query: str) -> IntentResult:
         """
@@ -222,66 +556,289 @@ class LLMService:
             Exception: 解析失败时抛出异常
         """
         if not user_query or not user_query.strip():
-            return IntentResult(
-                original_query=user_query or "",
-                keywords=[user_query] if user_query else []
-            )
+            return self._empty_intent(user_query)
+        
+        fast = self._parse_intent_fast(user_query.strip())
+        if fast is not None:
+            return fast
+        cached = self._get_cached_intent(user_query.strip())
+        if cached is not None:
+            return cached
+        cached, query_vec = self._get_semantic_intent(user_query.strip())
+        if cached is not None:
+            return cached
         
         try:
             # 构建Prompt
             prompt = self.build_intent_prompt(user_query.strip())
             
             # 调用LLM
-            response_text = self.call_llm(prompt, max_tokens=500, temperature=0.3)
+            response_text = self.call_llm(prompt, max_tokens=_INTENT_MAX_TOKENS, temperature=0.3)
             
-            # 解析JSON
-            intent_dict = self.parse_json_from_text(response_text)
-            
-            # 应用品牌补全
-            brand = intent_dict.get("brand")
-            if brand:
-                brand = self.complete_brand(brand)
-            
-            # 应用近义词处理
-            diagram_type = intent_dict.get("diagram_type")
-            if diagram_type:
-                diagram_type = self.apply_synonyms(diagram_type)
-
-            # --- Guardrail: sanitize/validate diagram_type extracted by LLM ---
-            # Some LLM responses mistakenly put the whole query into diagram_type
-            # (e.g. "VGT线路图"). This later triggers hierarchy filtering and
-            # can incorrectly drop valid matches.
-            keywords_from_llm = intent_dict.get("keywords", []) or []
-            diagram_type, keywords_from_type = self._sanitize_diagram_type(diagram_type, user_query.strip())
-            # merge back to keywords
-            merged_keywords = []
-            for x in list(keywords_from_llm) + list(keywords_from_type):
-                s = (str(x) or "").strip()
-                if not s:
-                    continue
-                merged_keywords.append(s)
+            intent_result = self._intent_from_response(user_query.strip(), response_text)
+        
+        except Exception as e:
+            return self._fallback_intent(user_query.strip(), e)
+        
+        self._cache_intent(intent_result, query_vec)
+        return intent_result
+
+    async def parse_intent_async(self, user_query: str) -> IntentResult:
+        """
+        异步解析用户意图（LLM 调用不阻塞事件循环，结果同 parse_intent）
+        
+        Args:
+            user_query: 用户查询
             
-            # 构建IntentResult
-            intent_result = IntentResult(
-                brand=brand if brand and brand.lower() != "null" else None,
-                model=intent_dict.get("model") if intent_dict.get("model") and intent_dict.get("model").lower() != "null" else None,
-                diagram_type=diagram_type if diagram_type and diagram_type.lower() != "null" else None,
-                vehicle_category=intent_dict.get("vehicle_category") if intent_dict.get("vehicle_category") and intent_dict.get("vehicle_category").lower() != "null" else None,
-                keywords=merged_keywords,
-                original_query=user_query.strip(),
-                confidence=float(intent_dict.get("confidence", 0.5))
+        Returns:
+            意图理解结果
+        """
+        if not user_query or not user_query.strip():
+            return self._empty_intent(user_query)
+        
+        fast = self._parse_intent_fast(user_query.strip())
+        if fast is not None:
+            return fast
+        cached = self._get_cached_intent(user_query.strip())
+        if cached is not None:
+            return cached
+        query_vec = None
+        if self._semantic_cache is not None:
+            # 句向量编码是 CPU 计算，放到线程池，避免阻塞事件循环（未启用语义缓存时不必切换线程）
+            cached, query_vec = await asyncio.to_thread(self._get_semantic_intent, user_query.strip())
+            if cached is not None:
+                return cached
+        
+        try:
+            prompt = self.build_intent_prompt(user_query.strip())
+            response_text, intent_dict = await self.call_llm_json_async(
+                prompt, max_tokens=_INTENT_MAX_TOKENS, temperature=0.3
             )
-            
-            return intent_result
+            if intent_dict is None:
+                # 流中没有可解析的 JSON：按完整文本解析（失败时抛出 ValueError，走降级）
+                intent_dict = self.parse_json_from_text(response_text)
+            intent_result = self._intent_from_dict(user_query.strip(), intent_dict)
         
         except Exception as e:
-            # 如果LLM调用失败，返回基础结果（使用原始查询）
-            print(f"⚠️ 意图理解失败: {str(e)}，使用原始查询作为关键词")
-            return IntentResult(
-                original_query=user_query.strip(),
-                keywords=[user_query.strip()],
-                confidence=0.0
-            )
+            return self._fallback_intent(user_query.strip(), e)
+        
+        self._cache_intent(intent_result, query_vec)
+        return intent_result
+
+    def parse_intents(self, user_queries: List[str]) -> List[IntentResult]:
+        """
+        批量解析用户意图（如按访问日志预热缓存），结果与输入一一对应
+
+        规则快速路径/缓存命中的查询不再请求 LLM，其余查询合并到一次 LLM 调用中；
+        批量结果无法解析或条数对不上时，逐条回退到 parse_intent。
+
+        Args:
+            user_queries: 用户查询列表
+
+        Returns:
+            意图理解结果列表
+        """
+        results: List[Optional[IntentResult]] = []
+        pending: Dict[str, List[int]] = {}
+        for i, user_query in enumerate(user_queries):
+            query = (user_query or "").strip()
+            if not query:
+                result = self._empty_intent(user_query)
+            else:
+                result = self._parse_intent_fast(query) or self._get_cached_intent(query)
+            if result is None:
+                pending.setdefault(query, []).append(i)
+            results.append(result)
+
+        if not pending:
+            return results
+
+        queries = list(pending)
+        parsed: List[Optional[IntentResult]] = [None] * len(queries)
+        if self.enabled and len(queries) > 1:
+            try:
+                prompt = self.build_intent_batch_prompt(queries)
+                response_text = self.call_llm(
+                    prompt, max_tokens=_INTENT_MAX_TOKENS * len(queries), temperature=0.3
+                )
+                items = self._parse_json_array(response_text)
+                if len(items) == len(queries):
+                    for j, (query, item) in enumerate(zip(queries, items)):
+                        if isinstance(item, dict):
+                            parsed[j] = self._intent_from_dict(query, item)
+                            self._cache_intent(parsed[j])
+            except Exception as e:
+                logger.warning("⚠️ 批量意图理解失败: %s，逐条解析", e)
+
+        for query, result in zip(queries, parsed):
+            for n, i in enumerate(pending[query]):
+                if result is None:
+                    # 第一条逐条解析后写入缓存，重复的查询直接命中
+                    results[i] = self.parse_intent(query)
+                else:
+                    results[i] = result if n == 0 else IntentResult.from_dict(result.to_dict())
+        return results
+
+    def build_intent_batch_prompt(self, user_queries: List[str]) -> str:
+        """构建批量意图理解的Prompt（查询按编号列出，要求返回等长 JSON 数组）"""
+        numbered = "\n".join(f"{i}. {q}" for i, q in enumerate(user_queries, 1))
+        return f"{_INTENT_PROMPT_RULES}用户查询（共 {len(user_queries)} 条）：\n{numbered}{_INTENT_BATCH_PROMPT_TAIL}"
+
+    @staticmethod
+    def _parse_json_array(text: str) -> List[Any]:
+        """从 LLM 返回的文本中提取 JSON 数组（允许前后带说明文字）"""
+        start, end = text.find("["), text.rfind("]")
+        if start < 0 or end < start:
+            raise ValueError(f"无法从文本中提取JSON数组: {text[:200]}")
+        data = json_util.loads(text[start:end + 1])
+        if not isinstance(data, list):
+            raise ValueError(f"无法从文本中提取JSON数组: {text[:200]}")
+        return data
+
+    def _parse_intent_fast(self, user_query: str) -> Optional[IntentResult]:
+        """
+        规则快速路径：查询恰好是“品牌”或“品牌 + 图类型”时直接构造结果，不调用 LLM
+
+        同类命中只允许一个（嵌套命中如“东风天龙”中的“东风”按最长的算）；
+        去掉品牌/类型后还剩其他内容（型号、关键词等）时返回 None，交给 LLM 处理。
+        """
+        if not self.enabled:
+            return None
+        hits: Dict[str, List[Tuple[int, int, str]]] = {"brand": [], "diagram_type": []}
+        for end, kw, entries in _FAST_PATH_MATCHER.iter_matches(user_query):
+            for kind, _, payload in entries:
+                hits[kind].append((end + 1 - len(kw), end + 1, payload))
+        if not hits["brand"]:
+            return None
+
+        picked: Dict[str, Tuple[int, int, str]] = {}
+        for kind, spans in hits.items():
+            if not spans:
+                continue
+            longest = max(spans, key=lambda span: span[1] - span[0])
+            if any(start < longest[0] or end > longest[1] for start, end, _ in spans):
+                return None
+            picked[kind] = longest
+
+        # 品牌和类型的位置不能重叠，去掉两者后只能剩下空白/“的”/标点
+        spans = sorted(picked.values())
+        if len(spans) == 2 and spans[0][1] > spans[1][0]:
+            return None
+        rest, pos = [], 0
+        for start, end, _ in spans:
+            rest.append(user_query[pos:start])
+            pos = end
+        rest.append(user_query[pos:])
+        if not _FAST_PATH_FILLER_RE.fullmatch("".join(rest)):
+            return None
+
+        diagram_type = picked.get("diagram_type")
+        return IntentResult(
+            brand=self.complete_brand(picked["brand"][2]),
+            diagram_type=diagram_type[2] if diagram_type else None,
+            keywords=[],
+            original_query=user_query,
+            confidence=0.9
+        )
+
+    def _intent_cache_key(self, user_query: str) -> str:
+        # 模型/Prompt 不同解析结果可能不同，key 中包含模型名和 Prompt 版本
+        return make_cache_key(self.model, INTENT_PROMPT_VERSION, normalize_query_key(user_query))
+
+    def _get_cached_intent(self, user_query: str) -> Optional[IntentResult]:
+        """
+        读取缓存的意图结果（未启用 LLM 时不走缓存）
+
+        每次命中都还原出新对象，调用方（如 chat 中清空品牌）修改结果不会影响缓存。
+        """
+        if not self.enabled:
+            return None
+        data = self._intent_cache.get(self._intent_cache_key(user_query))
+        if data is None:
+            return None
+        intent_result = IntentResult.from_dict(data)
+        intent_result.original_query = user_query
+        return intent_result
+
+    def _get_semantic_intent(self, user_query: str) -> Tuple[Optional[IntentResult], Any]:
+        """
+        按语义相似度读取缓存的意图结果
+
+        Returns:
+            (命中的意图结果或 None, 查询向量)；查询向量在写入缓存时复用，避免重复编码
+        """
+        if not self.enabled or self._semantic_cache is None:
+            return None, None
+        data, query_vec = self._semantic_cache.lookup(user_query)
+        if data is None:
+            return None, query_vec
+        intent_result = IntentResult.from_dict(data)
+        intent_result.original_query = user_query
+        return intent_result, query_vec
+
+    def _cache_intent(self, intent_result: IntentResult, query_vec: Any = None):
+        if not self.enabled:
+            return
+        data = intent_result.to_dict()
+        self._intent_cache.set(self._intent_cache_key(intent_result.original_query), data)
+        if self._semantic_cache is not None:
+            self._semantic_cache.add(query_vec, data)
+
+    @staticmethod
+    def _empty_intent(user_query: Optional[str]) -> IntentResult:
+        return IntentResult(
+            original_query=user_query or "",
+            keywords=[user_query] if user_query else []
+        )
+
+    @staticmethod
+    def _fallback_intent(user_query: str, error: Exception) -> IntentResult:
+        # 如果LLM调用失败，返回基础结果（使用原始查询）
+        logger.warning("⚠️ 意图理解失败: %s，使用原始查询作为关键词", error)
+        return IntentResult(
+            original_query=user_query,
+            keywords=[user_query],
+            confidence=0.0
+        )
+
+    def _intent_from_response(self, user_query: str, response_text: str) -> IntentResult:
+        """把 LLM 返回的文本解析为 IntentResult"""
+        # 解析JSON
+        return self._intent_from_dict(user_query, self.parse_json_from_text(response_text))
+
+    def _intent_from_dict(self, user_query: str, intent_dict: Dict[str, Any]) -> IntentResult:
+        """把 LLM 返回的 JSON 对象转换为 IntentResult（品牌补全、类型校验、关键词合并）"""
+        # 应用品牌补全（"null" 先归一为 None，不再送去匹配）
+        brand = _null_to_none(intent_dict.get("brand"))
+        if brand:
+            brand = self.complete_brand(brand)
+        
+        # 应用近义词处理
+        diagram_type = intent_dict.get("diagram_type")
+        if diagram_type:
+            diagram_type = self.apply_synonyms(diagram_type)
+
+        # --- Guardrail: sanitize/validate diagram_type extracted by LLM ---
+        # Some LLM responses mistakenly put the whole query into diagram_type
+        # (e.g. "VGT线路图"). This later triggers hierarchy filtering and
+        # can incorrectly drop valid matches.
+        keywords_from_llm = intent_dict.get("keywords") or []
+        diagram_type, keywords_from_type = self._sanitize_diagram_type(diagram_type, user_query)
+        # merge back to keywords (single pass, no intermediate list copies)
+        merged_keywords = [
+            s for s in (str(x).strip() for x in chain(keywords_from_llm, keywords_from_type)) if s
+        ]
+        
+        # 构建IntentResult（IntentResult 为 dataclass，直接构造，无额外校验开销）
+        return IntentResult(
+            brand=brand,
+            model=_null_to_none(intent_dict.get("model")),
+            diagram_type=_null_to_none(diagram_type),
+            vehicle_category=_null_to_none(intent_dict.get("vehicle_category")),
+            keywords=merged_keywords,
+            original_query=user_query,
+            confidence=float(intent_dict.get("confidence", 0.5))
+        )
 
     @staticmethod
     def _sanitize_diagram_type(diagram_type: Optional[str], user_query: str) -> tuple[Optional[str], List[str]]:
@@ -299,29 +856,19 @@ class LLMService:
         if not dt_raw:
             return None, []
 
-        # Known types (include synonym-family roots; keep longest-first matching)
-        candidates = list(dict.fromkeys(HierarchyUtil.COMMON_DIAGRAM_TYPES))
-        candidates.sort(key=len, reverse=True)
-
         # If LLM returns the whole query or an overly long string, try to extract a known type.
+        # Known types are matched longest-first in a single automaton pass.
         extra_keywords: List[str] = []
-        best = None
-        for c in candidates:
-            if c and c in dt_raw:
-                best = c
-                break
+        best = _DIAGRAM_TYPE_MATCHER.first_by_kind(dt_raw).get("diagram_type")
         if best is None:
             # also try in user query (sometimes dt_raw is garbage encoding)
-            for c in candidates:
-                if c and c in (user_query or ""):
-                    best = c
-                    break
+            best = _DIAGRAM_TYPE_MATCHER.first_by_kind(user_query or "").get("diagram_type")
 
         if best is not None:
             # Anything besides the best type is treated as keyword
             rest = dt_raw.replace(best, " ").strip()
             # Extract short uppercase/number codes like VGT/KL/C81 from the remaining string
-            for m in re.findall(r"[A-Z]{2,5}\d{0,4}", (rest or "").upper()):
+            for m in _CODE_TOKEN_RE.findall((rest or "").upper()):
                 if m and m not in extra_keywords:
                     extra_keywords.append(m)
             return best, extra_keywords
@@ -416,7 +963,8 @@ class LLMService:
         option_type: str,
         options: list,
         total_count: int,
-        context: Optional[Dict[str, Any]] = None
+        context: Optional[Dict[str, Any]] = None,
+        fallback_on_error: bool = True
     ) -> str:
         """
         使用LLM生成问题文本
@@ -426,12 +974,13 @@ class LLMService:
             options: 选项列表，格式：[{"name": "选项名", "count": 数量}, ...]
             total_count: 总结果数
             context: 对话上下文（可选）
+            fallback_on_error: LLM 调用失败时是否返回默认模板（False 时抛出异常，由调用方处理）
             
         Returns:
             生成的问题文本
             
         Raises:
-            Exception: LLM调用失败时抛出异常
+            Exception: fallback_on_error=False 且 LLM 调用失败时抛出异常
         """
         if not options:
             return "请选择您需要的选项："
@@ -441,38 +990,72 @@ class LLMService:
             prompt = self.build_question_prompt(option_type, options, total_count, context)
             
             # 调用LLM（使用较低的温度，确保生成的问题稳定）
-            response_text = self.call_llm(prompt, max_tokens=100, temperature=0.5)
-            
-            # 清理响应文本（移除可能的引号、换行等）
-            question_text = response_text.strip()
-            # 移除可能的引号
-            if question_text.startswith('"') and question_text.endswith('"'):
-                question_text = question_text[1:-1]
-            if question_text.startswith("'") and question_text.endswith("'"):
-                question_text = question_text[1:-1]
-            
-            return question_text
+            response_text = self.call_llm(prompt, max_tokens=_QUESTION_MAX_TOKENS, temperature=0.5)
+            return self._clean_question_text(response_text)
         
         except Exception as e:
+            if not fallback_on_error:
+                raise
             # 如果LLM调用失败，使用默认模板
-            print(f"⚠️ 问题生成失败: {str(e)}，使用默认模板")
-            type_mapping = {
-                "brand": "品牌",
-                "model": "型号",
-                "type": "电路图类型",
-                "category": "车辆类别"
-            }
-            type_name = type_mapping.get(option_type, "选项")
-            return f"找到了 {total_count} 个相关结果。请选择您需要的{type_name}："
+            return self._fallback_question_text(option_type, total_count, e)
+
+    async def generate_question_text_async(
+        self,
+        option_type: str,
+        options: list,
+        total_count: int,
+        context: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """
+        使用LLM生成问题文本（异步版本，参数/返回值同 generate_question_text）
+
+        并发会话的 LLM 请求在事件循环上重叠进行，不再各自占用一个工作线程等待。
+        """
+        if not options:
+            return "请选择您需要的选项："
+
+        try:
+            prompt = self.build_question_prompt(option_type, options, total_count, context)
+            response_text = await self.call_llm_async(prompt, max_tokens=_QUESTION_MAX_TOKENS, temperature=0.5)
+            return self._clean_question_text(response_text)
+
+        except Exception as e:
+            return self._fallback_question_text(option_type, total_count, e)
+
+    @staticmethod
+    def _clean_question_text(response_text: str) -> str:
+        """清理响应文本（移除可能的引号、换行等）"""
+        question_text = response_text.strip()
+        # 移除可能包裹整句的引号（先双引号后单引号，只去成对的，句中/单侧引号保留）
+        for quote in ('"', "'"):
+            if question_text[:1] == question_text[-1:] == quote:
+                question_text = question_text[1:-1]
+        return question_text
+
+    @staticmethod
+    def _fallback_question_text(option_type: str, total_count: int, error: Exception) -> str:
+        """LLM 调用失败时的默认问题模板"""
+        logger.warning("⚠️ 问题生成失败: %s，使用默认模板", error)
+        type_mapping = {
+            "brand": "品牌",
+            "model": "型号",
+            "type": "电路图类型",
+            "category": "车辆类别"
+        }
+        type_name = type_mapping.get(option_type, "选项")
+        return f"找到了 {total_count} 个相关结果。请选择您需要的{type_name}："
 
 
 # 全局LLM服务实例（单例模式）
 _llm_service_instance = None
+_llm_service_lock = threading.Lock()
 
 
 def get_llm_service() -> LLMService:
-    """获取LLM服务实例（单例）"""
+    """获取LLM服务实例（单例，多线程并发首次调用时只创建一个）"""
     global _llm_service_instance
     if _llm_service_instance is None:
-        _llm_service_instance = LLMService()
+        with _llm_service_lock:
+            if _llm_service_instance is None:
+                _llm_service_instance = LLMService()
     return _llm_service_instance
@@ -2,19 +2,316 @@
 问题生成服务模块
 根据搜索结果生成选择题，引导用户缩小范围
 """
-from typing import List, Dict, Optional, Any
+from functools import lru_cache
+from typing import List, Dict, Optional, Any, Tuple, Iterable, Sized
+import copy
+import heapq
+import os
 import re
+import logging
 import string
+import threading
+from collections import defaultdict
 from backend.app.models.circuit_diagram import CircuitDiagram
-from backend.app.models.types import ScoredResult, rebuild_scored_result_model
-from backend.app.services.search_service import get_search_service
+from backend.app.models.types import ScoredResult
+from backend.app.services.search_service import SearchService, get_search_service
 from backend.app.services.llm_service import get_llm_service
 from backend.app.utils.category_pattern_loader import get_pattern_loader
+from backend.app.utils.hierarchy_util import HierarchyUtil
 from backend.app.utils.option_merge_util import merge_similar_options
+from backend.app.utils.ttl_cache import TTLCache, make_cache_key
+from backend.app.utils.variant_util import variant_key_for_query
+from config import Config
 
-# 确保 ScoredResult 模型已重建（解决前向引用问题）
-rebuild_scored_result_model()
+# 预编译的正则（问题生成路径按结果/层级逐条调用，避免每次查 re 模块的编译缓存）
+_ECU_CODE_RE = re.compile(r"[A-Za-z]{1,6}\d{1,3}")  # ECU/代号，如 C81 / EDC17C81
+_CN_PLUS_SERIES_RE = re.compile(r"[\u4e00-\u9fff]{1,8}[A-Z]{2,4}")  # 中文 + 系列码，如 天龙KL
+_SERIES_CODE_RE = re.compile(r"([A-Z]{2,3})")  # 系列码，如 KL / KC / VL
+_AXLE_RE = re.compile(r"(\d)\s*[xX]\s*(\d)")  # 轴型/驱动，如 6x4 / 8X4
+_TRAILING_PUNCT_RE = re.compile(r"[，。.\s]+$")
+_ALNUM_RE = re.compile(r"[A-Za-z0-9]")
+_WS_RE = re.compile(r"\s+")
+_DUP_SERIES_RE = re.compile(r"(系列)\s*(系列)+")
+_FILE_EXT_RE = re.compile(r"\.[A-Z]{2,5}$", re.IGNORECASE)
+_TRAILING_SEGMENT_RE = re.compile(r"_[^_]*$")
+_KEYWORD_TOKEN_RE = re.compile(r"[A-Z]{2,}|[\u4e00-\u9fa5]{2,}")
+# 文件名分隔符（下划线、连字符、空白）删除表：等价于 re.sub(r"[_\-\s]+", "", s)；
+# 正则的 \s 也匹配全角空格等 Unicode 空白（码位均不超过 U+3000），一并列入
+_SEPARATORS_TRANS = str.maketrans('', '', '_-' + ''.join(chr(c) for c in range(0x3001) if chr(c).isspace()))
 
+# 非系列代码（文件扩展名、ECU 类型、总线协议等），从层级/文件名提取系列代码时排除
+_EXCLUDED_SERIES_CODES = frozenset([
+    'ECU', 'DCI', 'LNG', 'EDC', 'VEC', 'DOC', 'DCM',
+    'DOCX', 'VECU', 'BCM', 'PDF', 'XLS', 'XLSX', 'PPT', 'PPTX',
+    'D31', 'D32', 'D53', 'D56', 'ABS', 'ESP', 'TCS', 'EBD',
+    'CAN', 'LIN', 'MOST', 'FLEX', 'KWP', 'UDS', 'OBD'
+])
+# 定位系列层级时排除的代码（比 _EXCLUDED_SERIES_CODES 窄，保持原有定位行为）
+_SERIES_LEVEL_EXCLUDED_CODES = frozenset(['ECU', 'DCI', 'LNG', 'EDC', 'VEC', 'DOC', 'DCM', 'DOCX', 'VECU', 'BCM'])
+# 类型相关层级关键词（这些层级不作为系列选项）
+_TYPE_LEVEL_KEYWORDS = ('电路图', '仪表', 'ECU', '整车', '线路', '针脚', '模块')
+_TYPE_LEVEL_RE = re.compile("|".join(map(re.escape, _TYPE_LEVEL_KEYWORDS)))  # 一次匹配任一关键词
+# 未标注 diagram_type 的结果所在的类型分桶
+_UNTYPED_BUCKET = "其他（未标注类型）"
+# 其余字段缺失时的归类桶名，以及截断后“其他”补齐项的名称
+_NO_BRAND_BUCKET = "其他（未标注品牌）"
+_NO_MODEL_BUCKET = "其他（未标注型号/系列）"
+_NO_CATEGORY_BUCKET = "其他（未标注类别）"
+_NO_BRAND_MODEL_BUCKET = "其他（未标注品牌/型号）"
+_MORE_BUCKET = "其他（未分类/更多）"
+# 各筛选状态下按优先级尝试的选项类型（只读，按需派生新的 tuple）
+_OPTION_TYPES_BRAND_AND_TYPE = ("brand_model", "config")  # 已选品牌和类型
+_OPTION_TYPES_BRAND = ("brand_model", "config", "model", "type", "category")  # 已选品牌
+_OPTION_TYPES_DEFAULT = ("brand_model", "brand", "config", "model", "type", "category")
+# 配置/用途关键词及其规范化形式（按顺序匹配，取第一个命中）
+_ROLE_KEYWORDS = ("牵引车", "载货车", "自卸车", "环卫车", "搅拌车", "专用车", "厢式", "工程车", "冷藏车")
+_ROLE_KEYWORDS_NORM = tuple((kw, SearchService._norm_text(kw)) for kw in _ROLE_KEYWORDS)
+
+# 调试跟踪日志（默认不输出；需要排查选项生成时把该 logger 调到 DEBUG 级别）
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=4096)
+def _first_series_code(text: str) -> Optional[str]:
+    """
+    文本中第一个 2-3 位大写字母串（候选系列代码，如 KL / KC / VL），没有则返回 None
+    是否可用由调用方按各自的排除集判断。同一层级名（如“天龙KL系列”）会在大量结果中重复出现，按文本缓存。
+    """
+    m = _SERIES_CODE_RE.search(text)
+    return m.group(1) if m else None
+
+
+def _has_series_code(level_clean: str) -> bool:
+    """层级是否包含可作为系列的代码（只看第一个 2-3 位大写字母匹配）"""
+    code = _first_series_code(level_clean)
+    return code is not None and code not in _SERIES_LEVEL_EXCLUDED_CODES
+
+
+def _scan_hierarchy(
+    path: Tuple[str, ...],
+    brand_needle: Optional[str],
+    fallback_brand: Optional[str],
+    tianlong: bool
+) -> int:
+    """
+    在层级路径中定位要提取系列信息的层级位置（未找到返回 -1）
+    path 为已清理的层级路径（CircuitDiagram.clean_hierarchy），品牌同样按去 '*' 规则比对
+
+    层级路径结构：电路图 -> 类型 -> 品牌 -> 系列层级 -> 具体系列（如天龙KL） -> ...
+    先定位品牌（优先 brand_needle，找不到再用 diagram.brand），再从品牌后一层单次向后扫描：
+    - 遇到含"系列"的层级立即确定（该层含系列代码用该层；否则下一层含系列代码用下一层；否则仍用该层）
+    - 用户品牌含"天龙"时，含"天龙"且带系列代码的层级立即确定
+    - 否则依次回退到：第一个带系列代码的非类型层级、第一个非类型层级
+    """
+    # 层级已去掉 '*'，品牌也按同样规则清理后再比对（数据中存在"杰狮*通用"这类品牌）
+    if brand_needle:
+        brand_needle = brand_needle.replace('*', '').strip()
+    if fallback_brand:
+        fallback_brand = fallback_brand.replace('*', '').strip()
+    n = len(path)
+    brand_pos = -1
+    fallback_pos = -1
+    for i, level in enumerate(path):
+        if brand_needle and brand_needle in level:
+            brand_pos = i
+            break
+        if fallback_pos == -1 and fallback_brand and fallback_brand in level:
+            fallback_pos = i
+    if brand_pos == -1:
+        brand_pos = fallback_pos
+    if brand_pos == -1:
+        return -1
+
+    code_pos = -1
+    plain_pos = -1
+    for i in range(brand_pos + 1, n):
+        level_clean = path[i]
+        if "系列" in level_clean:
+            if _has_series_code(level_clean):
+                return i
+            if i + 1 < n and _has_series_code(path[i + 1]):
+                return i + 1
+            return i
+        has_code = _has_series_code(level_clean)
+        if tianlong and has_code and "天龙" in level_clean:
+            return i
+        if code_pos == -1 or plain_pos == -1:
+            if not _TYPE_LEVEL_RE.search(level_clean):
+                if plain_pos == -1:
+                    plain_pos = i
+                if code_pos == -1 and has_code:
+                    code_pos = i
+    return code_pos if code_pos != -1 else plain_pos
+
+
+@lru_cache(maxsize=4096)
+def _norm_option_name(s: str) -> str:
+    """选项名规范化：去 '*'、折叠空白与重复的“系列”（品牌/型号等取值大量重复，按原文缓存）"""
+    if not s:
+        return ""
+    s = str(s).replace("*", "").strip()
+    s = _WS_RE.sub(" ", s)
+    # 大多数取值不含“系列”：先做子串判断，避免无谓的正则扫描
+    if "系列" in s:
+        s = _DUP_SERIES_RE.sub(r"\1", s)
+    return s.strip()
+
+
+@lru_cache(maxsize=4096)
+def _strip_file_ext(name: str) -> str:
+    """去除 2~5 位字母扩展名（等价于 _FILE_EXT_RE.sub('', name)，用 rfind 代替正则；
+    不用 os.path.splitext：文件名中常含 '/'（如 FAW_52E/91E），会被当作路径分隔符）"""
+    i = name.rfind('.')
+    if i < 0:
+        return name
+    ext = name[i + 1:]
+    if 2 <= len(ext) <= 5 and ext.isascii() and ext.isalpha():
+        return name[:i]
+    return name
+
+
+@lru_cache(maxsize=4096)
+def _normalize_file_name(name: str) -> str:
+    """文件名前缀比较用的规范化：去扩展名与分隔符（同一文件名按候选对反复调用，按原文缓存）"""
+    return _strip_file_ext(name).translate(_SEPARATORS_TRANS)
+
+
+@lru_cache(maxsize=4096)
+def _config_variant_name(text: str) -> Optional[str]:
+    """
+    由“文件名 + 层级路径”文本得到配置选项名（如 "6x4 牵引车" / "4x2" / "自卸车"），无则 None。
+    同一批图纸在多轮澄清中反复出现，按文本缓存，规范化与正则匹配每条图纸只做一次。
+    """
+    t = SearchService._norm_text(text)
+    if not t:
+        return None
+
+    # 轴型/驱动：4x2 / 6x2 / 6x4 / 8x4 等
+    axle = None
+    # （[xX] 已兼容 “6X4” 大写写法）
+    m = _AXLE_RE.search(text)
+    if m:
+        axle = f"{m.group(1)}x{m.group(2)}"
+
+    role = None
+    for kw, kw_norm in _ROLE_KEYWORDS_NORM:
+        if kw_norm in t:
+            role = kw
+            break
+
+    if axle and role:
+        return f"{axle} {role}"
+    return axle or role
+
+
+def _user_brand_from_context(context: Optional[Dict[str, Any]]) -> Optional[str]:
+    """从上下文中取用户意图的品牌（可能是复合品牌）：优先意图识别结果，其次已选的品牌筛选"""
+    if not context:
+        return None
+    intent_result = context.get("intent_result")
+    if intent_result:
+        return intent_result.get("brand")
+    for filter_item in context.get("filter_history") or ():
+        if filter_item.get("type") == "brand":
+            return filter_item.get("value")
+    return None
+
+
+# 无 ids 的选项按哪类解析字段重新分桶（option_type -> _bucket_by_fields 的分桶名）
+_FIELD_BUCKET_KINDS = {
+    "brand": "brand",
+    "model": "model",
+    "category": "category",
+    "vehicle_category": "category",
+    "brand_model": "brand_model",
+    "brand+model": "brand_model",
+    "type": "type",
+}
+
+
+def _bucket_by_fields(results: List[ScoredResult]) -> Dict[str, Dict[str, set]]:
+    """
+    一次遍历 results，同时按 品牌 / 型号 / 类别 / 品牌+型号 / 类型 分桶（桶名 -> diagram ids）
+    每条数据在每种分桶里只属于一个桶；缺失字段归入对应的“其他（未标注…）”桶。
+    """
+    buckets: Dict[str, Dict[str, set]] = {kind: {} for kind in set(_FIELD_BUCKET_KINDS.values())}
+    brand_buckets = buckets["brand"]
+    model_buckets = buckets["model"]
+    category_buckets = buckets["category"]
+    brand_model_buckets = buckets["brand_model"]
+    type_buckets = buckets["type"]
+
+    def add(target: Dict[str, set], key: str, diagram_id: int) -> None:
+        key = _norm_option_name(key)
+        bucket = target.get(key)
+        if bucket is None:
+            bucket = target[key] = set()
+        bucket.add(diagram_id)
+
+    for r in results:
+        d = r.diagram
+        b = (d.brand or "").strip()
+        m = (d.model or "").strip()
+        add(brand_buckets, b or _NO_BRAND_BUCKET, d.id)
+        add(model_buckets, m or _NO_MODEL_BUCKET, d.id)
+        add(category_buckets, (getattr(d, "vehicle_category", None) or "").strip() or _NO_CATEGORY_BUCKET, d.id)
+        if b and m:
+            brand_model = f"{b} {m}"
+        else:
+            brand_model = b or m or _NO_BRAND_MODEL_BUCKET
+        add(brand_model_buckets, brand_model, d.id)
+        add(type_buckets, (getattr(d, "diagram_type", None) or "").strip() or _UNTYPED_BUCKET, d.id)
+    return buckets
+
+
+@lru_cache(maxsize=512)
+def _fmt_question_cached(question_text: str, option_type: str, opts_key: Tuple[Tuple[str, str], ...]) -> str:
+    """
+    格式化问题消息（纯函数，按 (问题文本, 选项类型, 选项标签/名称) 缓存）
+    热门导航路径在不同会话间会反复生成相同的问题消息，缓存后可跳过字符串拼接。
+    """
+    message = f"{question_text}\n"
+
+    for label, option_name in opts_key:
+        # 如果是品牌+型号组合，添加"系列"后缀
+        if option_type == "brand_model" and "系列" not in option_name:
+            option_name = f"{option_name} 系列"
+        # 如果是类型选择，保持原样（LLM应该已经生成了合适的描述）
+
+        message += f"{label}. {option_name}\n"
+
+    return message
+
+
+def _label_for_index(idx: int) -> str:
+    """第 idx 个选项标签（0 起，Excel 列名风格：A..Z, AA..AZ, BA..BZ...）"""
+    letters = string.ascii_uppercase
+    out = ""
+    x = idx
+    while True:
+        x, rem = divmod(x, 26)
+        out = letters[rem] + out
+        if x == 0:
+            break
+        x -= 1
+    return out
+
+
+# 导入时预生成前 702 个标签（A..ZZ），常规选项数直接切片即可
+_OPTION_LABELS: Tuple[str, ...] = tuple(_label_for_index(i) for i in range(702))
+
+
+def _option_labels(n: int) -> Tuple[str, ...]:
+    """
+    生成 n 个选项标签（Excel 列名风格：A..Z, AA..AZ, BA..BZ...）
+    返回 tuple 避免调用方修改预生成的标签表。
+    """
+    if n <= 0:
+        return ()
+    if n <= len(_OPTION_LABELS):
+        return _OPTION_LABELS[:n]
+    # 超出预生成范围（极少见）：逐个补齐
+    return _OPTION_LABELS + tuple(_label_for_index(i) for i in range(len(_OPTION_LABELS), n))
 
 class QuestionService:
     """问题生成服务"""
@@ -24,29 +321,37 @@ class QuestionService:
         self.search_service = get_search_service()
         self.llm_service = get_llm_service()
         self.pattern_loader = get_pattern_loader()  # 加载分类模式配置
+        # 问题缓存：相同候选集 + 相同上下文（重新生成问题、返回上一步等）直接复用上次生成的问题
+        # 只保存在进程内：ids 对应的数据随本进程加载的数据而定
+        self._question_cache = TTLCache(
+            maxsize=Config.QUESTION_CACHE_SIZE,
+            ttl=Config.QUESTION_CACHE_TTL_SECONDS,
+            namespace="question",
+        )
 
     @staticmethod
     def _make_option_labels(n: int) -> List[str]:
         """
         生成足够数量的选项标签：A..Z, AA..AZ, BA..BZ...
         """
-        if n <= 0:
-            return []
-        letters = string.ascii_uppercase
-
-        def idx_to_label(idx: int) -> str:
-            # Excel-style column naming (0-based)
-            out = ""
-            x = idx
-            while True:
-                x, rem = divmod(x, 26)
-                out = letters[rem] + out
-                if x == 0:
-                    break
-                x -= 1
-            return out
+        return list(_option_labels(n))
 
-        return [idx_to_label(i) for i in range(n)]
+    @staticmethod
+    def _format_options(options: List[Dict], option_type: str, max_options: int) -> List[Dict]:
+        """将收尾后的选项转换为返回给前端的格式（带 A/B/C... 标签，最多 max_options 个）"""
+        head = options[:max_options]
+        labels = _option_labels(len(head))
+        return [
+            {
+                "label": labels[i],
+                "name": option["name"],
+                "count": int(option.get("count") or 0),
+                "type": option_type,
+                # Optional: exact ids for this bucket (used for precise filtering)
+                "ids": option.get("ids") if isinstance(option, dict) else None,
+            }
+            for i, option in enumerate(head)
+        ]
     
     def generate_question(
         self,
@@ -81,35 +386,160 @@ class QuestionService:
         """
         if not results or len(results) < min_options:
             return None
+        # 不允许展示任何选项时，后面各分支都不可能产出有效问题
+        if max_options <= 0:
+            return None
+
+        cache_key = self._question_cache_key(results, min_options, max_options, excluded_types, context, use_llm)
+        cached = self._question_cache.get(cache_key)
+        if cached is not None:
+            return copy.deepcopy(cached)
+
+        question = self._generate_question_uncached(
+            results, min_options, max_options, excluded_types, context, use_llm
+        )
+        # LLM 临时失败时问题文本来自默认模板：不缓存，下一次请求重新尝试 LLM
+        if question is not None and not question.pop("_llm_fallback", False):
+            self._question_cache.set(cache_key, copy.deepcopy(question))
+        return question
+
+    @staticmethod
+    def _question_cache_key(
+        results: List[ScoredResult],
+        min_options: int,
+        max_options: int,
+        excluded_types: Optional[List[str]],
+        context: Optional[Dict[str, Any]],
+        use_llm: bool,
+    ) -> str:
+        """
+        问题缓存 key：候选 id 集合 + 生成参数 + 会影响问题的上下文字段
+        （当前查询、意图品牌/型号、已选筛选条件、用户筛选标记）
+        """
+        ctx = context or {}
+        intent = ctx.get("intent_result") or {}
+        filters = tuple((f.get("type"), f.get("value")) for f in (ctx.get("filter_history") or []))
+        user_filters = tuple((f.get("type"), f.get("value")) for f in (ctx.get("user_filter_history") or []))
+        return make_cache_key(
+            tuple(sorted(r.diagram.id for r in results)),
+            min_options,
+            max_options,
+            tuple(sorted(excluded_types or ())),
+            use_llm,
+            ctx.get("current_query") or "",
+            bool(intent),
+            intent.get("brand"),
+            intent.get("model"),
+            filters,
+            bool(ctx.get("has_user_filters")),
+            user_filters,
+        )
+
+    def _generate_question_uncached(
+        self,
+        results: List[ScoredResult],
+        min_options: int,
+        max_options: int,
+        excluded_types: Optional[List[str]],
+        context: Optional[Dict[str, Any]],
+        use_llm: bool,
+    ) -> Optional[Dict]:
+        """generate_question 的实际生成逻辑（不经过问题缓存）"""
+
+        # 一次遍历得到候选 id 全集与 diagram_type 分桶，供类型直返判断、类型分桶与选项收尾共用
+        seen_ids: set = set()
+        type_buckets: Dict[str, set] = {}
+        # 无 ids 选项的字段分桶（_finalize_options_with_ids 首次需要时一次性算出，换选项类型重试时复用）
+        field_buckets: Dict[str, Dict[str, set]] = {}
+        # 品牌/型号/类别的原始取值（去重后通常只有几种），用于判断哪些单一维度无法区分候选集
+        field_values: Dict[str, set] = {"brand": set(), "model": set(), "category": set()}
+        brand_values, model_values, category_values = field_values["brand"], field_values["model"], field_values["category"]
+        for r in results:
+            d = r.diagram
+            seen_ids.add(d.id)
+            brand_values.add(d.brand)
+            model_values.add(d.model)
+            category_values.add(d.vehicle_category)
+            t = (getattr(d, "diagram_type", None) or "").replace("*", "").strip() or _UNTYPED_BUCKET
+            # 先 get 再按需建桶：setdefault(t, set()) 每条记录都会先分配一个 set
+            bucket = type_buckets.get(t)
+            if bucket is None:
+                bucket = type_buckets[t] = set()
+            bucket.add(d.id)
+        # 候选 id 全集在各次选项类型尝试间只读共享：冻结后由类型保证不被就地修改
+        all_ids = frozenset(seen_ids)
+
+        # 所有结果在该维度上取值相同（未标注也算一种取值）：该维度只有一个桶，不可能拆分候选集
+        uniform_fields = {
+            field for field, values in field_values.items()
+            if len({(v or "").replace("*", "").strip() for v in values}) <= 1
+        }
         
+        # 上下文中的查询与筛选历史只取一次，后续各分支共用
+        ctx = context or {}
+        current_query = ctx.get("current_query") or ""
+        is_first_turn = not ctx.get("filter_history")
+
         # 优先尝试文档主题分类（当结果数量较多且查询更像“主题词”而不是“车型系列/ECU代号”时）
         # 例如："VGT执行器"、"解放动力"、"龙擎动力"、"涡轮增压器"等
         #
         # 注意：若查询形如“天龙KL电路图”“欧曼ETX...”或“C81电路图”这类更像“车型系列/ECU代号”的场景，
         # 应优先走 variant 分组（已有回归测试覆盖），避免被 document_category 抢占首轮问题类型。
-        current_query = (context or {}).get("current_query") or ""
-        has_ecu_code = bool(re.search(r"[A-Za-z]{1,6}\d{1,3}", current_query))
-        looks_like_cn_plus_series = bool(re.search(r"[\u4e00-\u9fff]{1,8}[A-Z]{2,4}", current_query))
+        has_ecu_code = bool(_ECU_CODE_RE.search(current_query))
+        looks_like_cn_plus_series = bool(_CN_PLUS_SERIES_RE.search(current_query))
+
+        # 文档主题分类分支的适用条件：结果足够多、查询不像车型系列/ECU代号
+        use_doc_category = len(results) >= 6 and not (has_ecu_code or looks_like_cn_plus_series)
+        doc_category_excluded = bool(excluded_types) and (
+            "document_category" in excluded_types or "filename_prefix" in excluded_types
+        )
+
+        # 先做廉价的维度筛选（排除已选维度、类型直返）：没有可问的结构化维度、且文档主题分类分支
+        # 也不适用时直接返回，不再做文档主题分类/文件名合并这类较重的提取
+        option_types, force_hierarchy_extraction = self._compute_option_types(
+            excluded_types, current_query, has_ecu_code, type_buckets
+        )
+        if not option_types and (not use_doc_category or doc_category_excluded):
+            return None
 
-        if len(results) >= 6 and not (has_ecu_code or looks_like_cn_plus_series):
+        # 按文件名逐条生成选项再做前缀合并：输入在本次调用内不变，而文档主题分类分支与最后的
+        # fallback 都可能用到它，只计算一次（结果只读，后续处理都会生成新列表）
+        filename_prefix_cache: List[Optional[List[Dict]]] = []
+
+        def filename_prefix_options() -> Optional[List[Dict]]:
+            if not filename_prefix_cache:
+                # 逐条生成，由 _merge_filename_prefixes 边遍历边分组，不先构造 N 个元素的中间列表
+                filename_options = (
+                    {"name": r.diagram.file_name or "", "count": 1, "ids": [r.diagram.id]}
+                    for r in results
+                )
+                filename_prefix_cache.append(
+                    self._merge_filename_prefixes(results, filename_options, max_options=max_options)
+                )
+            return filename_prefix_cache[0]
+
+        if use_doc_category:
             doc_category_options = self._extract_document_category_options(results, max_options=max_options)
-            print(f"🔍 文档类别提取结果: {len(doc_category_options) if doc_category_options else 0} 个选项")
+            logger.debug("🔍 文档类别提取结果: %d 个选项", len(doc_category_options) if doc_category_options else 0)
             if doc_category_options and len(doc_category_options) >= min_options:
                 # 如果提取到的类别数量>=10，尝试文件名前缀合并（在finalize之前）
                 current_option_type = "document_category"
                 if len(doc_category_options) >= 10:
-                    print(f"✅ 检测到类别数量 >= 10 ({len(doc_category_options)})，尝试文件名前缀合并...")
+                    logger.debug("✅ 检测到类别数量 >= 10 (%d)，尝试文件名前缀合并...", len(doc_category_options))
                     merged_options = self._merge_filename_prefixes(results, doc_category_options, max_options=max_options)
-                    print(f"🔍 合并结果: {len(merged_options) if merged_options else 0} 个选项")
+                    logger.debug("🔍 合并结果: %d 个选项", len(merged_options) if merged_options else 0)
                     if merged_options and len(merged_options) < len(doc_category_options) and len(merged_options) >= min_options:
                         # 使用合并后的选项
-                        print(f"✅ 合并成功: {len(doc_category_options)} -> {len(merged_options)}")
+                        logger.debug("✅ 合并成功: %d -> %d", len(doc_category_options), len(merged_options))
                         doc_category_options = merged_options
                         current_option_type = "filename_prefix"
                     else:
-                        print(f"⚠️ 合并失败或无效: merged_options={merged_options is not None}, len={len(merged_options) if merged_options else 0}, min_options={min_options}")
+                        logger.debug(
+                            "⚠️ 合并失败或无效: merged_options=%s, len=%d, min_options=%d",
+                            merged_options is not None, len(merged_options) if merged_options else 0, min_options,
+                        )
                 else:
-                    print(f"ℹ️ 类别数量 < 10 ({len(doc_category_options)})，跳过文件名前缀合并")
+                    logger.debug("ℹ️ 类别数量 < 10 (%d)，跳过文件名前缀合并", len(doc_category_options))
                 
                 # 如果成功提取到文档主题分类，优先使用
                 options = self._finalize_options_with_ids(
@@ -118,20 +548,14 @@ class QuestionService:
                     results=results,
                     max_options=max_options,
                     context=context,
+                    all_ids=all_ids,
+                    field_buckets=field_buckets,
+                    ids_are_authoritative=True,
                 )
                 if options and len(options) >= min_options:
                     
                     question_text = self._generate_question_text(current_option_type, len(results), context)
-                    option_labels = self._make_option_labels(min(max_options, len(options)))
-                    formatted_options = []
-                    for i, option in enumerate(options[:max_options]):
-                        formatted_options.append({
-                            "label": option_labels[i],
-                            "name": option['name'],
-                            "count": int(option.get("count") or 0),
-                            "type": current_option_type,
-                            "ids": option.get("ids") if isinstance(option, dict) else None,
-                        })
+                    formatted_options = self._format_options(options, current_option_type, max_options)
                     return {
                         "question": question_text,
                         "options": formatted_options,
@@ -139,18 +563,8 @@ class QuestionService:
                     }
             # 如果文档主题分类提取失败或提取到的类别太多（接近结果数量），直接尝试文件名前缀合并
             elif len(results) >= 10:
-                # 直接基于文件名生成选项并尝试合并
-                filename_options = []
-                for result in results:
-                    file_name = result.diagram.file_name or ""
-                    filename_options.append({
-                        "name": file_name,
-                        "count": 1,
-                        "ids": [result.diagram.id]
-                    })
-                
-                # 尝试合并文件名前缀
-                merged_options = self._merge_filename_prefixes(results, filename_options, max_options=max_options)
+                # 直接基于文件名生成选项并尝试合并文件名前缀
+                merged_options = filename_prefix_options()
                 if merged_options and len(merged_options) >= min_options and len(merged_options) < len(results):
                     options = self._finalize_options_with_ids(
                         option_type="filename_prefix",
@@ -158,115 +572,75 @@ class QuestionService:
                         results=results,
                         max_options=max_options,
                         context=context,
+                        all_ids=all_ids,
+                        field_buckets=field_buckets,
+                        ids_are_authoritative=True,
                     )
                     if options and len(options) >= min_options:
                         question_text = self._generate_question_text("filename_prefix", len(results), context)
-                        option_labels = self._make_option_labels(min(max_options, len(options)))
-                        formatted_options = []
-                        for i, option in enumerate(options[:max_options]):
-                            formatted_options.append({
-                                "label": option_labels[i],
-                                "name": option['name'],
-                                "count": int(option.get("count") or 0),
-                                "type": "filename_prefix",
-                                "ids": option.get("ids") if isinstance(option, dict) else None,
-                            })
+                        formatted_options = self._format_options(options, "filename_prefix", max_options)
                         return {
                             "question": question_text,
                             "options": formatted_options,
                             "option_type": "filename_prefix"
                         }
-        
-        # 按优先级尝试生成问题：车型变体(variant) -> 品牌+型号组合 -> 品牌 -> 配置 -> 型号 -> 类型 -> 类别
-        # 如果用户已经选择了品牌，尝试使用品牌+型号组合
-        option_types = []
-        
-        # 检查是否已经选择了品牌和类型
-        has_brand_filter = False
-        has_type_filter = False
-        if excluded_types:
-            has_brand_filter = "brand" in excluded_types
-            has_type_filter = "type" in excluded_types
-        
-        # 若用户输入形如“天龙KL电路图”，首轮优先按“车型变体前缀”分组（更符合业务期望）
-        current_query = (context or {}).get("current_query") or ""
-        has_diagram_kw = ("电路图" in current_query) or ("电路" in current_query and "图" in current_query)
-        # series code: KL/KC/VL... ; ecu/code: C81 / EDC17C81 ...
-        has_ecu_code = bool(re.search(r"[A-Za-z]{1,6}\d{1,3}", current_query))
-        has_series_code = bool(re.search(r"[A-Z]{2,3}", current_query)) and not has_ecu_code
-
-        # 如果已经选择了品牌和类型，优先询问系列（品牌后面的层级），其次询问配置/轴型
-        force_hierarchy_extraction = False
-        if has_brand_filter and has_type_filter:
-            # 用户已经指定了品牌和类型，必须询问系列（如KL、KC等）
-            # 只尝试brand_model类型，不允许fallback到其他类型
-            option_types = ["brand_model", "config"]
-            # 强制使用层级路径提取，不允许使用标准方法
-            force_hierarchy_extraction = True
-        elif has_brand_filter:
-            # 用户已经选择了品牌，优先询问系列，然后才是类型
-            option_types = ["brand_model", "config", "model", "type", "category"]
-        else:
-            # 否则，先尝试单一维度，如果单一维度选项不足，再尝试组合维度
-            # 优先尝试品牌+型号组合，因为这样可以从层级路径中提取更精确的选项
-            option_types = ["brand_model", "brand", "config", "model", "type", "category"]
-
-        # “代号/系列码 + 电路图”场景：把 variant 放到最前面（并避免被 excluded_types 过滤）
-        if has_diagram_kw and (has_series_code or has_ecu_code):
-            if not excluded_types or "variant" not in excluded_types:
-                option_types = ["variant"] + [t for t in option_types if t != "variant"]
-        
-        # 如果指定了要排除的类型，跳过它们
-        if excluded_types:
-            option_types = [opt_type for opt_type in option_types if opt_type not in excluded_types]
 
-        # 类型直返规则（关键）：如果候选的“diagram_type”只有一种，就不要再问类型，直接问下一维度
-        # 这能避免“明明都只有整车电路图，却还在问你要哪种类型”的低效澄清。
-        if "type" in option_types:
-            unique_types = {r.diagram.diagram_type for r in results if getattr(r.diagram, "diagram_type", None)}
-            if len(unique_types) <= 1:
-                option_types = [t for t in option_types if t != "type"]
-        
-        # 如果所有类型都被排除了，返回 None
+        # 文档主题分类也没有产出问题，且没有可问的结构化维度
         if not option_types:
             return None
         
+        # 层级路径提取的输入在本次调用内不变，而 brand_model 及 brand/model/category 的回退、
+        # 最后的 fallback 都会用到它：只计算一次，各处共用（结果只读，后续处理都会生成新列表）
+        hierarchy_cache: List[List[Dict]] = []
+
+        def hierarchy_options() -> List[Dict]:
+            if not hierarchy_cache:
+                hierarchy_cache.append(self._extract_options_from_hierarchy(results, max_options, context))
+            return hierarchy_cache[0]
+        
         for option_type in option_types:
             # 双重检查：确保当前类型不在排除列表中
             if excluded_types and option_type in excluded_types:
                 continue
             
+            # 选项是否都已带 ids（None 表示由 _finalize_options_with_ids 自行判断）
+            ids_known: Optional[bool] = None
+
             # 特殊处理：variant/brand_model/config 需要特殊提取逻辑
             if option_type == "variant":
                 options = self._extract_variant_options(results, max_options=max_options, context=context)
             elif option_type == "brand_model":
                 # 优先从层级路径中提取品牌+系列组合
-                options = self._extract_options_from_hierarchy(results, max_options, context)
-                print(f"🔍 _extract_options_from_hierarchy返回选项数: {len(options) if options else 0}")
+                options = hierarchy_options()
+                logger.debug("🔍 _extract_options_from_hierarchy返回选项数: %d", len(options) if options else 0)
                 # 如果提取失败，且不是强制层级提取，使用标准方法
                 if not options or len(options) < min_options:
                     if not force_hierarchy_extraction:
-                        print(f"⚠️ 层级提取失败，尝试标准方法")
+                        logger.debug("⚠️ 层级提取失败，尝试标准方法")
                         options = self._extract_brand_model_options(results, max_options)
-                        print(f"🔍 _extract_brand_model_options返回选项数: {len(options) if options else 0}")
+                        logger.debug("🔍 _extract_brand_model_options返回选项数: %d", len(options) if options else 0)
                     else:
                         # 强制层级提取时，如果失败，尝试更激进的提取策略
-                        print(f"⚠️ 强制层级提取失败，尝试更激进的提取策略")
+                        logger.debug("⚠️ 强制层级提取失败，尝试更激进的提取策略")
                         # 尝试从所有层级路径中提取系列代码，不限制位置
                         options = self._extract_series_codes_aggressive(results, max_options, context)
-                        print(f"🔍 激进提取返回选项数: {len(options) if options else 0}")
+                        logger.debug("🔍 激进提取返回选项数: %d", len(options) if options else 0)
                         # 如果激进提取也失败，至少尝试从文件名中提取
                         if not options or len(options) < min_options:
-                            print(f"⚠️ 激进提取也失败，尝试从文件名提取系列代码")
+                            logger.debug("⚠️ 激进提取也失败，尝试从文件名提取系列代码")
                             options = self._extract_series_from_filenames(results, max_options, context)
-                            print(f"🔍 文件名提取返回选项数: {len(options) if options else 0}")
+                            logger.debug("🔍 文件名提取返回选项数: %d", len(options) if options else 0)
             elif option_type == "type":
                 # 关键修复：
                 # - “type” 必须按当前候选集的 diagram_type 进行**分桶**（每条数据只属于一个桶），
                 #   否则会出现“选项显示4条，但点进去变33条”的严重不一致。
-                options = self._extract_disjoint_type_options(results, max_options=max_options)
+                options = self._extract_disjoint_type_options(results, max_options=max_options, precomputed=type_buckets)
+                ids_known = True  # 分桶结果每个选项都带 ids
             elif option_type == "config":
                 options = self._extract_config_variants(results, max_options=max_options, context=context)
+            elif option_type in uniform_fields and min_options >= 2:
+                # 单一取值的维度：跳过标准提取，直接走下面的层级路径回退
+                options = []
             else:
                 options = self.search_service.extract_options(
                     results,
@@ -276,22 +650,23 @@ class QuestionService:
             
             # 如果选项数量不足，尝试从层级路径中提取选项
             if not options or len(options) < min_options:
+                ids_known = None  # 回退提取的选项来源不一，交给收尾时判断
                 if option_type == "variant":
                     # variant 没有更好的回退策略，交给后续 option_type 继续尝试
                     pass
                 elif option_type == "brand_model":
                     # 尝试从层级路径中提取品牌+层级组合
-                    options = self._extract_options_from_hierarchy(results, max_options, context)
+                    options = hierarchy_options()
                 elif option_type == "type":
                     # 对于类型，尝试提取类型变体
                     options = self._extract_type_variants(results, max_options, context)
                 elif option_type in ["brand", "model", "category"]:
                     # 对于其他类型，也尝试从层级路径中提取
                     try:
-                        hierarchy_options = self._extract_options_from_hierarchy(results, max_options, context)
-                        if hierarchy_options and len(hierarchy_options) >= min_options:
+                        fallback_hierarchy = hierarchy_options()
+                        if fallback_hierarchy and len(fallback_hierarchy) >= min_options:
                             # 如果层级提取成功，使用层级选项
-                            options = hierarchy_options
+                            options = fallback_hierarchy
                             option_type = "brand_model"  # 更新选项类型
                     except:
                         pass
@@ -305,6 +680,9 @@ class QuestionService:
                 results=results,
                 max_options=max_options,
                 context=context,
+                all_ids=all_ids,
+                field_buckets=field_buckets,
+                ids_are_authoritative=ids_known,
             )
             
             # 检查选项数量是否足够
@@ -319,22 +697,26 @@ class QuestionService:
                         option_type = "filename_prefix"
                 
                 # 使用LLM生成问题文本（如果启用）
-                if use_llm:
+                llm_failed = False
+                # 未配置 LLM 时直接用默认模板（结果稳定，可以缓存）；LLM 调用失败由下面的 except 回退
+                if use_llm and self.llm_service.enabled:
                     try:
                         question_text = self.llm_service.generate_question_text(
                             option_type=option_type,
                             options=options,
                             total_count=len(results),
-                            context=context
+                            context=context,
+                            fallback_on_error=False
                         )
                     except Exception as e:
-                        print(f"⚠️ LLM生成问题失败: {str(e)}，使用默认模板")
-                        question_text = self._generate_question_text(option_type, len(results), context)
+                        # 与 generate_question_text 自带回退的文案保持一致，仅额外标记不缓存
+                        question_text = self.llm_service._fallback_question_text(option_type, len(results), e)
+                        llm_failed = True
                 else:
                     question_text = self._generate_question_text(option_type, len(results), context)
 
                 # 统一首轮提问口径：必须带上用户查询/意图，形如“我找到了XX相关的数据。请问您需要的是：”
-                if not ((context or {}).get("filter_history")):
+                if is_first_turn:
                     question_text = self._normalize_first_question_text(question_text, context)
                 
                 # 仅对“文件名类”选项做相似合并：避免明显重复/仅细节差异的条目刷屏
@@ -347,23 +729,16 @@ class QuestionService:
                         name_key="name",
                     )
 
-                option_labels = self._make_option_labels(min(max_options, len(options)))
-                formatted_options = []
-                for i, option in enumerate(options[:max_options]):
-                    formatted_options.append({
-                        "label": option_labels[i],
-                        "name": option['name'],
-                        "count": int(option.get("count") or 0),
-                        "type": option_type,
-                        # Optional: exact ids for this bucket (used for precise filtering)
-                        "ids": option.get("ids") if isinstance(option, dict) else None,
-                    })
+                formatted_options = self._format_options(options, option_type, max_options)
                 
-                return {
+                question = {
                     "question": question_text,
                     "options": formatted_options,
                     "option_type": option_type
                 }
+                if llm_failed:
+                    question["_llm_fallback"] = True  # generate_question 取出该标记，不缓存本次结果
+                return question
         
         # 如果无法生成问题，尝试最后的fallback
         if not results or len(results) < min_options:
@@ -371,18 +746,8 @@ class QuestionService:
         
         # 如果结果数量>=10，尝试文件名前缀合并
         if len(results) >= 10:
-            # 先基于文件名生成选项
-            filename_options = []
-            for result in results:
-                file_name = result.diagram.file_name or ""
-                filename_options.append({
-                    "name": file_name,
-                    "count": 1,
-                    "ids": [result.diagram.id]
-                })
-            
-            # 尝试合并文件名前缀
-            merged_options = self._merge_filename_prefixes(results, filename_options, max_options=max_options)
+            # 基于文件名生成选项并尝试合并文件名前缀（与文档主题分类分支共用同一次计算）
+            merged_options = filename_prefix_options()
             if merged_options and len(merged_options) >= min_options:
                 if len(merged_options) >= 6:
                     merged_options = merge_similar_options(
@@ -392,16 +757,7 @@ class QuestionService:
                         name_key="name",
                     )
                 question_text = self._generate_question_text("filename_prefix", len(results), context)
-                option_labels = self._make_option_labels(min(max_options, len(merged_options)))
-                formatted_options = []
-                for i, option in enumerate(merged_options[:max_options]):
-                    formatted_options.append({
-                        "label": option_labels[i],
-                        "name": option['name'],
-                        "count": int(option.get("count") or 0),
-                        "type": "filename_prefix",
-                        "ids": option.get("ids") if isinstance(option, dict) else None,
-                    })
+                formatted_options = self._format_options(merged_options, "filename_prefix", max_options)
                 return {
                     "question": question_text,
                     "options": formatted_options,
@@ -410,7 +766,7 @@ class QuestionService:
         
         # 最后的fallback：从层级路径中提取品牌+型号组合
         try:
-            fallback_options = self._extract_options_from_hierarchy(results, max_options, context)
+            fallback_options = hierarchy_options()
             if fallback_options and len(fallback_options) >= min_options:
                 # 使用默认模板生成问题
                 question_text = self._generate_question_text("brand_model", len(results), context)
@@ -431,7 +787,7 @@ class QuestionService:
                     "option_type": "brand_model"
                 }
         except Exception as e:
-            print(f"⚠️ Fallback选项提取失败: {str(e)}")
+            logger.warning("⚠️ Fallback选项提取失败: %s", e)
         
         # 如果所有方法都失败，返回None
         return None
@@ -473,10 +829,10 @@ class QuestionService:
 
         # 用户原始查询：优先保留包含代号/数字的表达（如 C81、电路图）
         current_query = (ctx.get("current_query") or "").strip()
-        current_query = re.sub(r"[，。.\s]+$", "", current_query)
+        current_query = _TRAILING_PUNCT_RE.sub("", current_query)
         if current_query:
             # 包含字母或数字时，直接使用原始查询以避免被品牌覆盖
-            if re.search(r"[A-Za-z0-9]", current_query):
+            if _ALNUM_RE.search(current_query):
                 return current_query
 
         subject = None
@@ -495,28 +851,97 @@ class QuestionService:
             subject = "相关电路图"
 
         # 简单清理末尾的无用符号
-        subject = re.sub(r"[，。.\s]+$", "", subject)
+        subject = _TRAILING_PUNCT_RE.sub("", subject)
         return subject or "相关电路图"
 
     def _extract_disjoint_type_options(
         self,
         results: List[ScoredResult],
         max_options: int = 5,
+        precomputed: Optional[Dict[str, set]] = None,
     ) -> List[Dict]:
         """
         Disjoint type buckets based on diagram.diagram_type.
         Each diagram belongs to at most one bucket.
+        precomputed: type -> ids buckets already built by the caller (read only).
+        Option ids are sets here; _finalize_options_with_ids sorts them once when serializing.
         """
-        type_to_ids: Dict[str, set] = {}
-        for r in results:
-            d = r.diagram
-            t = (getattr(d, "diagram_type", None) or "").replace("*", "").strip()
-            if not t:
-                t = "其他（未标注类型）"
-            type_to_ids.setdefault(t, set()).add(d.id)
-        options = [{"name": k, "count": len(v), "ids": sorted(v)} for k, v in type_to_ids.items()]
-        options.sort(key=lambda x: (-x["count"], x["name"]))
-        return options[: max(1, max_options * 5)]
+        type_to_ids = precomputed
+        if type_to_ids is None:
+            type_to_ids = {}
+            for r in results:
+                d = r.diagram
+                t = (getattr(d, "diagram_type", None) or "").replace("*", "").strip() or _UNTYPED_BUCKET
+                bucket = type_to_ids.get(t)
+                if bucket is None:
+                    bucket = type_to_ids[t] = set()
+                bucket.add(d.id)
+        options = [{"name": k, "count": len(v), "ids": v} for k, v in type_to_ids.items()]
+        # 只取前 K 个（数量降序、名称升序），部分排序即可
+        return heapq.nsmallest(max(1, max_options * 5), options, key=lambda x: (-x["count"], x["name"]))
+
+    @staticmethod
+    def _compute_option_types(
+        excluded_types: Optional[List[str]],
+        current_query: str,
+        has_ecu_code: bool,
+        type_buckets: Dict[str, set],
+    ) -> Tuple[Tuple[str, ...], bool]:
+        """
+        计算本轮按优先级尝试的选项类型
+
+        Returns:
+            (选项类型序列, 是否强制使用层级路径提取)；序列为空表示没有可问的维度
+        """
+        # 按优先级尝试生成问题：车型变体(variant) -> 品牌+型号组合 -> 品牌 -> 配置 -> 型号 -> 类型 -> 类别
+        # 如果用户已经选择了品牌，尝试使用品牌+型号组合
+        
+        # 检查是否已经选择了品牌和类型
+        has_brand_filter = False
+        has_type_filter = False
+        if excluded_types:
+            has_brand_filter = "brand" in excluded_types
+            has_type_filter = "type" in excluded_types
+        
+        # 若用户输入形如“天龙KL电路图”，首轮优先按“车型变体前缀”分组（更符合业务期望）
+        has_diagram_kw = ("电路图" in current_query) or ("电路" in current_query and "图" in current_query)
+        # series code: KL/KC/VL... ; ecu/code: C81 / EDC17C81 ...
+        has_series_code = bool(_SERIES_CODE_RE.search(current_query)) and not has_ecu_code
+
+        # 如果已经选择了品牌和类型，优先询问系列（品牌后面的层级），其次询问配置/轴型
+        force_hierarchy_extraction = False
+        if has_brand_filter and has_type_filter:
+            # 用户已经指定了品牌和类型，必须询问系列（如KL、KC等）
+            # 只尝试brand_model类型，不允许fallback到其他类型
+            option_types = _OPTION_TYPES_BRAND_AND_TYPE
+            # 强制使用层级路径提取，不允许使用标准方法
+            force_hierarchy_extraction = True
+        elif has_brand_filter:
+            # 用户已经选择了品牌，优先询问系列，然后才是类型
+            option_types = _OPTION_TYPES_BRAND
+        else:
+            # 否则，先尝试单一维度，如果单一维度选项不足，再尝试组合维度
+            # 优先尝试品牌+型号组合，因为这样可以从层级路径中提取更精确的选项
+            option_types = _OPTION_TYPES_DEFAULT
+
+        # “代号/系列码 + 电路图”场景：把 variant 放到最前面（并避免被 excluded_types 过滤）
+        if has_diagram_kw and (has_series_code or has_ecu_code):
+            if not excluded_types or "variant" not in excluded_types:
+                option_types = ("variant",) + option_types
+        
+        # 如果指定了要排除的类型，跳过它们
+        if excluded_types:
+            option_types = tuple(opt_type for opt_type in option_types if opt_type not in excluded_types)
+
+        # 类型直返规则（关键）：如果候选的“diagram_type”只有一种，就不要再问类型，直接问下一维度
+        # 这能避免“明明都只有整车电路图，却还在问你要哪种类型”的低效澄清。
+        # （未标注类型的结果不算一种类型）
+        if "type" in option_types:
+            unique_types = type_buckets.keys() - {_UNTYPED_BUCKET}
+            if len(unique_types) <= 1:
+                option_types = tuple(t for t in option_types if t != "type")
+
+        return option_types, force_hierarchy_extraction
 
     def _finalize_options_with_ids(
         self,
@@ -525,101 +950,94 @@ class QuestionService:
         results: List[ScoredResult],
         max_options: int,
         context: Optional[Dict[str, Any]] = None,
+        all_ids: Optional[frozenset] = None,
+        field_buckets: Optional[Dict[str, Dict[str, set]]] = None,
+        ids_are_authoritative: Optional[bool] = None,
     ) -> List[Dict]:
         """
         Normalize/merge options and ensure:
         - each option has ids
         - count == len(ids)
         - append “其他（未分类/更多）” to close coverage when truncated
+        Incoming ids may be lists or sets; returned ids are always sorted lists.
+        all_ids: ids of all results, if the caller already has them (read only).
+        field_buckets: per-call cache for _bucket_by_fields(results); filled on first use so that
+            retries with other option types in the same generate_question reuse one pass over results.
+        ids_are_authoritative: True when the caller built every option with ids (document category /
+            filename prefix), False when none carry ids; None (default) scans options to decide.
         """
         if not options:
             return []
 
         # Build mapping name -> ids (prefer provided ids; otherwise compute via disjoint field buckets)
-        all_ids = {r.diagram.id for r in results}
-
-        def norm_name(s: str) -> str:
-            if not s:
-                return ""
-            s = str(s).replace("*", "").strip()
-            s = re.sub(r"\s+", " ", s)
-            s = re.sub(r"(系列)\s*(系列)+", r"\1", s)
-            return s.strip()
+        if all_ids is None:
+            all_ids = frozenset(r.diagram.id for r in results)
 
         merged: Dict[str, set] = {}
 
         # Fast paths: if options already have ids, just merge by normalized name
-        has_any_ids = any(isinstance(o, dict) and isinstance(o.get("ids"), list) for o in options)
-        if has_any_ids:
+        if ids_are_authoritative is None:
+            ids_are_authoritative = any(
+                isinstance(o, dict) and isinstance(o.get("ids"), (list, set, frozenset)) for o in options
+            )
+        if ids_are_authoritative:
             for o in options:
-                name = norm_name(o.get("name"))
-                ids = o.get("ids") or []
+                name = _norm_option_name(o.get("name"))
                 if not name:
                     continue
-                merged.setdefault(name, set()).update(ids)
+                ids = o.get("ids") or ()
+                bucket = merged.get(name)
+                if bucket is None:
+                    # 首次出现直接由 ids 构造（复制一份，不修改调用方的集合）
+                    merged[name] = set(ids)
+                else:
+                    bucket.update(ids)
         else:
-            # Fallback: compute ids from parsed fields for disjoint types where possible
-            # brand/model/category/brand_model use parsed fields => disjoint buckets, stable counts
-            opt = (option_type or "").strip().lower()
-            if opt in ("brand", "model", "category", "vehicle_category", "brand_model", "brand+model"):
-                for r in results:
-                    d = r.diagram
-                    if opt == "brand":
-                        key = (d.brand or "").strip() or "其他（未标注品牌）"
-                    elif opt == "model":
-                        key = (d.model or "").strip() or "其他（未标注型号/系列）"
-                    elif opt in ("category", "vehicle_category"):
-                        key = (getattr(d, "vehicle_category", None) or "").strip() or "其他（未标注类别）"
-                    else:
-                        b = (d.brand or "").strip()
-                        m = (d.model or "").strip()
-                        if b and m:
-                            key = f"{b} {m}"
-                        elif b:
-                            key = b
-                        elif m:
-                            key = m
-                        else:
-                            key = "其他（未标注品牌/型号）"
-                    key = norm_name(key)
-                    merged.setdefault(key, set()).add(d.id)
-            elif opt == "type":
-                for r in results:
-                    d = r.diagram
-                    key = (getattr(d, "diagram_type", None) or "").strip() or "其他（未标注类型）"
-                    key = norm_name(key)
-                    merged.setdefault(key, set()).add(d.id)
-            else:
+            # Fallback: compute ids from parsed fields => disjoint buckets, stable counts
+            kind = _FIELD_BUCKET_KINDS.get((option_type or "").strip().lower())
+            if kind is None:
                 # Unknown: keep original counts, but without ids we cannot guarantee consistency
                 # (still better to return as-is)
                 return self.optimize_options(options, max_options)
+            if field_buckets is None:
+                field_buckets = {}
+            if not field_buckets:
+                field_buckets.update(_bucket_by_fields(results))
+            # read only below: buckets are shared with later calls through field_buckets
+            merged = field_buckets[kind]
+
+        # (name, ids set) pairs; ids are only sorted when building the returned options
+        items = [(k, v) for k, v in merged.items() if k]
 
-        # Convert to list with ids
-        items = [{"name": k, "ids": sorted(v), "count": len(v)} for k, v in merged.items() if k]
-        items.sort(key=lambda x: (-x["count"], x["name"]))
+        def order(item: Tuple[str, set]) -> Tuple[int, str]:
+            # count desc, name asc
+            return -len(item[1]), item[0]
 
         # Remove non-discriminating buckets: options that cover the entire candidate set
         # These lead to "23 → 23" no-op selections and can trap users in non-converging loops.
+        # Both sides are sets, so != compares sizes first and only walks buckets as large as all_ids.
         if all_ids:
-            items = [it for it in items if set(it.get("ids") or []) != all_ids]
+            items = [it for it in items if it[1] != all_ids]
 
         # Apply truncation with “其他” closure (only when there are more than max_options buckets)
         if max_options <= 0:
             return []
 
-        if len(items) <= max_options:
-            return items
+        if len(items) > max_options:
+            head_limit = max_options - 1 if max_options >= 3 else max_options
+            # Only the top head_limit buckets are kept: partial sort instead of sorting every bucket
+            head = heapq.nsmallest(head_limit, items, key=order)
+            if head_limit < max_options:
+                # 一次 C 层 difference 完成集合差（不再构造中间的 used 集合）
+                rest = all_ids.difference(*(ids for _, ids in head))
+                if rest:
+                    head.append((_MORE_BUCKET, rest))
+            head.sort(key=order)
+            items = head[:max_options]
+        else:
+            items.sort(key=order)
 
-        head_limit = max_options - 1 if max_options >= 3 else max_options
-        head = items[:head_limit]
-        used = set()
-        for it in head:
-            used |= set(it["ids"])
-        rest = all_ids - used
-        if rest and head_limit < max_options:
-            head.append({"name": "其他（未分类/更多）", "ids": sorted(rest), "count": len(rest)})
-        head.sort(key=lambda x: (-x["count"], x["name"]))
-        return head[:max_options]
+        return [{"name": k, "ids": sorted(v), "count": len(v)} for k, v in items]
 
     def _extract_config_variants(
         self,
@@ -631,53 +1049,16 @@ class QuestionService:
         提取“配置/轴型/用途”等选项（如 4x2/6x2/6x4 + 牵引车/载货车/自卸车/环卫车 等）
         用于第二层澄清。
         """
-        import re
-        from backend.app.services.search_service import SearchService
-
-        def norm(s: str) -> str:
-            return SearchService._norm_text(s)
-
-        role_keywords = ["牵引车", "载货车", "自卸车", "环卫车", "搅拌车", "专用车", "厢式", "工程车", "冷藏车"]
         options: Dict[str, int] = {}
 
         for r in results:
-            d = r.diagram
-            text = " ".join([d.file_name or ""] + (d.hierarchy_path or []))
-            t = norm(text)
-            if not t:
-                continue
-
-            # 轴型/驱动：4x2 / 6x2 / 6x4 / 8x4 等
-            axle = None
-            m = re.search(r"(\d)\s*[xX]\s*(\d)", text)
-            if m:
-                axle = f"{m.group(1)}x{m.group(2)}"
-            else:
-                # 兼容 “6X4”写法（大小写）
-                m2 = re.search(r"(\d)\s*[Xx]\s*(\d)", text)
-                if m2:
-                    axle = f"{m2.group(1)}x{m2.group(2)}"
-
-            role = None
-            for kw in role_keywords:
-                if norm(kw) in t:
-                    role = kw
-                    break
-
-            if axle and role:
-                name = f"{axle} {role}"
-            elif axle:
-                name = axle
-            elif role:
-                name = role
-            else:
-                continue
-
-            options[name] = options.get(name, 0) + 1
+            name = _config_variant_name(r.diagram.path_text)
+            if name:
+                options[name] = options.get(name, 0) + 1
 
         out = [{"name": k, "count": v} for k, v in options.items()]
-        out.sort(key=lambda x: (-x["count"], x["name"]))
-        return out[:max_options]
+        # 只保留前 max_options 个（数量降序、名称升序），部分排序即可
+        return heapq.nsmallest(max(0, max_options), out, key=lambda x: (-x["count"], x["name"]))
     
     def _extract_brand_model_options(
         self,
@@ -694,10 +1075,7 @@ class QuestionService:
         Returns:
             选项列表
         """
-        from backend.app.utils.hierarchy_util import HierarchyUtil
-        
-        diagrams = [result.diagram for result in results]
-        return HierarchyUtil.extract_options(diagrams, "brand_model", max_options)
+        return HierarchyUtil.extract_options((result.diagram for result in results), "brand_model", max_options)
     
     def _extract_options_from_hierarchy(
         self,
@@ -716,171 +1094,39 @@ class QuestionService:
         Returns:
             选项列表
         """
-        from backend.app.utils.hierarchy_util import HierarchyUtil
-        
-        diagrams = [result.diagram for result in results]
-        option_counts: Dict[str, int] = {}
+        # 选项名 -> 命中的 diagram ids（数量即 len(ids)）
         option_ids: Dict[str, set] = {}
         
         # 从上下文中获取用户意图的品牌（可能是复合品牌）
-        user_brand = None
-        if context and context.get("intent_result"):
-            user_brand = context["intent_result"].get("brand")
-        elif context and context.get("filter_history"):
-            for filter_item in context["filter_history"]:
-                if filter_item.get("type") == "brand":
-                    user_brand = filter_item.get("value")
-                    break
+        user_brand = _user_brand_from_context(context)
         
-        for diagram in diagrams:
-            # 查找品牌在层级路径中的位置（支持复合品牌）
-            brand_pos = -1
-            series_pos = -1
-            
-            # 首先尝试使用用户意图的品牌（可能是复合品牌）
-            if user_brand:
-                # 如果用户品牌是复合品牌（如"东风天龙"），尝试匹配层级路径
-                if user_brand in HierarchyUtil.COMPOUND_BRANDS:
-                    # 提取基础品牌（如"东风"）
-                    base_brand = None
-                    series_keyword = None
-                    if "东风" in user_brand:
-                        base_brand = "东风"
-                        if "天龙" in user_brand:
-                            series_keyword = "天龙"
-                    elif "解放" in user_brand:
-                        base_brand = "解放"
-                    elif "重汽" in user_brand:
-                        base_brand = "重汽"
-                    elif "福田" in user_brand:
-                        base_brand = "福田"
-                    elif "红岩" in user_brand:
-                        base_brand = "红岩"
-                    
-                    # 在层级路径中查找基础品牌
-                    if base_brand:
-                        for i, level in enumerate(diagram.hierarchy_path):
-                            if base_brand in level or level == base_brand:
-                                brand_pos = i
-                                # 如果找到了基础品牌，查找包含系列关键词的层级
-                                if series_keyword:
-                                    for j in range(i + 1, len(diagram.hierarchy_path)):
-                                        if series_keyword in diagram.hierarchy_path[j]:
-                                            series_pos = j
-                                            break
-                                break
-                else:
-                    # 如果不是复合品牌，直接匹配
-                    for i, level in enumerate(diagram.hierarchy_path):
-                        if user_brand in level or level == user_brand:
-                            brand_pos = i
-                            break
-            
-            # 如果没有找到，使用diagram.brand（可能是从层级路径解析出来的）
-            if brand_pos == -1 and diagram.brand:
-                for i, level in enumerate(diagram.hierarchy_path):
-                    if diagram.brand in level or level == diagram.brand:
-                        brand_pos = i
-                        break
-            
-            # 确定要提取的层级位置
-            # 层级路径结构：电路图 -> 类型 -> 品牌 -> 系列层级 -> 具体系列（如天龙KL） -> ...
-            extract_pos = -1
-            if brand_pos != -1:
-                # 查找品牌后面的层级，优先查找包含系列代码的层级
-                # 先查找"系列"相关的层级（如"天龙*系列"或"天龙KL系列"）
-                for i in range(brand_pos + 1, len(diagram.hierarchy_path)):
-                    level = diagram.hierarchy_path[i]
-                    level_clean = level.replace('*', '').strip()
-                    
-                    # 如果层级包含"系列"关键词，优先使用
-                    if "系列" in level_clean:
-                        # 检查当前层级是否包含系列代码（如"天龙KL系列"）
-                        series_match = re.search(r'([A-Z]{2,3})', level_clean)
-                        if series_match:
-                            potential_code = series_match.group(1)
-                            if potential_code not in ['ECU', 'DCI', 'LNG', 'EDC', 'VEC', 'DOC', 'DCM', 'DOCX', 'VECU', 'BCM']:
-                                extract_pos = i
-                                break
-                        # 如果当前层级不包含系列代码，检查下一层
-                        if i + 1 < len(diagram.hierarchy_path):
-                            next_level = diagram.hierarchy_path[i + 1]
-                            next_level_clean = next_level.replace('*', '').strip()
-                            # 如果下一层包含系列代码（如KL、KC等），使用下一层
-                            series_match = re.search(r'([A-Z]{2,3})', next_level_clean)
-                            if series_match:
-                                potential_code = series_match.group(1)
-                                if potential_code not in ['ECU', 'DCI', 'LNG', 'EDC', 'VEC', 'DOC', 'DCM', 'DOCX', 'VECU', 'BCM']:
-                                    extract_pos = i + 1
-                                    break
-                        # 否则使用当前层级
-                        if extract_pos == -1:
-                            extract_pos = i
-                        break
-                    
-                    # 如果层级包含"天龙"且包含系列代码（如"天龙KL"）
-                    if user_brand and "天龙" in user_brand and "天龙" in level_clean:
-                        series_match = re.search(r'([A-Z]{2,3})', level_clean)
-                        if series_match:
-                            potential_code = series_match.group(1)
-                            if potential_code not in ['ECU', 'DCI', 'LNG', 'EDC', 'VEC', 'DOC', 'DCM', 'DOCX', 'VECU', 'BCM']:
-                                extract_pos = i
-                                break
-                
-                # 如果没有找到系列层级，查找品牌后面第一个包含系列代码的层级
-                if extract_pos == -1:
-                    for i in range(brand_pos + 1, len(diagram.hierarchy_path)):
-                        level = diagram.hierarchy_path[i]
-                        level_clean = level.replace('*', '').strip()
-                        # 跳过类型相关的层级
-                        type_keywords = ['电路图', '仪表', 'ECU', '整车', '线路', '针脚', '模块']
-                        if any(keyword in level_clean for keyword in type_keywords):
-                            continue
-                        # 检查是否包含系列代码
-                        series_match = re.search(r'([A-Z]{2,3})', level_clean)
-                        if series_match:
-                            potential_code = series_match.group(1)
-                            if potential_code not in ['ECU', 'DCI', 'LNG', 'EDC', 'VEC', 'DOC', 'DCM', 'DOCX', 'VECU', 'BCM']:
-                                extract_pos = i
-                                break
-                
-                # 如果仍然没有找到，使用品牌后面的第一个非类型层级
-                if extract_pos == -1 and brand_pos + 1 < len(diagram.hierarchy_path):
-                    for i in range(brand_pos + 1, len(diagram.hierarchy_path)):
-                        level = diagram.hierarchy_path[i]
-                        level_clean = level.replace('*', '').strip()
-                        # 跳过类型相关的层级
-                        type_keywords = ['电路图', '仪表', 'ECU', '整车', '线路', '针脚', '模块']
-                        if not any(keyword in level_clean for keyword in type_keywords):
-                            extract_pos = i
-                            break
+        # 用户品牌对应的层级匹配词（复合品牌取基础品牌，如"东风天龙" -> "东风"），对所有结果相同，循环外计算一次
+        brand_needle = None
+        if user_brand:
+            brand_needle = HierarchyUtil.COMPOUND_BRAND_BASES.get(user_brand, user_brand)
+        tianlong = bool(user_brand and "天龙" in user_brand)
+
+        for result in results:
+            diagram = result.diagram
+            # 确定要提取的层级位置（单次扫描，见 _scan_hierarchy）
+            clean_path = diagram.clean_hierarchy
+            extract_pos = _scan_hierarchy(clean_path, brand_needle, diagram.brand, tianlong)
             
             # 提取系列信息
-            if extract_pos != -1 and extract_pos < len(diagram.hierarchy_path):
-                level_value = diagram.hierarchy_path[extract_pos]
-                # 清理层级值（去除特殊字符）
-                level_value_clean = level_value.replace('*', '').strip()
+            if extract_pos != -1 and extract_pos < len(clean_path):
+                # 已清理的层级值（去除特殊字符）
+                level_value_clean = clean_path[extract_pos]
                 
                 # 跳过类型相关的层级
-                type_keywords = ['电路图', '仪表', 'ECU', '整车', '线路', '针脚', '模块']
-                if any(keyword in level_value_clean for keyword in type_keywords):
+                if _TYPE_LEVEL_RE.search(level_value_clean):
                     # 如果层级值包含类型关键词，尝试提取更后面的层级
-                    if extract_pos + 1 < len(diagram.hierarchy_path):
-                        level_value = diagram.hierarchy_path[extract_pos + 1]
-                        level_value_clean = level_value.replace('*', '').strip()
+                    if extract_pos + 1 < len(clean_path):
+                        level_value_clean = clean_path[extract_pos + 1]
                 
                 # 提取系列代码（如KL、KC、VL等）
                 # 尝试从多个来源提取系列信息
                 series_code = None
                 
-                # 定义需要排除的非系列代码关键词（文件扩展名、ECU类型等）
-                excluded_codes = [
-                    'ECU', 'DCI', 'LNG', 'EDC', 'VEC', 'DOC', 'DCM', 
-                    'DOCX', 'VECU', 'BCM', 'PDF', 'XLS', 'XLSX', 'PPT', 'PPTX',
-                    'D31', 'D32', 'D53', 'D56', 'ABS', 'ESP', 'TCS', 'EBD',
-                    'CAN', 'LIN', 'MOST', 'FLEX', 'KWP', 'UDS', 'OBD'
-                ]
-                
                 # 1. 优先从层级值中提取系列代码（如"天龙KL" -> "KL"）
                 if level_value_clean:
                     # 如果层级值包含品牌名称（如"天龙"），提取后面的系列代码
@@ -889,20 +1135,18 @@ class QuestionService:
                         if "天龙" in level_value_clean:
                             after_tianlong = level_value_clean.split("天龙", 1)[1] if "天龙" in level_value_clean else level_value_clean
                             # 提取系列代码（优先匹配2-3个大写字母，如KL、KC、VL）
-                            series_match = re.search(r'([A-Z]{2,3})', after_tianlong)
-                            if series_match:
-                                potential_code = series_match.group(1)
-                                if potential_code not in excluded_codes:
+                            potential_code = _first_series_code(after_tianlong)
+                            if potential_code:
+                                if potential_code not in _EXCLUDED_SERIES_CODES:
                                     series_code = potential_code
                     
                     # 直接查找2-3个大写字母（系列代码，如KL、KC、VL）
                     if not series_code:
                         # 优先匹配2-3个大写字母（系列代码通常是2-3个字母）
-                        series_match = re.search(r'([A-Z]{2,3})', level_value_clean)
-                        if series_match:
-                            potential_code = series_match.group(1)
+                        potential_code = _first_series_code(level_value_clean)
+                        if potential_code:
                             # 排除常见的非系列代码
-                            if potential_code not in excluded_codes:
+                            if potential_code not in _EXCLUDED_SERIES_CODES:
                                 series_code = potential_code
                     
                     # 如果层级值包含"系列"关键词，尝试提取系列名称
@@ -911,10 +1155,9 @@ class QuestionService:
                         series_part = level_value_clean.split("系列")[0].strip()
                         if series_part and len(series_part) <= 10:
                             # 检查是否是系列代码格式（2-3个大写字母）
-                            series_match = re.search(r'([A-Z]{2,3})', series_part)
-                            if series_match:
-                                potential_code = series_match.group(1)
-                                if potential_code not in excluded_codes:
+                            potential_code = _first_series_code(series_part)
+                            if potential_code:
+                                if potential_code not in _EXCLUDED_SERIES_CODES:
                                     series_code = potential_code
                             else:
                                 # 如果不是系列代码格式，使用整个部分
@@ -924,7 +1167,7 @@ class QuestionService:
                 if not series_code and diagram.file_name:
                     file_name = diagram.file_name
                     # 去除文件扩展名（.DOCX、.PDF等）
-                    file_name_without_ext = re.sub(r'\.[A-Z]{2,5}$', '', file_name, flags=re.IGNORECASE)
+                    file_name_without_ext = _FILE_EXT_RE.sub('', file_name)
                     
                     # 查找文件名中的系列代码（如"东风天龙KL..." -> "KL"）
                     # 先查找品牌后面的部分
@@ -939,27 +1182,23 @@ class QuestionService:
                         after_brand = file_name_without_ext.split(brand_in_file, 1)[1] if brand_in_file in file_name_without_ext else file_name_without_ext
                         # 提取2-3个大写字母（系列代码）
                         # 只检查品牌后面的前30个字符，避免提取到文件扩展名或ECU类型
-                        series_match = re.search(r'([A-Z]{2,3})', after_brand[:30])
-                        if series_match:
-                            potential_code = series_match.group(1)
+                        potential_code = _first_series_code(after_brand[:30])
+                        if potential_code:
                             # 排除文件扩展名和ECU类型
-                            if potential_code not in excluded_codes:
+                            if potential_code not in _EXCLUDED_SERIES_CODES:
                                 series_code = potential_code
                 
                 # 3. 如果提取到了系列代码，生成选项
                 if series_code:
                     display_brand = user_brand if user_brand else (diagram.brand or "东风")
                     option_name = f"{display_brand} {series_code} 系列"
-                    option_counts[option_name] = option_counts.get(option_name, 0) + 1
                     option_ids.setdefault(option_name, set()).add(diagram.id)
                 elif level_value_clean and level_value_clean != diagram.brand and len(level_value_clean) <= 15:
                     # 如果没有提取到系列代码，但层级值有意义，使用层级值
                     # 跳过类型相关的层级
-                    type_keywords = ['电路图', '仪表', 'ECU', '整车', '线路', '针脚', '模块']
-                    if not any(keyword in level_value_clean for keyword in type_keywords):
+                    if not _TYPE_LEVEL_RE.search(level_value_clean):
                         display_brand = user_brand if user_brand else (diagram.brand or "东风")
                         option_name = f"{display_brand} {level_value_clean}"
-                        option_counts[option_name] = option_counts.get(option_name, 0) + 1
                         option_ids.setdefault(option_name, set()).add(diagram.id)
         
         # 关键修复：
@@ -967,8 +1206,8 @@ class QuestionService:
         # - 加入 “其他/未分类” 桶，让选项 count 能覆盖上一轮总数（即使被 max_options 截断）
 
         # 先按 count 排序
-        sorted_names = [n for n, _ in sorted(option_counts.items(), key=lambda x: x[1], reverse=True)]
-        total_ids = {d.id for d in diagrams}
+        sorted_names = [n for n, _ in sorted(option_ids.items(), key=lambda x: len(x[1]), reverse=True)]
+        total_ids = {result.diagram.id for result in results}
 
         # 预留一个槽位给 “其他”，保证 sums 闭合
         head_limit = max_options
@@ -980,16 +1219,13 @@ class QuestionService:
         chosen: List[Dict] = []
         used_ids = set()
         for name in chosen_names:
-            ids = set(option_ids.get(name, set()))
-            if not ids:
-                # fallback：没有 ids 记录时使用计数（但尽量不发生）
-                continue
+            ids = option_ids[name]
             used_ids |= ids
             chosen.append({"name": name, "count": len(ids), "ids": sorted(ids)})
 
         remaining_ids = total_ids - used_ids
         if reserve_other and remaining_ids:
-            chosen.append({"name": "其他（未分类/更多）", "count": len(remaining_ids), "ids": sorted(remaining_ids)})
+            chosen.append({"name": _MORE_BUCKET, "count": len(remaining_ids), "ids": sorted(remaining_ids)})
 
         chosen.sort(key=lambda x: x["count"], reverse=True)
         return chosen[:max_options]
@@ -1004,20 +1240,19 @@ class QuestionService:
         车型变体选项：按文件名前缀（车型/用途/轴型/配置等）分组。
         典型场景：用户输入“天龙KL电路图”，希望先在 5 个变体中选一个，再直接给结果。
         """
-        from backend.app.utils.variant_util import variant_key_for_query
-
-        diagrams = [r.diagram for r in results]
         current_query = (context or {}).get("current_query") or ""
 
         counts: Dict[str, int] = {}
-        for d in diagrams:
+        for r in results:
+            d = r.diagram
             k = variant_key_for_query(d.file_name or "", current_query)
             if not k:
                 continue
             counts[k] = counts.get(k, 0) + 1
 
-        options = [{"name": f"{k} 系列", "count": c} for k, c in sorted(counts.items(), key=lambda x: x[1], reverse=True)]
-        return options[:max_options]
+        # 只取前 max_options 个（nlargest 与“稳定降序排序后截取”结果一致）
+        top = heapq.nlargest(max_options, counts.items(), key=lambda x: x[1])
+        return [{"name": f"{k} 系列", "count": c} for k, c in top]
     
     def _extract_series_codes_aggressive(
         self,
@@ -1037,57 +1272,34 @@ class QuestionService:
         Returns:
             选项列表
         """
-        from backend.app.utils.hierarchy_util import HierarchyUtil
-        
-        diagrams = [result.diagram for result in results]
         option_counts = {}
         
         # 从上下文中获取用户意图的品牌
-        user_brand = None
-        if context and context.get("intent_result"):
-            user_brand = context["intent_result"].get("brand")
-        elif context and context.get("filter_history"):
-            for filter_item in context["filter_history"]:
-                if filter_item.get("type") == "brand":
-                    user_brand = filter_item.get("value")
-                    break
-        
-        # 定义需要排除的非系列代码关键词
-        excluded_codes = [
-            'ECU', 'DCI', 'LNG', 'EDC', 'VEC', 'DOC', 'DCM', 
-            'DOCX', 'VECU', 'BCM', 'PDF', 'XLS', 'XLSX', 'PPT', 'PPTX',
-            'D31', 'D32', 'D53', 'D56', 'ABS', 'ESP', 'TCS', 'EBD',
-            'CAN', 'LIN', 'MOST', 'FLEX', 'KWP', 'UDS', 'OBD'
-        ]
+        user_brand = _user_brand_from_context(context)
         
         # 从所有层级路径中提取系列代码
-        for diagram in diagrams:
+        for result in results:
+            diagram = result.diagram
             # 遍历所有层级路径，查找系列代码
-            for level in diagram.hierarchy_path:
-                level_clean = level.replace('*', '').strip()
-                
+            for level_clean in diagram.clean_hierarchy:
                 # 跳过类型相关的层级
-                type_keywords = ['电路图', '仪表', 'ECU', '整车', '线路', '针脚', '模块']
-                if any(keyword in level_clean for keyword in type_keywords):
+                if _TYPE_LEVEL_RE.search(level_clean):
                     continue
                 
                 # 查找系列代码（2-3个大写字母）
-                series_match = re.search(r'([A-Z]{2,3})', level_clean)
-                if series_match:
-                    potential_code = series_match.group(1)
-                    if potential_code not in excluded_codes:
+                potential_code = _first_series_code(level_clean)
+                if potential_code:
+                    if potential_code not in _EXCLUDED_SERIES_CODES:
                         display_brand = user_brand if user_brand else (diagram.brand or "东风")
                         option_name = f"{display_brand} {potential_code} 系列"
                         option_counts[option_name] = option_counts.get(option_name, 0) + 1
                         break  # 找到一个就停止，避免重复
         
-        # 转换为列表并按数量排序
-        options = [
+        # 按数量取前 max_options 个（nlargest 与“稳定降序排序后截取”结果一致）
+        return [
             {"name": name, "count": count}
-            for name, count in sorted(option_counts.items(), key=lambda x: x[1], reverse=True)
+            for name, count in heapq.nlargest(max_options, option_counts.items(), key=lambda x: x[1])
         ]
-        
-        return options[:max_options]
     
     def _extract_series_from_filenames(
         self,
@@ -1109,29 +1321,14 @@ class QuestionService:
         option_counts = {}
         
         # 从上下文中获取用户意图的品牌
-        user_brand = None
-        if context and context.get("intent_result"):
-            user_brand = context["intent_result"].get("brand")
-        elif context and context.get("filter_history"):
-            for filter_item in context["filter_history"]:
-                if filter_item.get("type") == "brand":
-                    user_brand = filter_item.get("value")
-                    break
-        
-        # 定义需要排除的非系列代码关键词
-        excluded_codes = [
-            'ECU', 'DCI', 'LNG', 'EDC', 'VEC', 'DOC', 'DCM', 
-            'DOCX', 'VECU', 'BCM', 'PDF', 'XLS', 'XLSX', 'PPT', 'PPTX',
-            'D31', 'D32', 'D53', 'D56', 'ABS', 'ESP', 'TCS', 'EBD',
-            'CAN', 'LIN', 'MOST', 'FLEX', 'KWP', 'UDS', 'OBD'
-        ]
+        user_brand = _user_brand_from_context(context)
         
         for result in results:
             diagram = result.diagram
             file_name = diagram.file_name
             
             # 去除文件扩展名
-            file_name_without_ext = re.sub(r'\.[A-Z]{2,5}$', '', file_name, flags=re.IGNORECASE)
+            file_name_without_ext = _FILE_EXT_RE.sub('', file_name)
             
             # 确定品牌
             brand_in_file = user_brand if user_brand else (diagram.brand or "东风")
@@ -1140,21 +1337,18 @@ class QuestionService:
             if brand_in_file in file_name_without_ext:
                 after_brand = file_name_without_ext.split(brand_in_file, 1)[1] if brand_in_file in file_name_without_ext else file_name_without_ext
                 # 提取2-3个大写字母（系列代码）
-                series_match = re.search(r'([A-Z]{2,3})', after_brand[:30])
-                if series_match:
-                    potential_code = series_match.group(1)
-                    if potential_code not in excluded_codes:
+                potential_code = _first_series_code(after_brand[:30])
+                if potential_code:
+                    if potential_code not in _EXCLUDED_SERIES_CODES:
                         display_brand = user_brand if user_brand else (diagram.brand or "东风")
                         option_name = f"{display_brand} {potential_code} 系列"
                         option_counts[option_name] = option_counts.get(option_name, 0) + 1
         
-        # 转换为列表并按数量排序
-        options = [
+        # 按数量取前 max_options 个（nlargest 与“稳定降序排序后截取”结果一致）
+        return [
             {"name": name, "count": count}
-            for name, count in sorted(option_counts.items(), key=lambda x: x[1], reverse=True)
+            for name, count in heapq.nlargest(max_options, option_counts.items(), key=lambda x: x[1])
         ]
-        
-        return options[:max_options]
     
     def _extract_document_category_options(
         self,
@@ -1176,9 +1370,6 @@ class QuestionService:
         Returns:
             选项列表，格式：[{"name": "类别名", "count": 数量, "ids": [id列表]}, ...]
         """
-        import re
-        from collections import defaultdict
-        
         category_to_ids: Dict[str, set] = defaultdict(set)
         
         # 从配置文件加载模式
@@ -1192,6 +1383,43 @@ class QuestionService:
         recommended_stop_markers = loader.get_recommended_stop_markers()
         fallback_config = loader.get_fallback_config()
         validation_config = loader.get_validation_config()
+        patterns_config = loader.get_patterns()
+
+        # 配置中的正则与结果无关：循环外预编译一次，循环内直接调用编译后对象的 sub/match/search
+        product_intro_cleanup = [
+            re.compile(p)
+            for p in patterns_config.get("product_intro", {}).get("cleanup_patterns", [r'【\d+】', r'[-_]'])
+        ]
+        recommended_stop_re = None
+        if recommended_prefixes:
+            stop_pattern = '|'.join(re.escape(marker) for marker in recommended_stop_markers)
+            recommended_stop_re = re.compile(rf'^([^{stop_pattern}]+?)(?:{stop_pattern}|\.)')
+        component_pattern = patterns_config.get("component_keywords", {})
+        max_length_after = component_pattern.get("max_length_after_keyword", 10)
+        # (品牌正则, [(条件, 条件值, 后处理正则)])
+        compiled_brand_patterns = []
+        for pattern_config in brand_patterns_config:
+            pattern_regex = pattern_config.get("regex")
+            if not pattern_regex:
+                continue
+            post_rules = [
+                (post_proc.get("condition"), post_proc.get("value"), re.compile(post_proc["regex"]))
+                for post_proc in pattern_config.get("post_processing", [])
+                if post_proc.get("regex")
+            ]
+            compiled_brand_patterns.append((re.compile(pattern_regex), post_rules))
+        brand_common_cleanup = [
+            re.compile(p) for p in patterns_config.get("brand_patterns", {}).get("common_cleanup", [])
+        ]
+        fallback_max_length = fallback_config.get("max_length", 30)
+        fallback_separators = fallback_config.get("separators", ["【", "(", "_", "-"])
+        fallback_cleanup = [
+            re.compile(p) for p in fallback_config.get("cleanup_patterns", [r'[-_]\d+$', r'[-_]诊断指导$'])
+        ]
+        remove_spaces = validation_config.get("remove_spaces", True)
+        strip_chars = validation_config.get("strip_chars", "【】()（）-_")
+        min_length = validation_config.get("min_length", 2)
+        max_length = validation_config.get("max_length", 50)
         
         # 定义常见的文档主题模式
         # 1. 产品/系统名称模式（如"VGT执行器"、"涡轮增压器转速传感器"）
@@ -1221,10 +1449,8 @@ class QuestionService:
                         if parts:
                             category = parts[0].strip()
                             # 清理常见的后缀（从配置中获取）
-                            product_intro_pattern = loader.get_patterns().get("product_intro", {})
-                            cleanup_patterns = product_intro_pattern.get("cleanup_patterns", [r'【\d+】', r'[-_]'])
-                            for pattern in cleanup_patterns:
-                                category = re.sub(pattern, '', category).strip()
+                            for pattern in product_intro_cleanup:
+                                category = pattern.sub('', category).strip()
                         break
             
             # 模式3: 【推荐】品牌+产品模式（如"【推荐】解放动力(锡柴)FAW_52E/91E 【VGT/VNT_...】" -> "【推荐】解放动力(锡柴)FAW_52E/91E"）
@@ -1234,13 +1460,12 @@ class QuestionService:
                         # 提取"【推荐】"后面的部分，直到遇到停止标记或文件扩展名
                         after_prefix = file_name.split(prefix, 1)[1]
                         # 提取到停止标记之前（保留前缀，因为这是重要的标识）
-                        stop_pattern = '|'.join(re.escape(marker) for marker in recommended_stop_markers)
-                        match = re.match(rf'^([^{stop_pattern}]+?)(?:{stop_pattern}|\.)', after_prefix)
+                        match = recommended_stop_re.match(after_prefix)
                         if match:
                             category = prefix + match.group(1).strip()
                         else:
                             # 如果没有找到停止标记，提取到文件扩展名之前
-                            category_name = re.sub(r'\.[A-Z]{2,5}$', '', after_prefix, flags=re.IGNORECASE).strip()
+                            category_name = _FILE_EXT_RE.sub('', after_prefix).strip()
                             # 如果提取的名称太长，尝试在第一个停止标记处截断
                             for marker in recommended_stop_markers:
                                 if marker in category_name:
@@ -1253,8 +1478,6 @@ class QuestionService:
             # 模式4: 传感器/执行器类（如"涡轮增压器转速传感器_诊断指导.DOCX" -> "涡轮增压器转速传感器"）
             # 使用配置化的关键词列表
             if not category:
-                component_pattern = loader.get_patterns().get("component_keywords", {})
-                max_length_after = component_pattern.get("max_length_after_keyword", 10)
                 for keyword in component_keywords:
                     if keyword in file_name:
                         # 找到关键词的位置，提取前面的部分
@@ -1264,8 +1487,8 @@ class QuestionService:
                             end_pos = min(idx + len(keyword) + max_length_after, len(file_name))
                             potential = file_name[:end_pos]
                             # 清理下划线和文件扩展名
-                            potential = re.sub(r'_[^_]*$', '', potential)
-                            potential = re.sub(r'\.[A-Z]{2,5}$', '', potential, flags=re.IGNORECASE)
+                            potential = _TRAILING_SEGMENT_RE.sub('', potential)
+                            potential = _FILE_EXT_RE.sub('', potential)
                             if len(potential) > 3:  # 确保提取到的类别有意义
                                 category = potential.strip()
                                 break
@@ -1275,72 +1498,58 @@ class QuestionService:
             if not category:
                 if any(brand in file_name for brand in brand_list):
                     # 使用配置中的品牌正则表达式模式
-                    for pattern_config in brand_patterns_config:
-                        pattern_regex = pattern_config.get("regex")
-                        if pattern_regex:
-                            match = re.search(pattern_regex, file_name)
-                            if match:
-                                category = match.group(0).strip()
-                                # 清理文件扩展名
-                                category = re.sub(r'\.[A-Z]{2,5}$', '', category, flags=re.IGNORECASE)
-                                
-                                # 应用后处理规则
-                                post_processing = pattern_config.get("post_processing", [])
-                                for post_proc in post_processing:
-                                    condition = post_proc.get("condition")
-                                    condition_value = post_proc.get("value")
-                                    post_regex = post_proc.get("regex")
-                                    
-                                    if condition == "contains" and condition_value and post_regex:
-                                        if condition_value in category:
-                                            match_h = re.match(post_regex, category)
-                                            if match_h:
-                                                category = match_h.group(1)
-                                
-                                # 应用通用清理规则
-                                common_cleanup = loader.get_patterns().get("brand_patterns", {}).get("common_cleanup", [])
-                                for cleanup_pattern in common_cleanup:
-                                    category = re.sub(cleanup_pattern, '', category)
-                                
-                                break
+                    for pattern_re, post_rules in compiled_brand_patterns:
+                        match = pattern_re.search(file_name)
+                        if match:
+                            category = match.group(0).strip()
+                            # 清理文件扩展名
+                            category = _FILE_EXT_RE.sub('', category)
+                            
+                            # 应用后处理规则
+                            for condition, condition_value, post_re in post_rules:
+                                if condition == "contains" and condition_value:
+                                    if condition_value in category:
+                                        match_h = post_re.match(category)
+                                        if match_h:
+                                            category = match_h.group(1)
+                            
+                            # 应用通用清理规则
+                            for cleanup_pattern in brand_common_cleanup:
+                                category = cleanup_pattern.sub('', category)
+                            
+                            break
             
             # 如果还没有提取到类别，使用通用提取机制（fallback）
             if not category:
                 # 去除文件扩展名
-                name_without_ext = re.sub(r'\.[A-Z]{2,5}$', '', file_name, flags=re.IGNORECASE)
-                max_length = fallback_config.get("max_length", 30)
-                separators = fallback_config.get("separators", ["【", "(", "_", "-"])
-                cleanup_patterns = fallback_config.get("cleanup_patterns", [r'[-_]\d+$', r'[-_]诊断指导$'])
+                name_without_ext = _FILE_EXT_RE.sub('', file_name)
                 
                 # 提取前N个字符作为类别（如果文件名较长）
-                if len(name_without_ext) > max_length:
+                if len(name_without_ext) > fallback_max_length:
                     # 尝试在合适的位置截断（优先在分隔符处截断）
-                    for sep in separators:
-                        if sep in name_without_ext[:max_length]:
+                    for sep in fallback_separators:
+                        if sep in name_without_ext[:fallback_max_length]:
                             category = name_without_ext.split(sep)[0].strip()
                             break
                     if not category:
-                        category = name_without_ext[:max_length].strip()
+                        category = name_without_ext[:fallback_max_length].strip()
                 else:
                     # 如果文件名较短，直接使用（但要去除常见的后缀）
                     category = name_without_ext
                     # 去除常见的后缀模式
-                    for cleanup_pattern in cleanup_patterns:
-                        category = re.sub(cleanup_pattern, '', category)
+                    for cleanup_pattern in fallback_cleanup:
+                        category = cleanup_pattern.sub('', category)
             
             # 清理和规范化类别名称（使用配置化的验证规则）
             if category:
                 # 去除多余的空格（如果配置要求）
-                if validation_config.get("remove_spaces", True):
-                    category = re.sub(r'\s+', '', category)
+                if remove_spaces:
+                    category = _WS_RE.sub('', category)
                 
                 # 去除指定的字符
-                strip_chars = validation_config.get("strip_chars", "【】()（）-_")
                 category = category.strip(strip_chars)
                 
                 # 验证长度
-                min_length = validation_config.get("min_length", 2)
-                max_length = validation_config.get("max_length", 50)
                 if min_length <= len(category) <= max_length:
                     category_to_ids[category].add(diagram.id)
         
@@ -1348,10 +1557,11 @@ class QuestionService:
         options = []
         for category, ids in category_to_ids.items():
             if len(ids) > 0:  # 确保至少有一个结果
+                # ids 在合并阶段保持集合，只对最终返回的选项排序
                 options.append({
                     "name": category,
                     "count": len(ids),
-                    "ids": sorted(ids)
+                    "ids": ids
                 })
         
         # 按数量降序排序
@@ -1361,30 +1571,59 @@ class QuestionService:
         if len(options) > max_options * 2:
             # 合并相似的类别（例如都包含"VGT"的类别）
             merged_options = {}
+            # 名称 -> 关键词集合（每个名称只提取一次）
+            keyword_sets: Dict[str, frozenset] = {}
+            # 倒排索引：关键词 -> 含该关键词的已合并类别名。重叠率 > 50% 必然至少共享一个关键词，
+            # 所以只需与共享关键词的类别比较，不必逐一扫描所有已合并类别
+            postings: Dict[str, set] = defaultdict(set)
+            # 类别名在 merged_options 中的插入顺序（改名时 pop 后重新插入会排到最后），
+            # 候选按此顺序比较，与按字典顺序逐一扫描取第一个命中的结果一致
+            key_rank: Dict[str, int] = {}
+            next_rank = 0
             for opt in options:
                 name = opt["name"]
                 merged = False
-                for existing_name in list(merged_options.keys()):
-                    # 检查是否有相似性（包含相同的关键词）
-                    # 提取关键词（去除常见词）
-                    name_keywords = set(re.findall(r'[A-Z]{2,}|[\u4e00-\u9fa5]{2,}', name))
-                    existing_keywords = set(re.findall(r'[A-Z]{2,}|[\u4e00-\u9fa5]{2,}', existing_name))
-                    # 如果有超过50%的关键词重叠，合并
-                    if name_keywords and existing_keywords:
-                        overlap = len(name_keywords & existing_keywords) / len(name_keywords | existing_keywords)
-                        if overlap > 0.5:
-                            # 合并到更长的名称
-                            if len(name) > len(existing_name):
-                                merged_options[name] = merged_options.pop(existing_name)
-                                merged_options[name]["ids"].update(opt["ids"])
-                                merged_options[name]["count"] = len(merged_options[name]["ids"])
-                            else:
-                                merged_options[existing_name]["ids"].update(opt["ids"])
-                                merged_options[existing_name]["count"] = len(merged_options[existing_name]["ids"])
-                            merged = True
-                            break
+                # 检查是否有相似性（包含相同的关键词）
+                # 提取关键词（去除常见词）
+                name_keywords = keyword_sets.get(name)
+                if name_keywords is None:
+                    name_keywords = keyword_sets[name] = frozenset(_KEYWORD_TOKEN_RE.findall(name))
+                candidates = set()
+                for kw in name_keywords:
+                    candidates.update(postings.get(kw, ()))
+                name_kw_len = len(name_keywords)
+                for existing_name in sorted(candidates, key=key_rank.__getitem__):
+                    existing_keywords = keyword_sets[existing_name]
+                    # 重叠率上界为 较小集合大小/较大集合大小：不超过50%时无需求交集
+                    existing_kw_len = len(existing_keywords)
+                    if 2 * min(name_kw_len, existing_kw_len) <= max(name_kw_len, existing_kw_len):
+                        continue
+                    # 如果有超过50%的关键词重叠，合并（交集/并集 > 0.5 即 3*交集 > 两集合大小之和，不必构造并集）
+                    inter = len(name_keywords & existing_keywords)
+                    if 3 * inter > name_kw_len + existing_kw_len:
+                        # 合并到更长的名称
+                        if len(name) > len(existing_name):
+                            merged_options[name] = merged_options.pop(existing_name)
+                            merged_options[name]["ids"].update(opt["ids"])
+                            merged_options[name]["count"] = len(merged_options[name]["ids"])
+                            del key_rank[existing_name]
+                            for kw in existing_keywords:
+                                postings[kw].discard(existing_name)
+                            key_rank[name] = next_rank
+                            next_rank += 1
+                            for kw in name_keywords:
+                                postings[kw].add(name)
+                        else:
+                            merged_options[existing_name]["ids"].update(opt["ids"])
+                            merged_options[existing_name]["count"] = len(merged_options[existing_name]["ids"])
+                        merged = True
+                        break
                 if not merged:
-                    merged_options[name] = {"name": name, "ids": set(opt["ids"]), "count": opt["count"]}
+                    merged_options[name] = {"name": name, "ids": opt["ids"], "count": opt["count"]}
+                    key_rank[name] = next_rank
+                    next_rank += 1
+                    for kw in name_keywords:
+                        postings[kw].add(name)
             
             # 转换回列表格式
             options = []
@@ -1392,16 +1631,19 @@ class QuestionService:
                 options.append({
                     "name": name,
                     "count": data["count"],
-                    "ids": sorted(data["ids"]) if isinstance(data["ids"], set) else data["ids"]
+                    "ids": data["ids"]
                 })
             options.sort(key=lambda x: x["count"], reverse=True)
         
-        return options[:max_options * 2]  # 返回更多选项，让_finalize_options_with_ids处理截断
+        options = options[:max_options * 2]  # 返回更多选项，让_finalize_options_with_ids处理截断
+        for opt in options:
+            opt["ids"] = sorted(opt["ids"])
+        return options
     
     def _merge_filename_prefixes(
         self,
         results: List[ScoredResult],
-        options: List[Dict],
+        options: Iterable[Dict],
         max_options: int = 5
     ) -> Optional[List[Dict]]:
         """
@@ -1416,24 +1658,27 @@ class QuestionService:
         
         Args:
             results: 搜索结果列表
-            options: 选项列表（格式：[{"name": "文件名", "count": 数量, "ids": [id列表]}, ...]）
+            options: 选项列表或按需生成选项的迭代器（格式：[{"name": "文件名", "count": 数量, "ids": [id列表]}, ...]）
             max_options: 最大选项数量
             
         Returns:
             合并后的选项列表，如果无法合并则返回None
         """
-        import re
-        from collections import defaultdict
-        
-        print(f"🔍 _merge_filename_prefixes 被调用: options数量={len(options) if options else 0}")
-        if not options or len(options) < 10:
-            print(f"⚠️ 选项数量不足10，跳过合并: {len(options) if options else 0}")
+        if options is None:
             return None
+        # 列表可以先判断数量；迭代器（如逐条结果生成的文件名选项）在遍历时计数，不必先整体物化
+        if isinstance(options, Sized):
+            logger.debug("🔍 _merge_filename_prefixes 被调用: options数量=%d", len(options))
+            if len(options) < 10:
+                logger.debug("⚠️ 选项数量不足10，跳过合并: %d", len(options))
+                return None
         
         # 获取所有文件名和对应的ids
         name_to_ids = {}
         name_to_count = {}
+        option_count = 0
         for option in options:
+            option_count += 1
             name = option.get("name", "")
             if name:
                 ids = option.get("ids", [])
@@ -1444,31 +1689,32 @@ class QuestionService:
                     # 如果没有ids，从results中查找
                     count = option.get("count", 0)
                     for result in results:
-                        if result.diagram.file_name == name:
-                            name_to_ids.setdefault(name, set()).add(result.diagram.id)
+                        d = result.diagram
+                        if d.file_name == name:
+                            name_to_ids.setdefault(name, set()).add(d.id)
                             name_to_count[name] = count or 1
+        if option_count < 10:
+            logger.debug("⚠️ 选项数量不足10，跳过合并: %d", option_count)
+            return None
         
         file_names = list(name_to_ids.keys())
         if not file_names:
             return None
         
         # 去除文件扩展名
-        def remove_ext(name: str) -> str:
-            return re.sub(r'\.[A-Z]{2,5}$', '', name, flags=re.IGNORECASE)
+        remove_ext = _strip_file_ext
         
         # 规范化文件名用于前缀比较（去除分隔符，但保留字符顺序）
-        def normalize_for_comparison(name: str) -> str:
-            name = remove_ext(name)
-            # 将下划线、连字符、空格等统一去除，但保留字符顺序
-            name = re.sub(r'[_\-\s]+', '', name)
-            return name
+        normalize_for_comparison = _normalize_file_name
+        # 每个文件名只规范化一次：前缀查找与候选对比较按名称直接查表
+        norm_cache: Dict[str, str] = {n: normalize_for_comparison(n) for n in file_names}
         
         # 从左到右查找公共前缀（基于规范化后的名称）
         def find_common_prefix_normalized(names: List[str], min_length: int = 3) -> Optional[str]:
             if not names:
                 return None
             
-            normalized = [normalize_for_comparison(n) for n in names]
+            normalized = [norm_cache[n] for n in names]
             if not normalized:
                 return None
             
@@ -1477,22 +1723,15 @@ class QuestionService:
             if len(shortest) < min_length:
                 return None
             
-            # 从左到右查找公共前缀长度
-            prefix_len = 0
-            for i in range(len(shortest)):
-                char = shortest[i]
-                if all(n[i] == char for n in normalized if i < len(n)):
-                    prefix_len = i + 1
-                else:
-                    break
+            # 公共前缀长度：字典序最小与最大的两个名称的公共前缀即所有名称的公共前缀
+            prefix_len = len(os.path.commonprefix(normalized))
             
             if prefix_len < min_length:
                 return None
             
             # 对于中文+字母+数字的组合（如"柳汽乘龙H7"），确保至少包含一个完整的词
-            # 检查前缀是否包含至少一个中文字符
-            prefix_chars = shortest[:prefix_len]
-            has_chinese = any('\u4e00' <= c <= '\u9fff' for c in prefix_chars)
+            # 检查前缀是否包含至少一个中文字符（前缀是公共的，看第一个名称首个中文字符的位置即可）
+            has_chinese = first_cjk_pos[names[0]] < prefix_len
             if not has_chinese and prefix_len < 5:
                 # 如果没有中文字符且长度较短，可能需要更长的前缀
                 return None
@@ -1500,7 +1739,7 @@ class QuestionService:
             # 将规范化后的前缀映射回原始名称
             # 使用第一个名称，找到对应长度的前缀
             original_name = names[0]
-            normalized_first = normalize_for_comparison(original_name)
+            normalized_first = normalized[0]
             
             # 计算原始名称中对应的前缀位置
             # 由于规范化去除了分隔符，需要找到原始名称中对应字符的位置
@@ -1530,8 +1769,25 @@ class QuestionService:
         merged_groups: Dict[str, List[str]] = defaultdict(list)
         remaining_names = set(file_names)
         
+        # 按规范化名称的前3个字符分桶（即前缀树的第3层）：可合并的名称必须共享至少3个字符的前缀，
+        # 只需在同一桶内两两比较，不必扫描全部剩余名称
+        prefix_buckets: Dict[str, List[str]] = defaultdict(list)
+        for n in file_names:
+            norm = norm_cache[n]
+            if len(norm) >= 3:
+                prefix_buckets[norm[:3]].append(n)
+        # 没有任何两个名称共享前3个字符时不可能合并，跳过排序与分组
+        if all(len(bucket) < 2 for bucket in prefix_buckets.values()):
+            return None
+        
+        # 规范化名称中首个中文字符的位置（只有短于5个字符的前缀才需要检查，只看前5个字符，没有则记为5）
+        first_cjk_pos: Dict[str, int] = {
+            n: next((i for i, c in enumerate(norm[:5]) if '\u4e00' <= c <= '\u9fff'), 5)
+            for n, norm in norm_cache.items()
+        }
+        
         # 按规范化后的长度排序，从长到短处理
-        sorted_names = sorted(file_names, key=lambda x: len(normalize_for_comparison(x)), reverse=True)
+        sorted_names = sorted(file_names, key=lambda x: len(norm_cache[x]), reverse=True)
         
         processed = set()
         for name in sorted_names:
@@ -1541,22 +1797,16 @@ class QuestionService:
             # 查找可以与此名称合并的其他名称
             candidates = [name]
             
-            # 查找其他可以合并的名称
-            for other_name in remaining_names:
+            # 同桶名称已满足“规范化后前3个字符相同且长度>=3”，只需再检查公共前缀是否有效
+            norm_name = norm_cache[name]
+            bucket = prefix_buckets.get(norm_name[:3], ()) if len(norm_name) >= 3 else ()
+            for other_name in bucket:
                 if other_name == name or other_name in processed:
                     continue
                 
                 # 检查是否有足够长的公共前缀
-                common_prefix = find_common_prefix_normalized([name, other_name], min_length=3)
-                if common_prefix:
-                    # 检查规范化后的名称是否共享足够长的前缀
-                    norm_name = normalize_for_comparison(name)
-                    norm_other = normalize_for_comparison(other_name)
-                    min_len = min(len(norm_name), len(norm_other))
-                    if min_len >= 3:
-                        # 检查前3个字符是否相同（降低要求，以便更好地合并）
-                        if norm_name[:min(3, len(norm_name))] == norm_other[:min(3, len(norm_other))]:
-                            candidates.append(other_name)
+                if find_common_prefix_normalized([name, other_name], min_length=3):
+                    candidates.append(other_name)
             
             # 如果找到多个可以合并的名称
             if len(candidates) > 1:
@@ -1587,7 +1837,7 @@ class QuestionService:
                     merged_options.append({
                         "name": group_name,
                         "count": len(all_ids),
-                        "ids": sorted(all_ids)
+                        "ids": all_ids
                     })
             
             # 添加未合并的单独名称
@@ -1598,15 +1848,19 @@ class QuestionService:
                     merged_options.append({
                         "name": remove_ext(name),
                         "count": count,
-                        "ids": sorted(ids)
+                        "ids": ids
                     })
             
             # 按数量降序排序
             merged_options.sort(key=lambda x: x["count"], reverse=True)
             
             # 如果合并后选项数量减少且>=2，返回合并后的选项
-            if len(merged_options) < len(options) and len(merged_options) >= 2:
-                return merged_options[:max_options * 2]  # 返回更多选项，让_finalize_options_with_ids处理
+            if len(merged_options) < option_count and len(merged_options) >= 2:
+                merged_options = merged_options[:max_options * 2]  # 返回更多选项，让_finalize_options_with_ids处理
+                # ids 在合并阶段保持集合，只对最终返回的选项排序
+                for opt in merged_options:
+                    opt["ids"] = sorted(opt["ids"])
+                return merged_options
         
         return None
     
@@ -1628,9 +1882,6 @@ class QuestionService:
         Returns:
             选项列表
         """
-        from backend.app.utils.hierarchy_util import HierarchyUtil
-        
-        diagrams = [result.diagram for result in results]
         option_counts = {}
         
         # 从上下文中获取用户已指定的类型关键词
@@ -1651,7 +1902,8 @@ class QuestionService:
                     break
         
         # 从层级路径和文件名称中提取包含类型关键词的具体类型变体
-        for diagram in diagrams:
+        for result in results:
+            diagram = result.diagram
             # 检查层级路径中的类型信息
             for level in diagram.hierarchy_path:
                 level_lower = level.lower()
@@ -1671,14 +1923,11 @@ class QuestionService:
                 # 这里可以进一步优化，提取文件名称中包含类型关键词的部分
                 pass
         
-        # 转换为列表并按数量排序
-        options = [
+        # 按数量取前 max_options 个（nlargest 与“稳定降序排序后截取”结果一致）
+        return [
             {"name": name, "count": count}
-            for name, count in option_counts.items()
+            for name, count in heapq.nlargest(max_options, option_counts.items(), key=lambda x: x[1])
         ]
-        options.sort(key=lambda x: x["count"], reverse=True)
-        
-        return options[:max_options]
     
     def optimize_options(
         self,
@@ -1703,10 +1952,11 @@ class QuestionService:
             if not s:
                 return ""
             s = str(s).strip()
-            s = re.sub(r"\s+", " ", s)
+            s = _WS_RE.sub(" ", s)
             s = s.replace("  ", " ")
-            # collapse duplicated “系列”
-            s = re.sub(r"(系列)\s*(系列)+", r"\1", s)
+            # collapse duplicated “系列”（不含“系列”时跳过正则）
+            if "系列" in s:
+                s = _DUP_SERIES_RE.sub(r"\1", s)
             return s.strip()
 
         merged_options = {}
@@ -1714,34 +1964,32 @@ class QuestionService:
             name = norm_name(option['name'])
             count = option['count']
             
-            # 检查是否有相似的选项（包含关系）
-            merged = False
-            for existing_name in list(merged_options.keys()):
+            # 检查是否有相似的选项（包含关系）：直接遍历字典找到第一个命中项，
+            # 替换放到循环外进行，不必每个选项都复制一份键列表
+            contained_name = None
+            for existing_name in merged_options:
                 # 如果新选项包含现有选项，合并（保留更具体的）
                 if name in existing_name:
                     # 新选项是现有选项的一部分，不合并
-                    pass
-                elif existing_name in name:
+                    continue
+                if existing_name in name:
                     # 现有选项是新选项的一部分，用新选项替换
-                    merged_options[name] = merged_options.pop(existing_name) + count
-                    merged = True
+                    contained_name = existing_name
                     break
             
-            if not merged:
+            if contained_name is not None:
+                merged_options[name] = merged_options.pop(contained_name) + count
+            else:
                 if name in merged_options:
                     merged_options[name] += count
                 else:
                     merged_options[name] = count
         
-        # 转换为列表并按数量排序
-        optimized = [
+        # 按数量取前 max_options 个（nlargest 与“稳定降序排序后截取”结果一致）
+        return [
             {"name": name, "count": count}
-            for name, count in merged_options.items()
+            for name, count in heapq.nlargest(max_options, merged_options.items(), key=lambda x: x[1])
         ]
-        optimized.sort(key=lambda x: x["count"], reverse=True)
-        
-        # 限制选项数量
-        return optimized[:max_options]
     
     def _generate_question_text(
         self,
@@ -1829,24 +2077,15 @@ class QuestionService:
         Returns:
             格式化的消息文本
         """
-        message = f"{question_data['question']}\n"
-        
-        for option in question_data['options']:
-            # 格式化选项名称，添加"系列"后缀（如果是品牌+型号组合）
-            option_name = option['name']
-            option_type = question_data.get('option_type', '')
-            
-            # 如果是品牌+型号组合，添加"系列"后缀
-            if option_type == "brand_model" and "系列" not in option_name:
-                option_name = f"{option_name} 系列"
-            # 如果是类型选择，保持原样或添加描述
-            elif option_type == "type":
-                # 保持原样，LLM应该已经生成了合适的描述
-                pass
-            
-            message += f"{option['label']}. {option_name}\n"
-        
-        return message
+        opts_key = tuple(
+            (str(option['label']), str(option['name']))
+            for option in question_data['options']
+        )
+        return _fmt_question_cached(
+            str(question_data['question']),
+            question_data.get('option_type', '') or '',
+            opts_key,
+        )
     
     def parse_user_choice(
         self,
@@ -1865,16 +2104,21 @@ class QuestionService:
         """
         user_input = user_input.strip().upper()
         
+        options = question_data['options']
+        
         # 检查是否是选项字母（A/B/C/D/E）
-        if len(user_input) == 1 and user_input in ['A', 'B', 'C', 'D', 'E']:
-            # 找到对应的选项
-            for option in question_data['options']:
+        if len(user_input) == 1 and user_input in 'ABCDE':
+            # 选项按顺序编号，先按位置直接取；标签与位置不一致时再逐一查找
+            idx = ord(user_input) - ord('A')
+            if idx < len(options) and options[idx]['label'] == user_input:
+                return options[idx]['name']
+            for option in options:
                 if option['label'] == user_input:
                     return option['name']
         
         # 检查是否是选项名称（完全匹配或部分匹配）
         user_input_lower = user_input.lower()
-        for option in question_data['options']:
+        for option in options:
             option_name_lower = option['name'].lower()
             if user_input_lower == option_name_lower or user_input_lower in option_name_lower:
                 return option['name']
@@ -1884,12 +2128,15 @@ class QuestionService:
 
 # 全局问题生成服务实例（单例模式）
 _question_service_instance = None
+_question_service_lock = threading.Lock()
 
 
 def get_question_service() -> QuestionService:
-    """获取问题生成服务实例（单例）"""
+    """获取问题生成服务实例（单例，多线程并发首次调用时只创建一个）"""
     global _question_service_instance
     if _question_service_instance is None:
-        _question_service_instance = QuestionService()
+        with _question_service_lock:
+            if _question_service_instance is None:
+                _question_service_instance = QuestionService()
     return _question_service_instance
 
@@ -7,17 +7,15 @@ import jieba
 import re
 import unicodedata
 import json
+import threading
 from pathlib import Path
 from backend.app.models.circuit_diagram import CircuitDiagram
 from backend.app.models.intent import IntentResult
-from backend.app.models.types import ScoredResult, rebuild_scored_result_model
+from backend.app.models.types import ScoredResult
 from backend.app.utils.data_loader import get_data_loader
 from backend.app.utils.hierarchy_util import HierarchyUtil
 from config import config as app_config
 
-# 确保 ScoredResult 模型已重建（解决前向引用问题）
-rebuild_scored_result_model()
-
 
 class SearchService:
     """搜索服务"""
@@ -1438,12 +1436,15 @@ class SearchService:
 
 # 全局搜索服务实例（单例模式）
 _search_service_instance = None
+_search_service_lock = threading.Lock()
 
 
 def get_search_service() -> SearchService:
-    """获取搜索服务实例（单例）"""
+    """获取搜索服务实例（单例，多线程并发首次调用时只创建一个）"""
     global _search_service_instance
     if _search_service_instance is None:
-        _search_service_instance = SearchService()
+        with _search_service_lock:
+            if _search_service_instance is None:
+                _search_service_instance = SearchService()
     return _search_service_instance
 
@@ -6,6 +6,7 @@ import pandas as pd
 from typing import List, Dict
 from pathlib import Path
 import sys
+import threading
 from pathlib import Path
 
 # 添加项目根目录到路径
@@ -168,12 +169,15 @@ class DataLoader:
 
 # 全局数据加载器实例（单例模式）
 _data_loader_instance = None
+_data_loader_lock = threading.Lock()
 
 
 def get_data_loader() -> DataLoader:
-    """获取数据加载器实例（单例）"""
+    """获取数据加载器实例（单例，多线程并发首次调用时只创建一个）"""
     global _data_loader_instance
     if _data_loader_instance is None:
-        _data_loader_instance = DataLoader()
+        with _data_loader_lock:
+            if _data_loader_instance is None:
+                _data_loader_instance = DataLoader()
     return _data_loader_instance
 
@@ -9,6 +9,8 @@
 
 from __future__ import annotations
 
+import heapq
+from collections import Counter
 from dataclasses import dataclass
 from typing import Dict, Iterable, List, Optional, Sequence, Set
 
@@ -36,6 +38,12 @@ class HierarchyUtil:
         "重汽豪汉",
     ]
 
+    # 复合品牌 -> 层级中匹配用的基础品牌（如"东风天龙" -> "东风"）；不含基础品牌的复合品牌映射为 None
+    COMPOUND_BRAND_BASES: Dict[str, Optional[str]] = {
+        cb: next((b for b in ("东风", "解放", "重汽", "福田", "红岩") if b in cb), None)
+        for cb in COMPOUND_BRANDS
+    }
+
     # 常见品牌列表（用于验证/解析）
     COMMON_BRANDS: List[str] = [
         "三一",
@@ -273,7 +281,7 @@ class HierarchyUtil:
 
     @staticmethod
     def extract_options(
-        diagrams: Sequence[CircuitDiagram],
+        diagrams: Iterable[CircuitDiagram],
         option_type: str,
         max_options: int = 5,
     ) -> List[Dict]:
@@ -290,37 +298,28 @@ class HierarchyUtil:
         if max_options <= 0:
             return []
 
-        counts: Dict[str, int] = {}
-
-        def add(name: Optional[str]):
-            n = (name or "").replace("*", "").strip()
-            if not n:
-                return
-            counts[n] = counts.get(n, 0) + 1
-
-        for d in diagrams:
-            if opt == "brand":
-                add(d.brand)
-            elif opt == "model":
-                add(d.model)
-            elif opt in ("type", "diagram_type"):
-                add(d.diagram_type)
-            elif opt in ("category", "vehicle_category"):
-                add(d.vehicle_category)
-            elif opt in ("brand_model", "brand+model"):
+        # 按类型选定取值方式（只判断一次，不在每条记录上重复分支）
+        if opt == "brand":
+            values = (d.brand for d in diagrams)
+        elif opt == "model":
+            values = (d.model for d in diagrams)
+        elif opt in ("type", "diagram_type"):
+            values = (d.diagram_type for d in diagrams)
+        elif opt in ("category", "vehicle_category"):
+            values = (d.vehicle_category for d in diagrams)
+        elif opt in ("brand_model", "brand+model"):
+            def brand_model(d: CircuitDiagram) -> str:
                 b = (d.brand or "").strip()
                 m = (d.model or "").strip()
-                if b and m:
-                    add(f"{b} {m}")
-                elif b:
-                    add(b)
-                elif m:
-                    add(m)
-            else:
-                # 未知类型：返回空，交由上层 fallback 处理
-                return []
-
-        options = [{"name": name, "count": count} for name, count in counts.items() if name]
-        options.sort(key=lambda x: (-x["count"], x["name"]))
-        return options[:max_options]
+                return f"{b} {m}" if b and m else (b or m)
+
+            values = (brand_model(d) for d in diagrams)
+        else:
+            # 未知类型：返回空，交由上层 fallback 处理
+            return []
+
+        counts = Counter(n for n in ((v or "").replace("*", "").strip() for v in values) if n)
+        # 只取前 max_options 个（数量降序、名称升序），无需对全部候选排序
+        top = heapq.nsmallest(max_options, counts.items(), key=lambda kv: (-kv[1], kv[0]))
+        return [{"name": name, "count": count} for name, count in top]
 
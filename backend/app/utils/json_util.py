@@ -0,0 +1,37 @@
+"""
+JSON 序列化工具
+
+优先使用 orjson（如已安装，序列化/反序列化明显快于标准库），否则回退到标准库 json。
+两种实现输出都是紧凑格式、保留中文原文。
+"""
+import json
+from typing import Any, Dict, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson 为可选依赖
+    orjson = None
+
+
+def dumps(obj: Any) -> str:
+    """序列化为 JSON 字符串"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    """
+    反序列化 JSON 字符串/字节串
+
+    Raises:
+        ValueError: 解析失败（orjson.JSONDecodeError / json.JSONDecodeError 均为其子类）
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def drop_none(data: Dict[str, Any]) -> Dict[str, Any]:
+    """去掉值为 None 的键（读取端统一按缺省值处理），减小持久化/传输体积"""
+    return {k: v for k, v in data.items() if v is not None}
@@ -0,0 +1,157 @@
+"""
+多模式关键词匹配工具（Aho–Corasick 自动机）
+
+一次线性扫描找出文本中出现的全部关键词，替代 “for kw in keywords: if kw in text” 的逐个查找。
+- 已安装 pyahocorasick 时使用其 C 实现
+- 否则使用纯 Python 实现（结果一致）
+
+每个关键词可以登记多条 (kind, priority, payload)：
+- kind: 关键词类别（如 brand / diagram_type）
+- priority: 同类别命中多个关键词时取 priority 最小者（通常即原列表中的下标，
+  与原来 “按列表顺序找第一个命中” 的语义保持一致）
+- payload: 命中后返回的值（默认是关键词本身）
+"""
+from collections import deque
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import ahocorasick
+except ImportError:  # pragma: no cover - pyahocorasick 为可选依赖
+    ahocorasick = None
+
+
+# (kind, priority, payload)
+Entry = Tuple[str, int, Any]
+
+
+class KeywordMatcher:
+    """多模式关键词匹配器"""
+
+    def __init__(self, use_native: bool = True):
+        """
+        初始化匹配器
+
+        Args:
+            use_native: 是否优先使用 pyahocorasick（未安装时自动回退纯 Python 实现）
+        """
+        self._entries: Dict[str, List[Entry]] = {}
+        self._use_native = bool(use_native and ahocorasick is not None)
+        self._built = False
+        # pyahocorasick 自动机
+        self._automaton = None
+        # 纯 Python 自动机：goto 表、失败指针、输出表（每个状态结束的关键词）
+        self._goto: List[Dict[str, int]] = []
+        self._fail: List[int] = []
+        self._out: List[List[str]] = []
+
+    def add(self, keyword: str, kind: str, priority: int = 0, payload: Any = None) -> None:
+        """登记关键词"""
+        if not keyword:
+            return
+        self._entries.setdefault(keyword, []).append(
+            (kind, priority, keyword if payload is None else payload)
+        )
+        self._built = False
+
+    def add_many(self, keywords: List[str], kind: str) -> None:
+        """按列表顺序登记一组同类关键词（priority 为列表下标）"""
+        for i, kw in enumerate(keywords):
+            self.add(kw, kind, priority=i)
+
+    def build(self) -> "KeywordMatcher":
+        """构建自动机（add 之后首次匹配前自动调用）"""
+        if self._use_native:
+            automaton = ahocorasick.Automaton()
+            for kw in self._entries:
+                automaton.add_word(kw, kw)
+            if self._entries:
+                automaton.make_automaton()
+            self._automaton = automaton
+        else:
+            self._build_python()
+        self._built = True
+        return self
+
+    def _build_python(self) -> None:
+        goto: List[Dict[str, int]] = [{}]
+        out: List[List[str]] = [[]]
+        for kw in self._entries:
+            node = 0
+            for ch in kw:
+                nxt = goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[node][ch] = nxt
+                    goto.append({})
+                    out.append([])
+                node = nxt
+            out[node].append(kw)
+
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in goto[node].items():
+                queue.append(child)
+                f = fail[node]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[child] = goto[f].get(ch, 0)
+                if out[fail[child]]:
+                    out[child] = out[child] + out[fail[child]]
+
+        self._goto, self._fail, self._out = goto, fail, out
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, str, List[Entry]]]:
+        """
+        扫描文本，逐个返回命中
+
+        Yields:
+            (结束下标, 关键词, 该关键词登记的 entries)
+        """
+        if not text or not self._entries:
+            return
+        if not self._built:
+            self.build()
+
+        if self._use_native:
+            for end, kw in self._automaton.iter(text):
+                yield end, kw, self._entries[kw]
+            return
+
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for kw in out[node]:
+                yield i, kw, self._entries[kw]
+
+    def first_by_kind(self, text: str) -> Dict[str, Any]:
+        """
+        一次扫描，返回每个类别中 priority 最小的命中
+
+        Returns:
+            {kind: payload}（未命中的类别不出现在结果中）
+        """
+        best: Dict[str, Tuple[int, Any]] = {}
+        for _, _, entries in self.iter_matches(text):
+            for kind, priority, payload in entries:
+                cur = best.get(kind)
+                if cur is None or priority < cur[0]:
+                    best[kind] = (priority, payload)
+        return {kind: payload for kind, (_, payload) in best.items()}
+
+    def find_all(self, text: str, kind: Optional[str] = None) -> List[str]:
+        """返回文本中命中的全部关键词（去重，按首次出现的结束位置排序）"""
+        seen = set()
+        found: List[str] = []
+        for _, kw, entries in self.iter_matches(text):
+            if kw in seen:
+                continue
+            if kind is not None and not any(e[0] == kind for e in entries):
+                continue
+            seen.add(kw)
+            found.append(kw)
+        return found
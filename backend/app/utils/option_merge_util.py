@@ -173,15 +173,32 @@ def merge_similar_options(
         if ra != rb:
             parent[rb] = ra
 
+    # Same decision as name_similarity(ni, nj) >= similarity_threshold, but cheaper per pair:
+    # - each name is normalized / counted once, not once per pair
+    # - pairs already in one cluster are skipped (union would be a no-op)
+    # - SequenceMatcher.ratio() <= quick_ratio() == 2*overlap/(len_a+len_b), so the
+    #   order-aware ratio is only computed when the overlap ratio alone does not decide
+    norms = [_norm_for_similarity(nm) if nm else "" for nm in names]
+    counters = [Counter(nm) if nm else None for nm in norms]
+
     for i in range(n):
-        ni = names[i]
+        ni = norms[i]
         if not ni:
             continue
+        ci = counters[i]
         for j in range(i + 1, n):
-            nj = names[j]
+            nj = norms[j]
             if not nj:
                 continue
-            if name_similarity(ni, nj) >= similarity_threshold:
+            if find(i) == find(j):
+                continue
+            inter = sum((ci & counters[j]).values())
+            if float(inter) / float(max(len(ni), len(nj))) >= similarity_threshold:
+                union(i, j)
+                continue
+            if 2.0 * inter / (len(ni) + len(nj)) < similarity_threshold:
+                continue
+            if SequenceMatcher(None, ni, nj).ratio() >= similarity_threshold:
                 union(i, j)
 
     # Build groups by root in first-occurrence order
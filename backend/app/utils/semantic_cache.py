@@ -0,0 +1,89 @@
+"""
+语义缓存（相似问法复用缓存结果）
+
+对查询文本做句向量编码，与已缓存查询做余弦相似度比较，超过阈值即视为命中。
+- 句向量模型使用 sentence-transformers（可选依赖），首次使用时才加载
+- 未安装 sentence-transformers 或模型加载失败时自动停用（只打印一次警告）
+- 向量存放在预分配的矩阵中，写满后按 FIFO 覆盖最早的条目
+"""
+import threading
+from typing import Any, Optional, Tuple
+
+import numpy as np
+
+
+class SemanticCache:
+    """基于句向量相似度的缓存"""
+
+    def __init__(self, model_name: str, threshold: float = 0.92, maxsize: int = 1024):
+        """
+        初始化语义缓存
+
+        Args:
+            model_name: sentence-transformers 模型名称或本地路径
+            threshold: 命中所需的最小余弦相似度
+            maxsize: 最多缓存的条目数
+        """
+        self.model_name = model_name
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.enabled = True
+        self._model = None
+        self._lock = threading.Lock()
+        self._matrix: Optional[np.ndarray] = None  # (maxsize, dim)，行向量已归一化
+        self._values: list = [None] * maxsize
+        self._size = 0
+        self._next = 0  # 下一个写入位置（写满后即最早的条目）
+
+    def _get_model(self):
+        """加载句向量模型（首次调用时加载）"""
+        if self._model is None and self.enabled:
+            with self._lock:
+                if self._model is None and self.enabled:
+                    try:
+                        from sentence_transformers import SentenceTransformer
+
+                        self._model = SentenceTransformer(self.model_name)
+                    except Exception as e:
+                        print(f"⚠️  语义缓存不可用（{e}）：仅使用精确匹配缓存")
+                        self.enabled = False
+        return self._model
+
+    def encode(self, text: str) -> Optional[np.ndarray]:
+        """把文本编码为归一化的句向量（不可用时返回 None）"""
+        model = self._get_model()
+        if model is None:
+            return None
+        vec = model.encode(text, normalize_embeddings=True)
+        return np.asarray(vec, dtype=np.float32)
+
+    def lookup(self, text: str) -> Tuple[Optional[Any], Optional[np.ndarray]]:
+        """
+        查找语义相近的缓存条目
+
+        Returns:
+            (命中的值或 None, 查询向量或 None)；查询向量可传给 add() 避免重复编码
+        """
+        vec = self.encode(text)
+        if vec is None:
+            return None, None
+        with self._lock:
+            if self._size == 0:
+                return None, vec
+            scores = self._matrix[: self._size] @ vec
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold:
+                return self._values[best], vec
+        return None, vec
+
+    def add(self, vec: Optional[np.ndarray], value: Any) -> None:
+        """写入缓存条目（vec 为 lookup() 返回的查询向量）"""
+        if vec is None:
+            return
+        with self._lock:
+            if self._matrix is None:
+                self._matrix = np.zeros((self.maxsize, vec.shape[0]), dtype=np.float32)
+            self._matrix[self._next] = vec
+            self._values[self._next] = value
+            self._next = (self._next + 1) % self.maxsize
+            self._size = min(self._size + 1, self.maxsize)
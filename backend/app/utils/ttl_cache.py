@@ -0,0 +1,158 @@
+"""
+带过期时间的 LRU 缓存
+
+- 进程内：OrderedDict 实现 LRU，超过 maxsize 淘汰最久未使用的条目，超过 ttl 的条目视为未命中
+- 可选 Redis 二级缓存（多 worker 共享）：配置 redis_url 后未命中时读 Redis，写入时 SETEX
+  Redis 不可用时只打印一次警告并退回纯进程内缓存
+- 可选磁盘缓存（diskcache，SQLite 存储）：配置 disk_path 后条目写入本机磁盘，
+  worker 重启/重新部署后仍可命中，同机多个 worker 共享；未安装 diskcache 或读写失败时同样退回进程内缓存
+- 值应为可 JSON 序列化的普通数据（dict/list/str...），由调用方负责还原为对象
+"""
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from backend.app.utils import json_util
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_query_key(query: str) -> str:
+    """查询文本的缓存归一化：去首尾空白、折叠连续空白"""
+    return _WS_RE.sub(" ", (query or "").strip())
+
+
+def make_cache_key(*parts: Any) -> str:
+    """把若干组成部分拼成定长缓存 key（blake2b 摘要）"""
+    raw = "\x1f".join(str(p) for p in parts)
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class TTLCache:
+    """线程安全的 TTL + LRU 缓存"""
+
+    def __init__(
+        self,
+        maxsize: int = 2048,
+        ttl: float = 3600,
+        redis_url: str = "",
+        namespace: str = "cache",
+        disk_path: str = "",
+        disk_size_limit: int = 256 << 20,
+    ):
+        """
+        初始化缓存
+
+        Args:
+            maxsize: 进程内最多缓存的条目数
+            ttl: 过期时间（秒）
+            redis_url: 可选，Redis 连接地址（配置后作为多 worker 共享的二级缓存）
+            namespace: Redis key 前缀
+            disk_path: 可选，磁盘缓存目录（配置后作为跨重启保留的持久缓存）
+            disk_size_limit: 磁盘缓存容量上限（字节），超出后按 LRU 淘汰
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.namespace = namespace
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._redis = None
+        if redis_url:
+            try:
+                import redis
+
+                self._redis = redis.Redis.from_url(redis_url)
+            except ImportError:
+                print(f"⚠️  已配置 REDIS_URL 但未安装 redis 包：{namespace} 缓存仅保存在进程内存中")
+        self._disk = None
+        if disk_path:
+            try:
+                import diskcache
+
+                self._disk = diskcache.Cache(disk_path, size_limit=disk_size_limit, eviction_policy="least-recently-used")
+            except ImportError:
+                print(f"⚠️  已配置磁盘缓存目录但未安装 diskcache 包：{namespace} 缓存不做持久化")
+            except Exception as e:
+                print(f"⚠️  {namespace} 磁盘缓存初始化失败（{e}）：缓存不做持久化")
+
+    def _redis_key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def _disable_redis(self, e: Exception):
+        print(f"⚠️  {self.namespace} 缓存访问 Redis 失败（{e}）：改为仅使用进程内缓存")
+        self._redis = None
+
+    def _disable_disk(self, e: Exception):
+        print(f"⚠️  {self.namespace} 磁盘缓存读写失败（{e}）：改为不做持久化")
+        self._disk = None
+
+    def get(self, key: str) -> Optional[Any]:
+        """读取缓存，未命中或已过期返回 None"""
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                expires_at, value = item
+                if expires_at > now:
+                    self._data.move_to_end(key)
+                    return value
+                del self._data[key]
+
+        raw = self._get_shared(key)
+        if raw is None:
+            return None
+        value = json_util.loads(raw)
+        self._put_local(key, value, now)
+        return value
+
+    def _get_shared(self, key: str) -> Optional[Any]:
+        """依次读取 Redis、磁盘缓存，返回序列化后的原始值"""
+        if self._redis is not None:
+            try:
+                raw = self._redis.get(self._redis_key(key))
+            except Exception as e:
+                self._disable_redis(e)
+            else:
+                if raw is not None:
+                    return raw
+        if self._disk is not None:
+            try:
+                return self._disk.get(key)
+            except Exception as e:
+                self._disable_disk(e)
+        return None
+
+    def set(self, key: str, value: Any) -> None:
+        """写入缓存"""
+        self._put_local(key, value, time.monotonic())
+        if self._redis is None and self._disk is None:
+            return
+        raw = json_util.dumps(value)
+        if self._redis is not None:
+            try:
+                self._redis.setex(self._redis_key(key), int(self.ttl), raw)
+            except Exception as e:
+                self._disable_redis(e)
+        if self._disk is not None:
+            try:
+                self._disk.set(key, raw, expire=self.ttl)
+            except Exception as e:
+                self._disable_disk(e)
+
+    def _put_local(self, key: str, value: Any, now: float) -> None:
+        with self._lock:
+            self._data[key] = (now + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        """清空进程内缓存（不影响 Redis/磁盘中的条目，其按 TTL 自然过期）"""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
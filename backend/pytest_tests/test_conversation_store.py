@@ -0,0 +1,175 @@
+def _mk_result(diagram_id: int):
+    from backend.app.models.circuit_diagram import CircuitDiagram
+    from backend.app.models.types import ScoredResult
+
+    d = CircuitDiagram(
+        id=diagram_id,
+        hierarchy_path=["电路图", "整车电路图", "商用车", "东风", "天龙"],
+        file_name=f"东风_天龙_整车电路图_{diagram_id}.DOCX",
+    )
+    return ScoredResult(diagram=d, score=0.5 + diagram_id)
+
+
+def test_conversation_state_store_roundtrip():
+    """会话状态序列化后应能完整还原（搜索结果通过 id 重新解析）"""
+    import json
+
+    from backend.app.models.conversation import ConversationState, ConversationStateEnum
+    from backend.app.models.intent import IntentResult
+
+    results = [_mk_result(1), _mk_result(2)]
+    by_id = {r.diagram.id: r for r in results}
+
+    st = ConversationState()
+    st.current_query = "东风天龙"
+    st.search_results = list(results)
+    st.intent_result = IntentResult(brand="东风", original_query="东风天龙")
+    st.add_message("user", "东风天龙")
+    st.update_state(ConversationStateEnum.NEEDS_CHOICE)
+    st.current_options = [{"label": "A", "name": "天龙KL", "ids": [1]}]
+    st.option_type = "brand_model"
+    # INITIAL 状态不记录快照，进入 NEEDS_CHOICE 后再保存
+    st.save_state_snapshot()
+
+    raw = json.dumps(st.to_store_dict(), ensure_ascii=False)
+
+    def resolve(pairs):
+        return [by_id[i] for i, _ in pairs if i in by_id]
+
+    restored = ConversationState.from_store_dict(json.loads(raw), resolve)
+
+    assert restored.state == ConversationStateEnum.NEEDS_CHOICE
+    assert [r.diagram.id for r in restored.search_results] == [1, 2]
+    assert restored.intent_result.brand == "东风"
+    assert restored.current_options == st.current_options
+    assert [m.content for m in restored.message_history] == ["东风天龙"]
+    assert restored.can_undo()
+    assert restored.state_history[-1]["state"] == ConversationStateEnum.NEEDS_CHOICE
+    assert restored.state_history[-1]["current_options"] == st.current_options
+
+
+def test_conversation_state_store_dict_omits_none_fields():
+    """持久化字典不写入 None 字段，读取时按缺省值还原"""
+    from backend.app.models.conversation import ConversationState
+    from backend.app.utils import json_util
+
+    data = ConversationState().to_store_dict()
+    assert "option_type" not in data
+    assert "intent_result" not in data
+    assert "relax_meta" not in data
+
+    restored = ConversationState.from_store_dict(json_util.loads(json_util.dumps(data)), lambda pairs: [])
+    assert restored.option_type is None
+    assert restored.intent_result is None
+
+
+def test_session_lock_serializes_requests_of_same_session():
+    """同一会话的请求在 await 处不交错，不同会话互不阻塞"""
+    import asyncio
+
+    from backend.app.models.conversation import ConversationManager
+
+    manager = ConversationManager()
+    events = []
+
+    async def handle(session_id, tag):
+        async with manager.session_lock(session_id):
+            events.append((tag, "start"))
+            await asyncio.sleep(0.01)
+            events.append((tag, "end"))
+
+    async def main():
+        await asyncio.gather(handle("s1", "a"), handle("s1", "b"), handle("s2", "c"))
+
+    asyncio.run(main())
+
+    same_session = [e for e in events if e[0] in ("a", "b")]
+    assert same_session == [("a", "start"), ("a", "end"), ("b", "start"), ("b", "end")]
+    assert events.index(("c", "start")) < events.index(("a", "end"))
+
+
+def test_undo_truncates_messages_without_copying_history():
+    """快照只记录累计消息数：回退时截断之后追加的消息，序列化后的快照不含消息历史"""
+    from backend.app.models.conversation import ConversationState, ConversationStateEnum
+    from backend.app.utils import json_util
+
+    st = ConversationState()
+    st.add_message("user", "东风天龙")
+    st.add_message("assistant", "请选择系列")
+    st.update_state(ConversationStateEnum.NEEDS_CHOICE)
+    st.save_state_snapshot()
+    st.add_message("user", "A")
+    st.add_message("user", "返回上一步")
+
+    data = st.to_store_dict()
+    assert "message_history" not in data["state_history"][-1]
+
+    restored = ConversationState.from_store_dict(json_util.loads(json_util.dumps(data)), lambda pairs: [])
+    for state in (st, restored):
+        assert state.undo_last_step()
+        assert [m.content for m in state.message_history] == ["东风天龙", "请选择系列"]
+
+
+def test_redis_manager_drops_local_state_after_save():
+    """Redis 会话请求结束写回后不再保留进程内状态，下一次读取总是取 Redis 中的最新值"""
+    from collections import OrderedDict
+
+    from backend.app.models.conversation import ConversationManager, RedisConversationManager
+
+    class _Pipe:
+        def __init__(self, store):
+            self.store, self.ops = store, []
+
+        def __getattr__(self, name):
+            return lambda *args: self.ops.append((name, args))
+
+        def execute(self):
+            out = []
+            for name, args in self.ops:
+                if name == "hget":
+                    out.append(self.store.get(args[0]))
+                elif name == "lrange":
+                    out.append(list(self.store.get(args[0], [])))
+                elif name == "hset":
+                    self.store[args[0]] = args[2]
+                elif name == "delete":
+                    self.store.pop(args[0], None)
+                elif name == "rpush":
+                    self.store.setdefault(args[0], []).extend(args[1:])
+            return out
+
+    class _Redis:
+        def __init__(self):
+            self.store = {}
+
+        def pipeline(self, transaction=True):
+            return _Pipe(self.store)
+
+    def make_manager(redis_client):
+        # 跳过 __init__ 中的连接探测，直接使用内存版客户端
+        manager = RedisConversationManager.__new__(RedisConversationManager)
+        ConversationManager.__init__(manager)
+        manager.__dict__.update(
+            _redis=redis_client, ttl_seconds=60, local_cache_size=8,
+            conversations=OrderedDict(), _persisted_msgs={}, _diagram_index={},
+        )
+        return manager
+
+    shared = _Redis()
+    worker_a, worker_b = make_manager(shared), make_manager(shared)
+
+    st = worker_a.get_or_create_state("s1")
+    st.current_query = "东风天龙"
+    st.add_message("user", "东风天龙")
+    worker_a.save_state("s1")
+    assert "s1" not in worker_a.conversations
+
+    # 下一轮落在另一个 worker 上并写入了更新的状态
+    other = worker_b.get_or_create_state("s1")
+    other.current_query = "解放J6"
+    other.add_message("user", "解放J6")
+    worker_b.save_state("s1")
+
+    latest = worker_a.get_or_create_state("s1")
+    assert latest.current_query == "解放J6"
+    assert [m.content for m in latest.message_history] == ["东风天龙", "解放J6"]
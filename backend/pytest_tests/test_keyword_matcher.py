@@ -0,0 +1,28 @@
+from backend.app.utils.keyword_matcher import KeywordMatcher
+
+
+def _first_in_list_order(keywords, text):
+    for kw in keywords:
+        if kw in text:
+            return kw
+    return None
+
+
+def test_first_by_kind_keeps_list_order_priority():
+    """同类别命中多个关键词时，结果与“按列表顺序找第一个命中”一致（不受出现位置影响）"""
+    brands = ["东风", "解放", "东风天龙", "重汽"]
+    types = ["仪表图", "电路图", "ECU电路图"]
+    for use_native in (True, False):
+        m = KeywordMatcher(use_native=use_native)
+        m.add_many(brands, "brand")
+        m.add_many(types, "diagram_type")
+        for text in ["解放J6和东风天龙的ECU电路图", "重汽仪表图", "无关文本", ""]:
+            hits = m.first_by_kind(text)
+            assert hits.get("brand") == _first_in_list_order(brands, text)
+            assert hits.get("diagram_type") == _first_in_list_order(types, text)
+
+
+def test_find_all_returns_overlapping_hits():
+    m = KeywordMatcher(use_native=False)
+    m.add_many(["he", "she", "his", "hers"], "k")
+    assert set(m.find_all("ushers")) == {"she", "he", "hers"}
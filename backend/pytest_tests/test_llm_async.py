@@ -0,0 +1,236 @@
+import asyncio
+import json
+
+
+def _bare_llm_service(**attrs):
+    """不读取真实配置、不初始化缓存的 LLMService，只设置测试需要的属性"""
+    from backend.app.services.llm_service import LLMService
+
+    svc = LLMService.__new__(LLMService)
+    for name, value in attrs.items():
+        setattr(svc, name, value)
+    return svc
+
+
+def test_call_llm_async_joins_sse_chunks(monkeypatch):
+    """异步调用按 SSE 增量片段拼接出完整文本"""
+    import httpx
+    from backend.app.services import llm_service as llm_mod
+
+    chunks = ['{"brand": ', '"东风"}']
+    body = "".join(
+        f"id:{i}\nevent:result\ndata:{json.dumps({'output': {'text': c}}, ensure_ascii=False)}\n\n"
+        for i, c in enumerate(chunks)
+    )
+    seen = {}
+
+    def handler(request):
+        seen["sse"] = request.headers.get("X-DashScope-SSE")
+        return httpx.Response(200, text=body, headers={"content-type": "text/event-stream"})
+
+    svc = _bare_llm_service(enabled=True, api_key="sk-test", model="qwen-test", max_tokens=100, temperature=0.3)
+
+    async def run():
+        monkeypatch.setattr(llm_mod, "_async_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        try:
+            return await svc.call_llm_async("prompt")
+        finally:
+            await llm_mod.close_async_client()
+
+    assert asyncio.run(run()) == '{"brand": "东风"}'
+    assert seen["sse"] == "enable"
+
+
+def test_call_llm_posts_to_rest_endpoint_with_shared_client(monkeypatch):
+    """同步调用直接请求 REST 接口（共享连接池），解析 output.text"""
+    import httpx
+    from backend.app.services import llm_service as llm_mod
+
+    seen = []
+
+    def handler(request):
+        seen.append((request.headers.get("Authorization"), json.loads(request.content)))
+        return httpx.Response(200, json={"output": {"text": '{"brand": "东风"}'}, "request_id": "r1"})
+
+    svc = _bare_llm_service(enabled=True, api_key="sk-test", model="qwen-test", max_tokens=100, temperature=0.3)
+
+    monkeypatch.setattr(llm_mod, "_sync_client", httpx.Client(transport=httpx.MockTransport(handler)))
+    try:
+        assert svc.call_llm("prompt", max_tokens=50) == '{"brand": "东风"}'
+        assert svc.call_llm("prompt") == '{"brand": "东风"}'
+    finally:
+        llm_mod.close_sync_client()
+
+    assert seen[0][0] == "Bearer sk-test"
+    assert seen[0][1]["input"] == {"prompt": "prompt"}
+    assert seen[0][1]["parameters"]["max_tokens"] == 50
+    assert "incremental_output" not in seen[0][1]["parameters"]
+
+
+def test_call_llm_json_async_stops_streaming_once_json_closes():
+    """JSON 对象闭合后立即停止接收；说明文字里的括号不会导致提前结束"""
+    svc = _bare_llm_service()
+    consumed = []
+    closed = []
+
+    def fake_stream(chunks):
+        async def stream_llm(prompt, model=None, max_tokens=None, temperature=None):
+            try:
+                for c in chunks:
+                    consumed.append(c)
+                    yield c
+            finally:
+                closed.append(True)
+        return stream_llm
+
+    svc.stream_llm = fake_stream(['说明{略}：{"brand": "东', '风", "k": "}"', '}', "\n以上是解析结果", "……"])
+    text, data = asyncio.run(svc.call_llm_json_async("prompt"))
+    assert data == {"brand": "东风", "k": "}"}
+    assert svc.parse_json_from_text(text) == data
+    assert len(consumed) == 3 and closed == [True]
+
+    consumed.clear()
+    svc.stream_llm = fake_stream(["没有", "JSON"])
+    assert asyncio.run(svc.call_llm_json_async("prompt")) == ("没有JSON", None)
+    assert len(consumed) == 2
+
+
+def test_parse_intent_caches_successful_llm_results():
+    """相同查询只调用一次 LLM；命中缓存返回的是独立副本"""
+    from backend.app.services.llm_service import LLMService
+
+    svc = LLMService()
+    svc.enabled = True
+    calls = []
+
+    def fake_call_llm(prompt, **kwargs):
+        calls.append(prompt)
+        return '{"brand": "东风", "model": "天龙KL", "diagram_type": null, "keywords": ["仪表"], "confidence": 0.9}'
+
+    svc.call_llm = fake_call_llm
+
+    first = svc.parse_intent("东风天龙KL仪表")
+    first.brand = None  # 调用方修改结果不应影响缓存
+    second = svc.parse_intent("  东风天龙KL仪表 ")
+
+    assert len(calls) == 1
+    assert second.brand == "东风"
+    assert second.model == "天龙KL"
+    assert second.keywords == ["仪表"]
+
+
+def test_parse_intent_async_skips_thread_hop_without_semantic_cache(monkeypatch):
+    """未启用语义缓存时，未命中缓存的请求不经线程池，直接请求 LLM；流式路径解析出的 JSON 直接复用"""
+    from backend.app.services import llm_service as llm_mod
+
+    svc = llm_mod.LLMService()
+    svc.enabled = True
+    svc._semantic_cache = None
+
+    async def no_thread(*args, **kwargs):
+        raise AssertionError("不应切换到线程池")
+
+    async def fake_call_llm_json_async(prompt, **kwargs):
+        data = {"brand": "东风", "model": "天龙KL", "diagram_type": None, "keywords": ["仪表"], "confidence": 0.9}
+        return json.dumps(data, ensure_ascii=False), data
+
+    def no_reparse(text):
+        raise AssertionError("流式路径已解析过 JSON，不应再解析")
+
+    monkeypatch.setattr(llm_mod.asyncio, "to_thread", no_thread)
+    svc.call_llm_json_async = fake_call_llm_json_async
+    svc.parse_json_from_text = no_reparse
+
+    result = asyncio.run(svc.parse_intent_async("东风天龙KL仪表线路"))
+    assert result.brand == "东风"
+    assert result.model == "天龙KL"
+
+
+def test_parse_intent_does_not_cache_failures():
+    from backend.app.services.llm_service import LLMService
+
+    svc = LLMService()
+    svc.enabled = True
+    calls = []
+
+    def failing_call_llm(prompt, **kwargs):
+        calls.append(prompt)
+        raise Exception("timeout")
+
+    svc.call_llm = failing_call_llm
+    assert svc.parse_intent("解放JH6").confidence == 0.0
+    assert svc.parse_intent("解放JH6").confidence == 0.0
+    assert len(calls) == 2
+
+
+def test_generate_question_text_async_cleans_quotes_and_falls_back():
+    """异步问题生成：去掉 LLM 包裹的引号；LLM 失败时回退默认模板"""
+    svc = _bare_llm_service()
+    options = [{"name": "仪表图", "count": 3}, {"name": "整车图", "count": 2}]
+
+    async def ok(prompt, **kwargs):
+        return '"请问您需要哪种类型？"\n'
+
+    async def boom(prompt, **kwargs):
+        raise Exception("timeout")
+
+    svc.call_llm_async = ok
+    assert asyncio.run(svc.generate_question_text_async("type", options, 5)) == "请问您需要哪种类型？"
+
+    svc.call_llm_async = boom
+    text = asyncio.run(svc.generate_question_text_async("type", options, 5))
+    assert text == "找到了 5 个相关结果。请选择您需要的电路图类型："
+
+
+def test_parse_intent_fast_path_skips_llm_for_brand_and_type_only_queries():
+    """查询只有“品牌 [+ 图类型]”时走规则快速路径；还有型号/多个品牌时仍调用 LLM"""
+    from backend.app.services.llm_service import LLMService
+
+    svc = LLMService()
+    svc.enabled = True
+    calls = []
+
+    def fake_call_llm(prompt, **kwargs):
+        calls.append(prompt)
+        return '{"brand": null, "model": null, "diagram_type": null, "keywords": [], "confidence": 0.5}'
+
+    svc.call_llm = fake_call_llm
+
+    fast = svc.parse_intent("东风天龙 的整车电路图")
+    assert (fast.brand, fast.diagram_type, fast.keywords) == ("东风天龙", "整车电路图", [])
+    assert svc.parse_intent("欧曼").brand == "福田欧曼"  # 与 LLM 路径一样做品牌补全
+    assert calls == []
+
+    svc.parse_intent("东风天龙KL仪表图")
+    svc.parse_intent("三一 徐工 电路图")
+    assert len(calls) == 2
+
+
+def test_parse_intents_batches_uncached_queries_into_one_llm_call():
+    """批量解析：快速路径/缓存命中的查询不发给 LLM，其余合并为一次调用，结果按输入顺序对齐"""
+    from backend.app.services.llm_service import LLMService
+
+    svc = LLMService()
+    svc.enabled = True
+    calls = []
+
+    def fake_call_llm(prompt, **kwargs):
+        calls.append(prompt)
+        return (
+            '结果如下：[{"brand": "东风", "model": "天龙KL", "diagram_type": null, "keywords": ["仪表"]},'
+            ' {"brand": "解放", "model": "JH6", "diagram_type": "整车电路图", "keywords": []}]'
+        )
+
+    svc.call_llm = fake_call_llm
+
+    results = svc.parse_intents(["东风天龙KL仪表", "东风天龙", "解放JH6整车电路图", "", "东风天龙KL仪表"])
+
+    assert len(calls) == 1
+    assert "1. 东风天龙KL仪表" in calls[0] and "2. 解放JH6整车电路图" in calls[0]
+    assert [r.model for r in results] == ["天龙KL", None, "JH6", None, "天龙KL"]
+    assert results[1].brand == "东风天龙" and results[2].diagram_type == "整车电路图"
+    assert results[0] is not results[4]
+
+    # 批量结果已写入缓存，单条解析直接命中
+    assert svc.parse_intent("解放JH6整车电路图").model == "JH6"
+    assert len(calls) == 1
@@ -14,5 +14,33 @@ def test_sanitize_diagram_type_drops_unknown_type():
     assert extra == []
 
 
+def test_sanitize_diagram_type_prefers_longest_known_type():
+    # "电路图" 和 "整车电路图" 同时命中时取更长的那个；diagram_type 无效时退回到用户原句中查找
+    dt, _ = LLMService._sanitize_diagram_type("整车电路图", "")
+    assert dt == "整车电路图"
+    dt, _ = LLMService._sanitize_diagram_type("???", "东风天龙整车电路图")
+    assert dt == "整车电路图"
 
 
+def test_parse_json_from_text_handles_wrapped_and_nested_json():
+    svc = LLMService.__new__(LLMService)  # 不需要初始化 API 配置
+    text = '好的，解析结果：{"brand": "东风", "keywords": ["a}b", "c\\"{"], "extra": {"n": {"x": 1}}} 以上。'
+    data = svc.parse_json_from_text(text)
+    assert data["brand"] == "东风"
+    assert data["keywords"] == ["a}b", 'c"{']
+    assert data["extra"]["n"]["x"] == 1
+
+    # 说明文字中有未闭合的括号时，仍能找到后面的 JSON
+    assert svc.parse_json_from_text('说明 { 略 {"brand": "解放"}') == {"brand": "解放"}
+
+
+def test_find_json_spans_single_pass_with_unclosed_braces():
+    from backend.app.services.llm_service import _find_json_spans
+
+    # 未闭合的左括号里直接包含的已闭合片段按顶层返回；嵌套在已闭合片段里的不单独返回
+    text = '{ 说明 {"a": {"b": 1}} 又一个 {"c": 2'
+    assert [text[s:e] for s, e in _find_json_spans(text)] == ['{"a": {"b": 1}}']
+
+    # 截断的流式输出：大量未闭合括号也只扫描一遍
+    text = "{" * 50000 + '{"brand": "东风"}'
+    assert _find_json_spans(text) == [(50000, len(text))]
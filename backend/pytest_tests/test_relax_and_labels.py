@@ -48,3 +48,22 @@ def test_search_and_relax_prefers_drop_generic_keeps_series_code():
     assert "VGT" not in (meta.get("used_keywords") or [])
 
 
+def test_scan_hierarchy_prefers_series_level_after_brand():
+    from backend.app.services.question_service import _scan_hierarchy
+
+    # 品牌后第一个含“系列”的层级不带代码时，下一层带系列代码则用下一层
+    path = ["电路图", "整车电路图", "东风", "ECU电路图", "天龙*系列", "天龙KL"]
+    assert _scan_hierarchy(path, "东风", None, True) == 5
+    # 用户品牌找不到时回退到 diagram.brand；无“系列”层级则取第一个带系列代码的非类型层级
+    path = ["电路图", "解放", "仪表", "J6P", "JH6"]
+    assert _scan_hierarchy(path, "重汽", "解放", False) == 4
+    assert _scan_hierarchy(path, None, None, False) == -1
+
+
+def test_scan_hierarchy_matches_starred_brand_on_clean_levels():
+    from backend.app.services.question_service import _scan_hierarchy
+
+    # 层级已去掉 '*'，diagram.brand 仍带 '*'（如"杰狮*通用"）时也应定位到品牌层
+    path = ["电路图", "整车电路图", "杰狮通用", "仪表", "C500"]
+    assert _scan_hierarchy(path, None, "杰狮*通用", False) == 4
+    assert _scan_hierarchy(path, "杰狮*通用", None, False) == 4
@@ -205,6 +205,162 @@ def test_variant_grouping_for_ecu_code_query(monkeypatch):
     }
 
 
+def test_generate_question_reuses_cached_question(monkeypatch):
+    """相同候选集 + 相同上下文再次生成问题时直接复用缓存；返回的是副本，调用方修改不影响缓存。"""
+    diagrams = [
+        _mk_diagram(1, "福田奥铃_493_整车电路图【EDC17C81】【国五】.DOCX"),
+        _mk_diagram(2, "江淮_瑞风M5_整车电路图【EDC17C81】【2012款】.DOCX"),
+        _mk_diagram(3, "东风_凯普特D28_国四_整车电路图【EDC17C81】.DOCX"),
+    ]
+    fake_svc = SearchService(data_loader=_FakeLoader(diagrams))
+
+    import backend.app.services.search_service as search_service_mod
+    import backend.app.services.question_service as question_service_mod
+
+    monkeypatch.setattr(search_service_mod, "get_search_service", lambda: fake_svc)
+    monkeypatch.setattr(question_service_mod, "get_search_service", lambda: fake_svc)
+
+    qs = QuestionService()
+    scored = [ScoredResult(diagram=d, score=1.0) for d in diagrams]
+    kwargs = dict(min_options=2, max_options=5, excluded_types=None, context={"current_query": "C81电路图"}, use_llm=False)
+
+    first = qs.generate_question(results=scored, **kwargs)
+    assert first is not None
+    expected = {o["name"]: o["count"] for o in first["options"]}
+    first["options"].clear()
+
+    calls = []
+    monkeypatch.setattr(qs, "_generate_question_uncached", lambda *a, **k: calls.append(a))
+    second = qs.generate_question(results=list(reversed(scored)), **kwargs)
+    assert not calls
+    assert {o["name"]: o["count"] for o in second["options"]} == expected
+
+    # 上下文不同（已有筛选条件）不会命中
+    qs.generate_question(results=scored, **{**kwargs, "context": {"current_query": "C81电路图", "filter_history": [{"type": "brand", "value": "福田"}]}})
+    assert len(calls) == 1
+
+
+def test_generate_question_cache_keys_intent_model_and_skips_llm_fallback(monkeypatch):
+    """意图型号参与首轮问题文本，不同型号不共用缓存；LLM 失败回退到默认模板的问题不写入缓存。"""
+    diagrams = [
+        _mk_diagram(i, f"东风天龙_{series}_整车电路图.DOCX")
+        for i, series in enumerate(["KL", "VL", "KC", "KL", "VL"], 1)
+    ]
+    fake_svc = SearchService(data_loader=_FakeLoader(diagrams))
+
+    import backend.app.services.search_service as search_service_mod
+    import backend.app.services.question_service as question_service_mod
+
+    monkeypatch.setattr(search_service_mod, "get_search_service", lambda: fake_svc)
+    monkeypatch.setattr(question_service_mod, "get_search_service", lambda: fake_svc)
+
+    qs = QuestionService()
+    scored = [ScoredResult(diagram=d, score=1.0) for d in diagrams]
+
+    def ctx(model):
+        return {"current_query": "电路图", "intent_result": {"brand": "东风", "model": model}}
+
+    kwargs = dict(min_options=2, max_options=5, excluded_types=None)
+    with_model = qs.generate_question(results=scored, context=ctx("天龙"), use_llm=False, **kwargs)
+    without_model = qs.generate_question(results=scored, context=ctx(None), use_llm=False, **kwargs)
+    assert "东风天龙" in with_model["question"]
+    assert "东风天龙" not in without_model["question"]
+
+    uncached = qs._generate_question_uncached
+    calls = []
+    monkeypatch.setattr(qs, "_generate_question_uncached", lambda *a, **k: calls.append(a) or uncached(*a, **k))
+
+    def failing_llm(**kwargs):
+        raise RuntimeError("timeout")
+
+    monkeypatch.setattr(qs.llm_service, "enabled", True)
+    monkeypatch.setattr(qs.llm_service, "generate_question_text", failing_llm)
+    first = qs.generate_question(results=scored, context=ctx("天龙"), use_llm=True, **kwargs)
+    second = qs.generate_question(results=scored, context=ctx("天龙"), use_llm=True, **kwargs)
+    assert first is not None and "_llm_fallback" not in first
+    assert second == first
+    assert len(calls) == 2
+    # 非首轮不做首轮口径改写：回退文案与 generate_question_text 自带的默认模板一致
+    later = qs.generate_question(
+        results=scored,
+        context=dict(ctx("天龙"), filter_history=[{"type": "brand", "value": "东风"}]),
+        use_llm=True,
+        **kwargs,
+    )
+    assert later["question"].startswith(f"找到了 {len(scored)} 个相关结果。请选择您需要的")
+
+
+def test_generate_question_skips_document_category_when_no_dimension_left(monkeypatch):
+    """所有可问维度及文档主题分类都已排除时直接返回 None，不再做文档主题分类等较重的提取。"""
+    diagrams = [_mk_diagram(i, f"VGT执行器{i}_诊断指导.DOCX") for i in range(1, 9)]
+    fake_svc = SearchService(data_loader=_FakeLoader(diagrams))
+
+    import backend.app.services.question_service as question_service_mod
+
+    monkeypatch.setattr(question_service_mod, "get_search_service", lambda: fake_svc)
+
+    qs = QuestionService()
+    calls = []
+    monkeypatch.setattr(qs, "_extract_document_category_options", lambda *a, **k: calls.append(a) or [])
+    qd = qs.generate_question(
+        results=[ScoredResult(diagram=d, score=1.0) for d in diagrams],
+        min_options=2,
+        max_options=5,
+        excluded_types=["brand_model", "brand", "config", "model", "type", "category", "document_category"],
+        context={"current_query": "VGT执行器"},
+        use_llm=False,
+    )
+    assert qd is None
+    assert not calls
+
+
+def test_generate_question_keeps_document_category_when_dimensions_exhausted(monkeypatch):
+    """结构化维度都已选过时，结果仍足够多则照常按文档主题分类追问。"""
+    components = ["VGT执行器", "EGR阀", "涡轮增压器转速传感器"]
+    diagrams = [_mk_diagram(i, f"{components[i % 3]}{i}_诊断指导.DOCX") for i in range(9)]
+    fake_svc = SearchService(data_loader=_FakeLoader(diagrams))
+
+    import backend.app.services.question_service as question_service_mod
+
+    monkeypatch.setattr(question_service_mod, "get_search_service", lambda: fake_svc)
+
+    qs = QuestionService()
+    qd = qs.generate_question(
+        results=[ScoredResult(diagram=d, score=1.0) for d in diagrams],
+        min_options=2,
+        max_options=5,
+        excluded_types=["brand", "type", "brand_model", "config"],
+        context={
+            "current_query": "诊断指导",
+            "filter_history": [
+                {"type": "brand", "value": "东风"},
+                {"type": "type", "value": "电路图"},
+                {"type": "brand_model", "value": "天龙"},
+            ],
+        },
+        use_llm=False,
+    )
+    assert qd is not None
+    assert qd["option_type"] in ("document_category", "filename_prefix")
+
+
+def test_merge_filename_prefixes_accepts_option_generator(monkeypatch):
+    """文件名选项可按需逐条生成：与传入列表的合并结果一致，ids 为排序后的列表。"""
+    import backend.app.services.question_service as question_service_mod
+
+    monkeypatch.setattr(question_service_mod, "get_search_service", lambda: SearchService(data_loader=_FakeLoader([])))
+
+    names = [f"柳汽乘龙H7_{i}号线路图.DOCX" for i in range(6)] + [f"东风天龙KL_{i}号线路图.DOCX" for i in range(6)]
+    options = [{"name": n, "count": 2, "ids": [2 * i + 1, 2 * i]} for i, n in enumerate(names)]
+
+    qs = QuestionService()
+    from_list = qs._merge_filename_prefixes([], options, max_options=5)
+    from_gen = qs._merge_filename_prefixes([], (o for o in options), max_options=5)
+
+    assert from_list and from_gen == from_list
+    assert all(o["ids"] == sorted(o["ids"]) for o in from_gen)
+
+
 def test_extract_keywords_splits_guo_emission_and_howoqi():
     svc = SearchService(data_loader=_FakeLoader([]))
     kws = svc._extract_keywords("重汽豪沃国六电路图")
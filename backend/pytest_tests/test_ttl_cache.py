@@ -0,0 +1,76 @@
+from backend.app.utils.ttl_cache import TTLCache, make_cache_key, normalize_query_key
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    c = TTLCache(maxsize=2, ttl=60)
+    c.set("a", 1)
+    c.set("b", 2)
+    assert c.get("a") == 1  # a 变为最近使用
+    c.set("c", 3)
+    assert c.get("b") is None
+    assert c.get("a") == 1 and c.get("c") == 3
+
+
+def test_ttl_cache_expires_entries(monkeypatch):
+    import backend.app.utils.ttl_cache as ttl_cache
+
+    now = [100.0]
+    monkeypatch.setattr(ttl_cache.time, "monotonic", lambda: now[0])
+    c = TTLCache(maxsize=10, ttl=5)
+    c.set("k", {"brand": "东风"})
+    now[0] += 4
+    assert c.get("k") == {"brand": "东风"}
+    now[0] += 2
+    assert c.get("k") is None
+
+
+def test_query_key_normalization():
+    assert normalize_query_key("  东风天龙   仪表图 ") == "东风天龙 仪表图"
+    assert make_cache_key("llm", "东风天龙") == make_cache_key("llm", "东风天龙")
+    assert make_cache_key("llm", "东风天龙") != make_cache_key("rules", "东风天龙")
+
+
+def test_semantic_cache_hits_similar_queries_and_evicts_fifo():
+    import numpy as np
+    from backend.app.utils.semantic_cache import SemanticCache
+
+    vectors = {
+        "天龙仪表图": [1.0, 0.0, 0.0],
+        "东风天龙的仪表电路图": [0.96, 0.28, 0.0],
+        "解放JH6整车图": [0.0, 1.0, 0.0],
+        "重汽豪沃ECU": [0.0, 0.0, 1.0],
+    }
+
+    class FakeModel:
+        def encode(self, text, normalize_embeddings=True):
+            return np.asarray(vectors[text], dtype=np.float32)
+
+    cache = SemanticCache("fake", threshold=0.9, maxsize=2)
+    cache._model = FakeModel()
+
+    hit, vec = cache.lookup("天龙仪表图")
+    assert hit is None
+    cache.add(vec, {"brand": "东风天龙"})
+
+    hit, _ = cache.lookup("东风天龙的仪表电路图")
+    assert hit == {"brand": "东风天龙"}
+    assert cache.lookup("解放JH6整车图")[0] is None
+
+    # 容量为 2：再写入两条后最早的条目被覆盖
+    cache.add(cache.lookup("解放JH6整车图")[1], {"brand": "一汽解放"})
+    cache.add(cache.lookup("重汽豪沃ECU")[1], {"brand": "中国重汽"})
+    assert cache.lookup("天龙仪表图")[0] is None
+    assert cache.lookup("解放JH6整车图")[0] == {"brand": "一汽解放"}
+
+
+def test_ttl_cache_persists_to_disk_across_instances(tmp_path):
+    """配置磁盘目录后，新实例（模拟 worker 重启）仍能读到之前写入的条目"""
+    import pytest
+
+    pytest.importorskip("diskcache")
+    c = TTLCache(maxsize=10, ttl=60, disk_path=str(tmp_path))
+    c.set("k", {"brand": "东风", "keywords": ["仪表"]})
+
+    restarted = TTLCache(maxsize=10, ttl=60, disk_path=str(tmp_path))
+    assert restarted.get("k") == {"brand": "东风", "keywords": ["仪表"]}
+    assert restarted.get("missing") is None
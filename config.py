@@ -18,6 +18,13 @@ class Config:
     # 使用最新的 Qwen-Plus 版本（2025-07-28），支持1M上下文，阶梯计费
     ALI_QWEN_MODEL = os.getenv('ALI_QWEN_MODEL', 'qwen-plus-2025-07-28')  # 最新版本
     
+    # DashScope REST 接口（同步调用与异步流式调用共用）与 LLM 请求超时（秒）
+    DASHSCOPE_API_URL = os.getenv(
+        'DASHSCOPE_API_URL',
+        'https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation'
+    )
+    LLM_TIMEOUT_SECONDS = float(os.getenv('LLM_TIMEOUT_SECONDS', 30))
+    
     # 后端服务配置
     BACKEND_HOST = os.getenv('BACKEND_HOST', '0.0.0.0')
     BACKEND_PORT = int(os.getenv('BACKEND_PORT', 8000))
@@ -39,6 +46,28 @@ class Config:
     MAX_SEARCH_RESULTS = int(os.getenv('MAX_SEARCH_RESULTS', 20))  # 最大搜索结果数
     MAX_FINAL_RESULTS = int(os.getenv('MAX_FINAL_RESULTS', 5))  # 最终返回的最大结果数
     
+    # 会话存储配置
+    # 配置 REDIS_URL 后会话状态保存在 Redis（多 worker 共享、自动过期）；否则保存在进程内存
+    REDIS_URL = os.getenv('REDIS_URL', '')
+    SESSION_TTL_SECONDS = int(os.getenv('SESSION_TTL_SECONDS', 3600))  # 会话过期时间（秒）
+    
+    # 意图理解结果缓存（相同查询直接复用解析结果；配置了 REDIS_URL 时多 worker 共享）
+    INTENT_CACHE_SIZE = int(os.getenv('INTENT_CACHE_SIZE', 2048))  # 进程内最多缓存的查询数
+    INTENT_CACHE_TTL_SECONDS = int(os.getenv('INTENT_CACHE_TTL_SECONDS', 3600))  # 过期时间（秒）
+    # 可选磁盘持久化（需要 diskcache）：配置目录后缓存跨 worker 重启保留、同机 worker 共享
+    INTENT_CACHE_DIR = os.getenv('INTENT_CACHE_DIR', '')
+    INTENT_CACHE_DISK_SIZE_MB = int(os.getenv('INTENT_CACHE_DISK_SIZE_MB', 256))  # 磁盘缓存容量上限（MB）
+    
+    # 语义缓存（可选，需要 sentence-transformers）：相似问法（如“天龙仪表图”/“东风天龙的仪表电路图”）复用意图结果
+    SEMANTIC_CACHE_ENABLED = os.getenv('SEMANTIC_CACHE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    SEMANTIC_CACHE_MODEL = os.getenv('SEMANTIC_CACHE_MODEL', 'paraphrase-multilingual-MiniLM-L12-v2')
+    SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.92))  # 命中所需的最小余弦相似度
+    SEMANTIC_CACHE_SIZE = int(os.getenv('SEMANTIC_CACHE_SIZE', 1024))
+    
+    # 问题缓存（相同候选集与上下文复用已生成的选择题，仅进程内）
+    QUESTION_CACHE_SIZE = int(os.getenv('QUESTION_CACHE_SIZE', 256))
+    QUESTION_CACHE_TTL_SECONDS = int(os.getenv('QUESTION_CACHE_TTL_SECONDS', 600))  # 过期时间（秒）
+    
     # 选择题配置
     MIN_CHOICES = int(os.getenv('MIN_CHOICES', 3))  # 最少选项数
     MAX_CHOICES = int(os.getenv('MAX_CHOICES', 5))  # 最多选项数